@@ -0,0 +1,286 @@
+"""Local JSON API for the SQLite recipe book, so many users can be served at once.
+
+An asyncio HTTP/1.1 server (standard library only) in front of db_recipes.RecipeBook. The
+event loop only parses requests and writes responses; every SQLite call runs on a bounded
+thread pool, each thread with its own connection from database.get_connection.
+
+    POST   /register            {"username": ..., "password": ...}
+    POST   /login               {"username": ..., "password": ...}  -> {"token": ...}
+    POST   /logout
+    GET    /recipes?after_id=0&limit=10                            -> {"recipes": [...], "next_after_id": ...}
+    POST   /recipes             {"Meal Category": ..., "Dish Name": ..., ...}
+    GET    /recipes/<id>
+    PATCH  /recipes/<id>        any of the recipe fields
+    DELETE /recipes/<id>
+    GET    /search?q=...&limit=10&offset=0
+
+Everything except register and login needs an "Authorization: Bearer <token>" header.
+
+Recipe writes from every session go through one write_queue.WriteQueue, which commits the
+writes that arrive within --max-delay seconds of each other in a single transaction. A write
+is answered once it has committed; with --durable, once that commit has been synced to disk.
+
+With --shards N, users are spread over N database files (shards.py), each with its own write
+queue. If N differs from the last run, users move to their new shards in the background while
+the server keeps answering.
+
+    python api_server.py --port 8080 --workers 8
+    python api_server.py --shards 4
+"""
+import asyncio
+import json
+import secrets
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from config import SHARD_DIR
+from db_recipes import Recipe, RecipeBook, User, ensure_database
+from shards import ShardCatalog
+from write_queue import MAX_BATCH, MAX_DELAY, WriteQueue
+
+WORKERS = 8
+MAX_BODY = 1 << 20
+MAX_PAGE = 100
+TOKEN_TTL = 12 * 60 * 60  # seconds a login token stays valid
+
+# Recipe fields in requests and responses (the same names as CSV and JSONL files) -> columns
+COLUMNS = {"Meal Category": "category", "Dish Name": "name", "Ingredients": "ingredients", "Cooking Directions": "directions"}
+REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+           404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+###### Recipe API ######
+class RecipeApi:
+    """Routes requests to RecipeBook methods, running them on the SQLite thread pool"""
+
+    def __init__(self, db_file=None, workers=WORKERS, write_queue=None, shards=None):
+        self.db_file = db_file
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sqlite")
+        self.write_queue = write_queue
+        self.shards = shards  # a shards.ShardCatalog in sharded mode, used instead of db_file and write_queue
+        self.tokens = {}  # token -> (username, expiry time)
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+
+    def book(self, username):
+        if self.shards is not None:
+            return RecipeBook(username, shards=self.shards)
+        return RecipeBook(username, db_file=self.db_file, write_queue=self.write_queue)
+
+    def create_user(self, username, password):
+        if self.shards is not None:
+            return self.shards.create_user(username, password)
+        return User.create(username, password, self.db_file)
+
+    def authenticate(self, username, password):
+        if self.shards is not None:
+            return self.shards.authenticate(username, password)
+        return User.authenticate(username, password, self.db_file)
+
+    def username(self, headers):
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        session = self.tokens.get(token) if scheme.lower() == "bearer" else None
+        if session is None or session[1] < time.monotonic():
+            self.tokens.pop(token, None)
+            raise ApiError(401, "Log in first")
+        return session[0]
+
+    async def handle(self, method, target, headers, body):
+        """Return (status, JSON-serialisable payload) for one request"""
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        data = json.loads(body) if body else {}
+        if not isinstance(data, dict):
+            raise ApiError(400, "The request body must be a JSON object")
+
+        if parts == ["register"] and method == "POST":
+            username, password = credentials(data)
+            try:
+                await self.call(self.create_user, username, password)
+            except ValueError as error:
+                raise ApiError(409, str(error))
+            return 201, {"username": username}
+        if parts == ["login"] and method == "POST":
+            username, password = credentials(data)
+            if not await self.call(self.authenticate, username, password):
+                raise ApiError(401, "Invalid username or password")
+            token = secrets.token_urlsafe(24)
+            self.tokens[token] = (username, time.monotonic() + TOKEN_TTL)
+            return 200, {"token": token}
+        if parts == ["logout"] and method == "POST":
+            self.username(headers)
+            self.tokens.pop(headers["authorization"].partition(" ")[2], None)
+            return 204, None
+
+        username = self.username(headers)
+        if parts == ["recipes"] and method == "GET":
+            after_id, limit = integer(query, "after_id", 0), page_limit(query)
+            recipes = await self.call(lambda: self.book(username).fetch_page(after_id, limit))
+            next_after_id = recipes[-1]["Recipe ID"] if recipes and len(recipes) == limit else None
+            return 200, {"recipes": recipes, "next_after_id": next_after_id}
+        if parts == ["recipes"] and method == "POST":
+            recipe = Recipe.from_dict({field: str(data.get(field, "")) for field in COLUMNS})
+            recipe_id = await self.call(lambda: self.book(username).insert_recipe(recipe))
+            return 201, {"Recipe ID": recipe_id, **recipe.to_dict()}
+        if parts == ["search"] and method == "GET":
+            limit, offset = page_limit(query), integer(query, "offset", 0)
+            results = await self.call(lambda: self.book(username).search(query.get("q", ""), limit, offset))
+            return 200, {"results": results}
+        if len(parts) == 2 and parts[0] == "recipes":
+            try:
+                recipe_id = int(parts[1])
+            except ValueError:
+                raise ApiError(404, "No such recipe")
+            if method == "GET":
+                return 200, await self.call(lambda: self.find(username, recipe_id))
+            if method == "PATCH":
+                changes = {COLUMNS[field]: str(value) for field, value in data.items() if field in COLUMNS}
+                return 200, await self.call(lambda: self.edit(username, recipe_id, changes))
+            if method == "DELETE":
+                await self.call(lambda: self.delete(username, recipe_id))
+                return 204, None
+            raise ApiError(405, f"{method} is not allowed here")
+        raise ApiError(404, "Not found")
+
+    # These run on the thread pool
+    def find(self, username, recipe_id):
+        recipe = self.book(username).get_recipe(recipe_id)
+        if recipe is None:
+            raise ApiError(404, "No such recipe")
+        return recipe
+
+    def edit(self, username, recipe_id, changes):
+        book = self.book(username)
+        if not book.update_recipe(recipe_id, **changes):
+            raise ApiError(404, "No such recipe")
+        return book.get_recipe(recipe_id)
+
+    def delete(self, username, recipe_id):
+        if not self.book(username).delete_recipe(recipe_id):
+            raise ApiError(404, "No such recipe")
+
+
+def credentials(data):
+    username, password = str(data.get("username", "")).lower().strip(), str(data.get("password", ""))
+    if not username or not password:
+        raise ApiError(400, "username and password are required")
+    return username, password
+
+
+def integer(query, name, default):
+    try:
+        return max(0, int(query.get(name, default)))
+    except ValueError:
+        raise ApiError(400, f"{name} must be a whole number")
+
+
+def page_limit(query):
+    limit = integer(query, "limit", 10)
+    if limit < 1:
+        raise ApiError(400, "limit must be at least 1")
+    return min(limit, MAX_PAGE)
+
+
+###### HTTP ######
+async def read_request(reader):
+    """Read one request; returns None when the client has closed the connection"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise ApiError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def response(status, payload, keep_alive):
+    body = b"" if payload is None else json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + body
+
+
+async def serve_connection(api, reader, writer):
+    """Answer requests on one connection until the client closes it (HTTP/1.1 keep-alive)"""
+    try:
+        while True:
+            keep_alive = False
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await api.handle(method, target, headers, body)
+            except ApiError as error:
+                status, payload = error.status, {"error": str(error)}
+            except (ValueError, UnicodeDecodeError, asyncio.LimitOverrunError):
+                status, payload = 400, {"error": "Malformed request"}
+            except Exception:  # answer rather than drop the connection, but keep the details on the server
+                traceback.print_exc()
+                status, payload = 500, {"error": "Internal Server Error"}
+            writer.write(response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=8080, db_file=None, workers=WORKERS,
+                max_batch=MAX_BATCH, max_delay=MAX_DELAY, durable=False, shards=None, shard_dir=SHARD_DIR):
+    if shards:
+        catalog = ShardCatalog(shard_dir)
+        catalog.resize(shards)  # migrates every shard, before any worker thread touches one
+        catalog.start_write_queues(max_batch=max_batch, max_delay=max_delay, durable=durable)
+        threading.Thread(target=catalog.rebalance, name="rebalance", daemon=True).start()
+        api = RecipeApi(workers=workers, shards=catalog)
+    else:
+        ensure_database(db_file)  # migrate once, before any worker thread touches the database
+        api = RecipeApi(db_file, workers, WriteQueue(db_file, max_batch, max_delay, durable))
+    server = await asyncio.start_server(lambda reader, writer: serve_connection(api, reader, writer), host, port)
+    print(f"Serving the recipe book API on http://{host}:{server.sockets[0].getsockname()[1]}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="threads running SQLite queries")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="writes committed together at most")
+    parser.add_argument("--max-delay", type=float, default=MAX_DELAY,
+                        help="seconds a write waits for others to commit with it")
+    parser.add_argument("--durable", action="store_true", help="answer writes only once synced to disk")
+    parser.add_argument("--shards", type=int, help="spread users over this many database files")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, max_batch=args.max_batch,
+                          max_delay=args.max_delay, durable=args.durable, shards=args.shards))
+    except KeyboardInterrupt:
+        pass
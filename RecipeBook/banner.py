@@ -0,0 +1,23 @@
+import functools
+
+# Set to False by --no-banner: menus then print plain text and pyfiglet is never imported
+show_banner = True
+
+
+@functools.lru_cache(maxsize=None)
+def _figlet():
+    # pyfiglet takes tens of milliseconds to import and load its font, so only pay for it
+    # the first time a banner is actually drawn
+    from pyfiglet import Figlet
+    return Figlet(font="small")
+
+
+def render_banner(text):
+    """Return text as ASCII art, or as plain text when banners are turned off"""
+    if not show_banner:
+        return text
+    return _figlet().renderText(text)
+
+
+def add_banner_option(parser):
+    parser.add_argument("--no-banner", action="store_true", help="skip the ASCII-art banners for a faster start")
@@ -0,0 +1,221 @@
+"""Non-interactive commands, so scripts can use a recipe book without walking the menus.
+
+    python project.py --user eli list --limit 20
+    python db_recipes.py add --user eli --name "Garlic Soup" --ingredients "Garlic, Water"
+    python oop_project.py --user eli --format csv search "garlic, onion"
+    python db_recipes.py --user eli --stdin-jsonl < commands.jsonl
+
+With --stdin-jsonl every input line is one command as a JSON object, such as
+{"command": "add", "recipe": {"Dish Name": "Soup"}} or {"command": "edit", "key": 3,
+"changes": {"Dish Name": "Broth"}}, optionally with its own "user". They all run in one
+process against books loaded once, and each writes one JSON line: {"ok": true, "result": ...}
+or {"ok": false, "error": ...}.
+
+Each app supplies a book class for a user with add, get, list, edit, delete, search,
+import_file, export_file, flush and recover methods. A recipe's key is the number shown in
+the menus: its position from 1 in a CSV book, its Recipe ID in SQLite.
+"""
+import contextlib
+import csv
+import json
+import os
+import sys
+from itertools import islice
+try:
+    from .locking import StaleBookError  # imported as RecipeBook.batch, by project.py
+except ImportError:
+    from locking import StaleBookError  # imported by name, by the apps in RecipeBook/
+
+FIELDS = ["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
+# Recipe fields -> Recipe attribute (and SQLite column) names
+FIELD_ATTRIBUTES = {"Meal Category": "category", "Dish Name": "name", "Ingredients": "ingredients", "Cooking Directions": "directions"}
+FIELD_OPTIONS = {"category": "Meal Category", "name": "Dish Name", "ingredients": "Ingredients", "directions": "Cooking Directions"}
+GROUP_SIZE = 500  # --stdin-jsonl commands run inside one group (one SQLite transaction)
+CHANGES = {"add", "edit", "delete"}  # commands whose changes are only saved when the book is flushed
+
+
+def add_batch_commands(parser):
+    """Add the batch subcommands and options to an app's argument parser"""
+    import argparse  # the apps only import it when run as programs
+    parser.add_argument("--user", help="whose recipe book to use")
+    parser.add_argument("--format", choices=["json", "csv"], default="json", help="output format")
+    parser.add_argument("--stdin-jsonl", action="store_true", help="read one JSON command per line from stdin")
+    # Also accept --user and --format after the subcommand
+    options = dict(default=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest="command")
+
+    def command(name, help):
+        subparser = commands.add_parser(name, help=help)
+        subparser.add_argument("--user", **options)
+        subparser.add_argument("--format", choices=["json", "csv"], **options)
+        return subparser
+
+    def recipe_options(subparser):
+        for option, field in FIELD_OPTIONS.items():
+            subparser.add_argument(f"--{option}", help=field)
+
+    recipe_options(command("add", "add a recipe"))
+    listing = command("list", "list recipes")
+    listing.add_argument("--offset", type=int, default=0)
+    listing.add_argument("--limit", type=int, help="at most this many (default: all)")
+    command("get", "show one recipe").add_argument("key", type=int)
+    edit = command("edit", "change some fields of a recipe")
+    edit.add_argument("key", type=int)
+    recipe_options(edit)
+    command("delete", "delete a recipe").add_argument("key", type=int)
+    search = command("search", "search recipes (by comma-separated ingredients for CSV books)")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=10)
+    command("import", "import recipes from a CSV or JSONL file").add_argument("path")
+    command("export", "export recipes to a CSV or JSONL file").add_argument("path")
+
+
+def command_params(args):
+    """The command given on the command line, in the same form as a --stdin-jsonl line"""
+    params = {"command": args.command}
+    values = vars(args)
+    fields = {FIELD_OPTIONS[option]: values[option] for option in FIELD_OPTIONS if values.get(option) is not None}
+    if args.command == "add":
+        params["recipe"] = fields
+    elif args.command == "edit":
+        params["changes"] = fields
+    for name in ("key", "offset", "limit", "query", "path"):
+        if name in values:
+            params[name] = values[name]
+    return params
+
+
+def run_command(book, params):
+    command = params.get("command")
+    if command == "add":
+        return book.add({field: str(params.get("recipe", {}).get(field, "")) for field in FIELDS})
+    if command == "get":
+        return book.get(params["key"])
+    if command == "list":
+        return book.list(params.get("offset", 0), params.get("limit"))
+    if command == "edit":
+        changes = {field: str(value) for field, value in params.get("changes", {}).items() if field in FIELDS}
+        return book.edit(params["key"], changes)
+    if command == "delete":
+        return book.delete(params["key"])
+    if command == "search":
+        return book.search(params["query"], params.get("limit", 10))
+    if command == "import":
+        return {"imported": book.import_file(params["path"])}
+    if command == "export":
+        return {"exported": book.export_file(params["path"])}
+    raise ValueError(f"Unknown command: {command}")
+
+
+def write_result(result, output_format, out):
+    if output_format == "json":
+        json.dump(result, out, indent=2)
+        out.write("\n")
+        return
+    rows = result if isinstance(result, list) else [result]
+    if rows:
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]), extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_jsonl(open_book, default_user, lines, out, group=None):
+    """Run one command per line, reusing each user's book. Returns the number that failed.
+
+    group, if given, returns a context manager that every GROUP_SIZE commands run inside
+    (db_recipes passes its transaction, so a batch commits once per group, with each command
+    in a savepoint of its own). The replies to a group are written once its changes are saved,
+    so a change that fails to save is reported as failed rather than ok.
+    """
+    books = {}
+    failures = 0
+    lines = iter(lines)
+    while chunk := list(islice(lines, GROUP_SIZE)):
+        replies = []  # (username, command, reply)
+        try:
+            with group() if group else contextlib.nullcontext() as conn:
+                for line in chunk:
+                    if line.strip():
+                        replies.append(run_line(books, open_book, default_user, line, conn))
+                unsaved = flush_books(books)
+        except Exception as error:  # the group's transaction failed to commit: none of it was saved
+            unsaved = dict.fromkeys(books, error)
+        for username, command, reply in replies:
+            if reply["ok"] and command in CHANGES and username in unsaved:
+                reply = {"ok": False, "error": error_message(unsaved[username])}
+            failures += not reply["ok"]
+            out.write(json.dumps(reply) + "\n")
+    return failures
+
+
+def flush_books(books):
+    """Save every book's changes; returns username -> error for the books that could not be saved"""
+    unsaved = {}
+    for username, book in books.items():
+        try:
+            book.flush()
+        except Exception as error:
+            book.recover(error)
+            unsaved[username] = error
+    return unsaved
+
+
+def run_line(books, open_book, default_user, line, conn=None):
+    """(username, command, reply) for one command line"""
+    book = username = command = None
+    try:
+        params = json.loads(line)
+        username, command = params.get("user", default_user), params.get("command")
+        if not username:
+            raise ValueError("No user given")
+        book = books.get(username)
+        if book is None:
+            book = books[username] = open_book(username)
+        with savepoint(conn):
+            return username, command, {"ok": True, "result": run_command(book, params)}
+    except Exception as error:
+        if book is not None:
+            book.recover(error)
+        return username, command, {"ok": False, "error": error_message(error)}
+
+
+@contextlib.contextmanager
+def savepoint(conn):
+    """Undo what a command wrote to the group's transaction, if any, when it fails part way"""
+    if conn is None:
+        yield
+        return
+    conn.execute("SAVEPOINT batch_command")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK TO batch_command")
+        raise
+    finally:
+        conn.execute("RELEASE batch_command")
+
+
+def run_batch(args, open_book, group=None):
+    """Run the command in args (or --stdin-jsonl) and return the exit status"""
+    out = sys.stdout
+    # The apps report every change on the terminal; keep that out of the output
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if args.stdin_jsonl:
+            return 1 if run_jsonl(open_book, args.user, sys.stdin, out, group) else 0
+        if not args.user:
+            print("--user is required", file=sys.stderr)
+            return 2
+        try:
+            book = open_book(args.user)
+            result = run_command(book, command_params(args))
+            book.flush()  # before reporting success
+        except (KeyError, ValueError, OSError, StaleBookError) as error:
+            print(error_message(error), file=sys.stderr)
+            return 1
+        write_result(result, args.format, out)
+        return 0
+
+
+def error_message(error):
+    # str(KeyError) would wrap the message in quotes; an OSError's first argument is its errno
+    return f"{type(error).__name__}: {error.args[0] if isinstance(error, KeyError) and error.args else error}"
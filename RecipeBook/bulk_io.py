@@ -0,0 +1,97 @@
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+FIELDS = ["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
+WRITE_BUFFER = 1 << 20  # bytes buffered before each write to disk
+
+
+def file_format(path):
+    return "jsonl" if str(path).endswith(".jsonl") else "csv"
+
+
+def read_recipes(path):
+    """Yield recipes from a CSV or JSONL file one at a time, so any size file fits in memory.
+
+    A CSV can be another user's recipe book. Missing fields come back as empty strings
+    and extra ones (such as "Recipe ID") are dropped.
+    """
+    with open(path, mode="r", newline="") as file:
+        if file_format(path) == "jsonl":
+            rows = (json.loads(line) for line in file if line.strip())
+        else:
+            rows = csv.DictReader(file)
+        for row in rows:
+            yield {field: str(row.get(field) or "") for field in FIELDS}
+
+
+def write_recipes(recipes, path, header=True, mode="w"):
+    """Stream recipes to a CSV or JSONL file through one large buffer. Returns how many were written."""
+    count = 0
+    unfinished = mode == "a" and not ends_line(path)
+    with open(path, mode=mode, newline="", buffering=WRITE_BUFFER) as file:
+        if unfinished:  # e.g. a book saved by hand without a final newline: don't glue a row onto its last one
+            file.write("\n" if file_format(path) == "jsonl" else "\r\n")
+        if file_format(path) == "jsonl":
+            for recipe in recipes:
+                file.write(json.dumps({field: recipe.get(field, "") for field in FIELDS}) + "\n")
+                count += 1
+        else:
+            writer = csv.DictWriter(file, fieldnames=FIELDS, extrasaction="ignore")
+            if header:
+                writer.writeheader()
+            for recipe in recipes:
+                writer.writerow(recipe)
+                count += 1
+    return count
+
+
+def ends_line(path):
+    """Whether path is missing, empty or ends in a newline, so rows appended to it start a line of their own"""
+    try:
+        with open(path, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() == 0:
+                return True
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+    except FileNotFoundError:
+        return True
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+###### Progress ######
+class Progress:
+    """Reports rows processed and rows/sec while a bulk import or export runs"""
+
+    def __init__(self, label, every=100_000, out=sys.stderr):
+        self.label = label
+        self.every = every
+        self.out = out
+        self.count = 0
+        self.started = time.perf_counter()
+
+    def track(self, rows):
+        """Pass rows through, counting them and reporting every so often"""
+        for row in rows:
+            yield row
+            self.count += 1
+            if self.count % self.every == 0:
+                self.report()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed else 0.0
+
+    def report(self, finished=False):
+        status = "done" if finished else "so far"
+        print(f"{self.label}: {self.count:,} rows {status} ({self.rate():,.0f} rows/sec)", file=self.out)
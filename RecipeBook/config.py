@@ -1,8 +1,13 @@
 import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-USER_FILE = os.path.join(BASE_DIR, "oopusers.csv")
-RECIPES_DIR = os.path.join(BASE_DIR, "recipes")
-DB_FILE = os.path.join(BASE_DIR, "recipes.db")
+# Data lives next to the code unless RECIPE_BOOK_DATA_DIR points somewhere else (benchmarks, tests)
+DATA_DIR = os.environ.get("RECIPE_BOOK_DATA_DIR", BASE_DIR)
+USER_FILE = os.path.join(DATA_DIR, "oopusers.csv")
+RECIPES_DIR = os.path.join(DATA_DIR, "recipes")
+DB_FILE = os.path.join(DATA_DIR, "recipes.db")
+SHARD_DIR = os.path.join(DATA_DIR, "shards")  # catalog.db and recipes-<n>.db of the sharded mode (shards.py)
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")  # made by snapshot.py
 
-print(f"Base directory: {BASE_DIR}, \nData File: {USER_FILE}, \nRecipes file: {RECIPES_DIR},\nRecipes db file: {DB_FILE}")
\ No newline at end of file
+if __name__ == "__main__":
+    print(f"Base directory: {BASE_DIR}, \nData File: {USER_FILE}, \nRecipes file: {RECIPES_DIR},\nRecipes db file: {DB_FILE}")
@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from config import DB_FILE
+import instrumentation
+
+# Connection tuning shared by every connection the app opens
+CACHE_SIZE_KB = 16384                # page cache per connection (PRAGMA cache_size takes -KiB)
+MMAP_SIZE = 256 * 1024 * 1024        # bytes of the database file to memory-map for reads
+STATEMENT_CACHE_SIZE = 256           # prepared statements kept per connection
+
+_local = threading.local()
+
+
+class TimedConnection(sqlite3.Connection):
+    """A connection that records how long each statement takes to run (for a query, until its
+    first row is ready), used when RECIPE_BOOK_TIMINGS is set"""
+
+    def execute(self, sql, parameters=()):
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            instrumentation.record_statement(sql, perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            instrumentation.record_statement(sql, perf_counter() - start)
+
+
+###### Connections ######
+def get_connection(db_file=None):
+    """Return this thread's long-lived connection to db_file (the app database by default)"""
+    db_file = db_file or DB_FILE
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_file)
+    if conn is None:
+        # isolation_level=None leaves transaction control to transaction() below
+        conn = sqlite3.connect(db_file, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE,
+                               factory=TimedConnection if instrumentation.enabled else sqlite3.Connection)
+        if instrumentation.enabled:
+            instrumentation.trace_statements(conn)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        connections[db_file] = conn
+    return conn
+
+
+def close_connections():
+    """Close every connection opened by the current thread"""
+    connections = getattr(_local, "connections", {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+###### Transactions ######
+@contextmanager
+def transaction(db_file=None, write=True):
+    """Run a block as one transaction on the shared connection and yield the connection.
+
+    Write transactions take the write lock up front (BEGIN IMMEDIATE) so they never fail
+    half way through on a busy database. A block nested inside another transaction joins it.
+    """
+    conn = get_connection(db_file)
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def read_transaction(db_file=None):
+    """A transaction for reads that need one consistent view of the database"""
+    return transaction(db_file, write=False)
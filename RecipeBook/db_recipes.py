@@ -1,42 +1,43 @@
-import sqlite3
-import os
 import getpass
+import re
+import sqlite3
 import textwrap
-from tabulate import tabulate
-from pyfiglet import Figlet
-from config import DB_FILE
+import threading
+from itertools import groupby, islice
+from database import get_connection, read_transaction, transaction
+from instrumentation import timed
+from schema import last_recipe_id, link_ingredients, link_recipes_after, migrate
+from ingredient_index import SimilarityIndex, unique_ingredients
+from pager import PAGE_SIZE, page_count, view_pages
+from query_cache import QueryCache
+from table_renderer import RecipeTable
+from storage import RecipeStore, recipes_menu
+from user_directory import hash_password, verify_password
+from batch import FIELD_ATTRIBUTES
+import banner
+from bulk_io import Progress, chunked, read_recipes, write_recipes
 
 
 # Initialize the database
-def initialize_database():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Create users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        )
-    """)
-    # Create recipes table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS recipes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            category TEXT NOT NULL,
-            name TEXT NOT NULL,
-            ingredients TEXT NOT NULL,
-            directions TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-initialize_database()
-
-f = Figlet(font="small")
+def initialize_database(db_file=None):
+    """Create the database or upgrade an existing one to the current schema"""
+    migrate(db_file)
+
+
+_initialized = set()
+
+def ensure_database(db_file=None):
+    """Run initialize_database once per database file, the first time it is used"""
+    if db_file not in _initialized:
+        initialize_database(db_file)
+        _initialized.add(db_file)
+
+recipe_table = RecipeTable(["Recipe ID", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"])
+# Database file -> RecipeSimilarity, built by the first similar_recipes query on it
+similarity_indexes = {}
+similarity_lock = threading.Lock()
+# Database file -> QueryCache of recipe rows and pages, shared by every RecipeBook (and thread) using it
+query_caches = {}
 
 ###### User Management ######
 class User:
@@ -47,31 +48,37 @@ class User:
     @classmethod
     def register(cls):
         """Creates a new user or redirects to login if username already exists"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        ensure_database()
+        conn = get_connection()
 
         while True:
             username = input("Enter a username: ").lower().strip()
             # Check if username exists
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-            if cursor.fetchone():
+            if conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
                 print("Username already exists. Redirecting to login...")
-                conn.close()
                 return cls.login(existing_user=username)
             else:
                 password = getpass.getpass(f"Enter a password for {username}: ").strip()
-                cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-                conn.commit()
+                user = cls.create(username, password)
                 print(f"User {username} has been registered successfully!")
-                conn.close()
-                return cls(username, password)
+                return user
+
+    @classmethod
+    @timed("auth.create")
+    def create(cls, username, password, db_file=None):
+        """Register a user with a hashed password. Raises ValueError if the username is taken."""
+        ensure_database(db_file)
+        hashed = hash_password(password)  # deliberately slow, so not while holding the write lock
+        try:
+            with transaction(db_file) as conn:
+                conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Username {username} already exists") from None
+        return cls(username, password)
 
     @classmethod
     def login(cls, existing_user=None):
         """Authenticate user login"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
         attempts = 0
         while attempts < 3:
             if existing_user:
@@ -80,20 +87,26 @@ class User:
                 username = input("Enter your username: ").lower().strip()
 
             password = getpass.getpass("Enter your password: ").strip()
-            cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-            user_data = cursor.fetchone()
-            if user_data:
+            user = cls.authenticate(username, password)
+            if user:
                 print(f"Welcome, {username}!")
-                conn.close()
-                return cls(username, password)
+                return user
             else:
                 attempts += 1
                 print(f"Invalid credentials. Attempts left: {3 - attempts}")
 
         print("Failed to login after 3 attempts.")
-        conn.close()
         return None
 
+    @classmethod
+    @timed("auth.authenticate")
+    def authenticate(cls, username, password, db_file=None):
+        """Return the user if the password matches, otherwise None"""
+        ensure_database(db_file)
+        conn = get_connection(db_file)
+        user_data = conn.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        return cls(username, password) if user_data and verify_password(password, user_data[0]) else None
+
 
 ##### Recipe ######
 class Recipe:
@@ -103,6 +116,11 @@ class Recipe:
         self.ingredients = ingredients
         self.directions = directions
 
+    @classmethod
+    def from_dict(cls, row):
+        return cls(row.get("Meal Category") or "", row.get("Dish Name") or "",
+                   row.get("Ingredients") or "", row.get("Cooking Directions") or "")
+
     def to_dict(self):
         return {
             "Meal Category": self.category,
@@ -112,110 +130,646 @@ class Recipe:
         }
 
 ###### Recipe Book ######
-class RecipeBook:
-    def __init__(self, username):
+RECIPE_FIELDS = ["Recipe ID", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
+RECIPE_COLUMNS = ["id", "category", "name", "ingredients", "directions"]  # the same fields, as cached rows hold them
+
+class UserMoved(LookupError):
+    """The user's account is no longer in this database: a rebalance moved it to another shard"""
+
+
+class RecipeBook(RecipeStore):
+    def __init__(self, username, db_file=None, write_queue=None, shards=None):
         self.username = username
+        self.shards = shards  # a shards.ShardCatalog, to find the user's database there instead
+        if shards is None:
+            self.open(db_file, write_queue)
+            return
+        try:
+            self.open(*shards.locate(username))
+        except UserMoved as error:  # moved between finding their shard and opening it
+            self.follow(error)
+
+    def open(self, db_file, write_queue):
+        self.db_file = db_file
+        self.write_queue = write_queue  # a write_queue.WriteQueue shared with other sessions, to commit in groups
+        ensure_database(db_file)
         self.user_id = self.get_user_id()
+        self.cache = query_caches.get(db_file) or query_caches.setdefault(db_file, QueryCache())
+
+    def follow(self, error):
+        """After a UserMoved error, reopen the book on the user's new shard (or raise error,
+        if the book isn't sharded or is part of a larger transaction on the old one)"""
+        if self.shards is None or get_connection(self.db_file).in_transaction:
+            raise error
+        self.open(*self.shards.locate(self.username))
 
     def get_user_id(self):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = ?", (self.username,))
-        user_id = cursor.fetchone()[0]
-        conn.close()
-        return user_id
+        conn = get_connection(self.db_file)
+        row = conn.execute("SELECT id FROM users WHERE username = ?", (self.username,)).fetchone()
+        if row is None:
+            if self.shards is not None:
+                raise UserMoved(f"{self.username} has moved to another shard")
+            raise LookupError(f"No user named {self.username}")
+        return row[0]
+
+    ###### Query cache ######
+    def generation(self, conn):
+        """How many times this user's recipes have been written, as conn sees the database now"""
+        row = conn.execute("SELECT generation FROM users WHERE id = ?", (self.user_id,)).fetchone()
+        if row is None:
+            raise UserMoved(f"{self.username} has moved to another shard")
+        return row[0]
+
+    def cached(self, key, read):
+        """The query cache's value for key, or read(conn) from the database, which is then cached.
+
+        Inside a transaction the cache is left alone: what the transaction sees may still be
+        rolled back.
+        """
+        try:
+            return self.cached_once(key, read)
+        except UserMoved as error:
+            self.follow(error)
+            return self.cached_once(key, read)
+
+    def cached_once(self, key, read):
+        conn = get_connection(self.db_file)
+        if conn.in_transaction:
+            return read(conn)
+        value = self.cache.get(self.user_id, self.generation(conn), key)
+        if value is None:
+            with read_transaction(self.db_file) as conn:  # the value and its generation from one snapshot
+                generation = self.generation(conn)
+                value = read(conn)
+            if value is not None:
+                self.cache.put(self.user_id, generation, key, value)
+        return value
+
+    def read(self, read):
+        """read(conn), uncached, from one view of the database that still holds the user"""
+        try:
+            return self.read_once(read)
+        except UserMoved as error:
+            self.follow(error)
+            return self.read_once(read)
+
+    def read_once(self, read):
+        with read_transaction(self.db_file) as conn:
+            self.generation(conn)  # raises UserMoved once a rebalance has taken the user's account away
+            return read(conn)
+
+    def write_through(self, before, after, update):
+        """Apply a write this book just committed, which took the user's generation from before
+        to after, to the query cache with update(cache, user_id)"""
+        if get_connection(self.db_file).in_transaction:
+            return  # part of a larger transaction: once it commits, readers see the new generation
+        self.cache.write_through(self.user_id, before, after, lambda cache: update(cache, self.user_id))
+
+    def write(self, func):
+        """Run func(conn) in a write transaction and return its result once committed. With a
+        write queue, the transaction is shared with the other writes queued at the same time."""
+        try:
+            return self.write_once(func)
+        except UserMoved as error:
+            self.follow(error)
+            return self.write_once(func)
+
+    def write_once(self, func):
+        if self.write_queue is None or get_connection(self.db_file).in_transaction:
+            with transaction(self.db_file) as conn:  # (inside a transaction, this joins it)
+                return func(conn)
+        return self.write_queue.submit(func).result()
 
     def load_user_recipes(self):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, category, name, ingredients, directions FROM recipes WHERE user_id = ?", (self.user_id,))
-        recipes = [
-            dict(zip(["Recipe ID", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"], row))
-            for row in cursor.fetchall()
-        ]
-        conn.close()
-        return recipes
-
-    def add_recipe(self):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        category = input("Enter Meal Category: ").strip()
-        name = input("Enter Dish Name: ").strip()
-        ingredients = input("Enter Ingredients (comma-separated): ").strip()
-        directions = input("Enter Cooking Directions: ").strip()
-
-        cursor.execute("""
-            INSERT INTO recipes (user_id, category, name, ingredients, directions)
-            VALUES (?, ?, ?, ?, ?)
-        """, (self.user_id, category, name, ingredients, directions))
-        conn.commit()
-        conn.close()
+        return list(self.iter_recipes())
+
+    def iter_recipes(self, after_id=0, batch_size=500):
+        """Yield the user's recipes in ID order, fetching them from SQLite a batch at a time.
+        Raises UserMoved if the user moves to another shard part way through (their Recipe IDs change)."""
+        read = self.read
+        while True:
+            rows = read(lambda conn: conn.execute("""
+                SELECT id, category, name, ingredients, directions FROM recipes
+                WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?
+            """, (self.user_id, after_id, batch_size)).fetchall())
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(RECIPE_FIELDS, row))
+            after_id, read = rows[-1][0], self.read_once
+
+    @timed("storage.fetch_page")
+    def fetch_page(self, after_id=0, limit=PAGE_SIZE):
+        """One page of recipes, starting after the recipe with ID after_id (keyset pagination)"""
+        rows = self.cached(("page", after_id, limit), lambda conn: tuple(conn.execute("""
+            SELECT id, category, name, ingredients, directions FROM recipes
+            WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?
+        """, (self.user_id, after_id, limit))))
+        return [dict(zip(RECIPE_FIELDS, row)) for row in rows]
+
+    @timed("storage.count_recipes")
+    def count_recipes(self):
+        return self.cached(("count",), lambda conn: conn.execute(
+            "SELECT COUNT(*) FROM recipes WHERE user_id = ?", (self.user_id,)).fetchone()[0])
+
+    def view_recipes(self, done_label="Back to menu"):
+        """Show the book one page at a time, reading only the page on screen from the database"""
+        total = self.count_recipes()
+        if not total:
+            print("No recipes found.")
+            return
+        page_starts = {0: 0}  # page number -> ID of the recipe just before it
+
+        def page_start(conn, page):
+            if page == 0:
+                return 0
+            row = conn.execute("SELECT id FROM recipes WHERE user_id = ? ORDER BY id LIMIT 1 OFFSET ?",
+                               (self.user_id, page * PAGE_SIZE - 1)).fetchone()
+            if row is None:  # recipes were deleted since the pages were counted: show the last page there is
+                count = conn.execute("SELECT COUNT(*) FROM recipes WHERE user_id = ?", (self.user_id,)).fetchone()[0]
+                return page_start(conn, page_count(count) - 1)
+            return row[0]
+
+        def show_page(page):
+            if page not in page_starts:
+                # Jumped past the pages seen so far: find where this one starts
+                page_starts[page] = self.read(lambda conn: page_start(conn, page))
+            recipes = self.fetch_page(page_starts[page])
+            if recipes:
+                page_starts[page + 1] = recipes[-1]["Recipe ID"]
+            self.list_recipes(recipes)
+
+        view_pages(show_page, page_count(total), done_label)
+
+    def add_recipe(self, recipe=None):
+        if isinstance(recipe, dict):
+            recipe = Recipe.from_dict(recipe)
+        elif recipe is None:
+            category = input("Enter Meal Category: ").strip()
+            name = input("Enter Dish Name: ").strip()
+            ingredients = input("Enter Ingredients (comma-separated): ").strip()
+            directions = input("Enter Cooking Directions: ").strip()
+            recipe = Recipe(category, name, ingredients, directions)
+
+        self.insert_recipe(recipe)
         print("Recipe added successfully!")
 
-    def edit_recipe(self):
-        recipes = self.load_user_recipes()
-        self.list_recipes(recipes)
+    @timed("storage.insert_recipe")
+    def insert_recipe(self, recipe):
+        """Add a Recipe to the book and return its new Recipe ID"""
+        def insert(conn):
+            before = self.generation(conn)
+            recipe_id = conn.execute("""
+                INSERT INTO recipes (user_id, category, name, ingredients, directions)
+                VALUES (?, ?, ?, ?, ?)
+            """, (self.user_id, recipe.category, recipe.name, recipe.ingredients, recipe.directions)).lastrowid
+            link_ingredients(conn, [(recipe_id, self.user_id, recipe.ingredients)])
+            return recipe_id, before, self.generation(conn)
 
-        try:
-            choice = int(input("Enter the Recipe ID to edit: "))
-            recipe = next((r for r in recipes if r["Recipe ID"] == choice), None)
-
-            if recipe:
-                category = input(f"Enter new Meal Category (current: {recipe['Meal Category']}): ").strip() or recipe['Meal Category']
-                name = input(f"Enter new Dish Name (current: {recipe['Dish Name']}): ").strip() or recipe['Dish Name']
-                ingredients = input(f"Enter new Ingredients (current: {recipe['Ingredients']}): ").strip() or recipe['Ingredients']
-                directions = input(f"Enter new Cooking Directions (current: {recipe['Cooking Directions']}): ").strip() or recipe['Cooking Directions']
-
-                conn = sqlite3.connect(DB_FILE)
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE recipes
-                    SET category = ?, name = ?, ingredients = ?, directions = ?
-                    WHERE id = ? AND user_id = ?
-                """, (category, name, ingredients, directions, choice, self.user_id))
-                conn.commit()
-                conn.close()
-                print("Recipe updated successfully!")
-            else:
-                print("Invalid Recipe ID.")
-        except ValueError:
-            print("Invalid input.")
+        recipe_id, before, after = self.write(insert)
+        row = (recipe_id, recipe.category, recipe.name, recipe.ingredients, recipe.directions)
+        self.write_through(before, after, lambda cache, user_id: cache_inserted(cache, user_id, row))
+        self.track_similarity(recipe_id)
+        return recipe_id
+
+    @timed("storage.get_recipe")
+    def get_recipe(self, recipe_id):
+        """One of this user's recipes by ID, or None"""
+        row = self.cached(("recipe", recipe_id), lambda conn: conn.execute("""
+            SELECT id, category, name, ingredients, directions FROM recipes
+            WHERE id = ? AND user_id = ?
+        """, (recipe_id, self.user_id)).fetchone())
+        return dict(zip(RECIPE_FIELDS, row)) if row else None
+
+    @timed("storage.import_recipes")
+    def import_recipes(self, source, chunk_size=5000, show_progress=False):
+        """Stream recipes from a CSV or JSONL file into the database, one transaction per chunk"""
+        progress = Progress(f"Importing into {self.username}")
+        rows = read_recipes(source)
+        if show_progress:
+            rows = progress.track(rows)
+        count = 0
+        for chunk in chunked(rows, chunk_size):
+            with transaction(self.db_file) as conn:
+                last_id = last_recipe_id(conn)
+                conn.executemany("""
+                    INSERT INTO recipes (user_id, category, name, ingredients, directions)
+                    VALUES (?, ?, ?, ?, ?)
+                """, [(self.user_id, r["Meal Category"], r["Dish Name"], r["Ingredients"], r["Cooking Directions"]) for r in chunk])
+                link_recipes_after(conn, last_id)
+            count += len(chunk)
+        similarity_indexes.pop(self.db_file, None)  # rebuilt by the next query rather than updated row by row
+        if show_progress:
+            progress.report(finished=True)
+        return count
+
+    @timed("storage.import_from_user")
+    def import_from_user(self, other_username):
+        """Copy another user's whole book inside SQLite, without the rows ever reaching Python"""
+        with transaction(self.db_file) as conn:
+            last_id = last_recipe_id(conn)
+            cursor = conn.execute("""
+                INSERT INTO recipes (user_id, category, name, ingredients, directions)
+                SELECT ?, category, name, ingredients, directions FROM recipes
+                WHERE user_id = (SELECT id FROM users WHERE username = ?)
+                ORDER BY id
+            """, (self.user_id, other_username))
+            # Copy the ingredient links the same way, pairing each copy with its original by order
+            conn.execute("""
+                INSERT INTO recipe_ingredients (recipe_id, ingredient_id, user_id)
+                SELECT copies.id, links.ingredient_id, ?
+                FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS number FROM recipes
+                      WHERE user_id = (SELECT id FROM users WHERE username = ?)) AS originals
+                JOIN (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS number FROM recipes
+                      WHERE user_id = ? AND id > ?) AS copies USING (number)
+                JOIN recipe_ingredients AS links ON links.recipe_id = originals.id
+            """, (self.user_id, other_username, self.user_id, last_id))
+        similarity_indexes.pop(self.db_file, None)
+        return cursor.rowcount
+
+    @timed("storage.export_recipes")
+    def export_recipes(self, destination, show_progress=False):
+        """Stream the user's recipes to a CSV or JSONL file"""
+        progress = Progress(f"Exporting {self.username}")
+        rows = self.iter_recipes(batch_size=5000)
+        if show_progress:
+            rows = progress.track(rows)
+        count = write_recipes(rows, destination)
+        if show_progress:
+            progress.report(finished=True)
+        return count
+
+    @timed("storage.update_recipe")
+    def update_recipe(self, recipe_id, **fields):
+        """Change only the given columns (category, name, ingredients, directions) of one
+        recipe. Returns the number of recipes updated: 0 if this user has no such recipe."""
+        columns = [column for column in ("category", "name", "ingredients", "directions") if column in fields]
+        if not columns:
+            return 1 if self.get_recipe(recipe_id) else 0
+        def update(conn):
+            before = self.generation(conn)
+            updated = conn.execute(
+                f"UPDATE recipes SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ? AND user_id = ?",
+                [fields[column] for column in columns] + [recipe_id, self.user_id]).rowcount
+            if "ingredients" in fields and updated:
+                link_ingredients(conn, [(recipe_id, self.user_id, fields["ingredients"])])
+            return updated, before, self.generation(conn)
 
-    def delete_recipe(self):
-        recipes = self.load_user_recipes()
-        self.list_recipes(recipes)
+        updated, before, after = self.write(update)
+        if updated:
+            changes = {RECIPE_COLUMNS.index(column): fields[column] for column in columns}
+            self.write_through(before, after, lambda cache, user_id: cache_updated(cache, user_id, recipe_id, changes))
+            if "ingredients" in fields:
+                self.track_similarity(recipe_id)
+        return updated
 
+    def pick_recipe(self, action):
+        """Let the user page through the book and type the ID of a recipe; None if they can't"""
+        if not self.count_recipes():
+            print("No recipes found.")
+            return None
+        self.view_recipes(done_label="Choose a recipe")
         try:
-            choice = int(input("Enter the Recipe ID to delete: "))
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM recipes WHERE id = ? AND user_id = ?", (choice, self.user_id))
-            conn.commit()
-            conn.close()
-            print("Recipe deleted successfully!")
+            return int(input(f"Enter the Recipe ID to {action}: "))
         except ValueError:
             print("Invalid input.")
+            return None
+
+    def edit_recipe(self, recipe_id=None, changes=None):
+        """Edit a recipe. changes maps attribute names (category, name, ingredients, directions)
+        to new values; without them the user is asked. Returns the number of recipes updated."""
+        if recipe_id is not None and changes is not None:
+            return self.update_recipe(recipe_id, **changes)
+
+        recipe_id = self.pick_recipe("edit")
+        if recipe_id is None:
+            return 0
+        recipe = self.get_recipe(recipe_id)
+        if recipe is None:
+            print("Invalid Recipe ID.")
+            return 0
+
+        changes = {}
+        for column, field in (("category", "Meal Category"), ("name", "Dish Name"),
+                              ("ingredients", "Ingredients"), ("directions", "Cooking Directions")):
+            value = input(f"Enter new {field} (current: {recipe[field]}): ").strip()
+            if value and value != recipe[field]:
+                changes[column] = value
+        updated = self.update_recipe(recipe_id, **changes)
+        print("Recipe updated successfully!" if updated else "Invalid Recipe ID.")
+        return updated
+
+    def delete_recipe(self, recipe_id=None):
+        """Delete a recipe, asking which one if recipe_id is not given. Returns the number deleted."""
+        if recipe_id is None:
+            recipe_id = self.pick_recipe("delete")
+            if recipe_id is None:
+                return 0
+            interactive = True
+        else:
+            interactive = False
+
+        deleted = self.remove_recipe(recipe_id)
+        if interactive:
+            print("Recipe deleted successfully!" if deleted else "Invalid Recipe ID.")
+        return deleted
 
+    @timed("storage.remove_recipe")
+    def remove_recipe(self, recipe_id):
+        """Delete one of this user's recipes by ID. Returns the number deleted: 0 if there is no such recipe."""
+        def remove(conn):
+            before = self.generation(conn)
+            deleted = conn.execute("DELETE FROM recipes WHERE id = ? AND user_id = ?", (recipe_id, self.user_id)).rowcount
+            return deleted, before, self.generation(conn)
+
+        deleted, before, after = self.write(remove)
+        if deleted:
+            self.write_through(before, after, lambda cache, user_id: cache_deleted(cache, user_id, recipe_id))
+            self.track_similarity(recipe_id)
+        return deleted
+
+    @timed("render.list_recipes")
     def list_recipes(self, recipes=None):
-        recipes = recipes or self.load_user_recipes()
+        if recipes is None:
+            recipes = self.load_user_recipes()
         if recipes:
-            headers = ["Recipe ID", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
-            rows = [
-                [r["Recipe ID"], r["Meal Category"], r["Dish Name"],
-                 "\n".join(textwrap.wrap(r["Ingredients"], 25)),
-                 "\n".join(textwrap.wrap(r["Cooking Directions"], 40))]
+            recipe_table.write([
+                (r["Recipe ID"], r["Meal Category"], r["Dish Name"], r["Ingredients"], r["Cooking Directions"])
                 for r in recipes
-            ]
-            print(tabulate(rows, headers=headers, tablefmt="rounded_grid"))
+            ])
         else:
             print("No recipes found.")
 
+    @timed("search.full_text")
+    def search(self, query, limit=10, offset=0, markers=("[", "]")):
+        """Return this user's recipes matching query, best match first, with a highlighted snippet"""
+        match = fts_query(query)
+        if not match:
+            return []
+        rows = self.read(lambda conn: conn.execute("""
+            SELECT recipes.id, recipes.category, recipes.name,
+                   snippet(recipes_fts, -1, ?, ?, '...', 12)
+            FROM recipes_fts JOIN recipes ON recipes.id = recipes_fts.rowid
+            WHERE recipes_fts MATCH ?
+            ORDER BY bm25(recipes_fts, 2.0, 5.0, 3.0, 1.0, 0.0)
+            LIMIT ? OFFSET ?
+        """, (markers[0], markers[1], f"owner:u{self.user_id} AND {{category name ingredients directions}} : ({match})", limit, offset)).fetchall())
+        return [dict(zip(["Recipe ID", "Meal Category", "Dish Name", "Match"], row)) for row in rows]
+
+    ###### Ingredient queries ######
+    @timed("search.recipes_with_ingredients")
+    def recipes_with_ingredients(self, ingredients, limit=None):
+        """This user's recipes that use every one of the given ingredients, in ID order"""
+        names = unique_ingredients(ingredients)
+        if not names:
+            return []
+        rows = self.read(lambda conn: conn.execute(f"""
+            SELECT id, category, name, ingredients, directions FROM recipes
+            WHERE id IN (
+                SELECT recipe_id FROM recipe_ingredients
+                WHERE user_id = ? AND ingredient_id IN (SELECT id FROM ingredients WHERE name IN ({', '.join('?' * len(names))}))
+                GROUP BY recipe_id HAVING COUNT(*) = ?
+            )
+            ORDER BY id LIMIT ?
+        """, (self.user_id, *names, len(names), -1 if limit is None else limit)).fetchall())
+        return [dict(zip(RECIPE_FIELDS, row)) for row in rows]
+
+    @timed("search.top_ingredients")
+    def top_ingredients(self, limit=10):
+        """The ingredients used in most of this user's recipes, as (ingredient, number of recipes)"""
+        return self.read(lambda conn: conn.execute("""
+            SELECT ingredients.name, used.recipes FROM (
+                SELECT ingredient_id, COUNT(*) AS recipes FROM recipe_ingredients
+                WHERE user_id = ? GROUP BY ingredient_id
+            ) AS used JOIN ingredients ON ingredients.id = used.ingredient_id
+            ORDER BY used.recipes DESC, ingredients.name LIMIT ?
+        """, (self.user_id, limit)).fetchall())
+
+    @timed("search.recipes_sharing_ingredients")
+    def recipes_sharing_ingredients(self, recipe_id, limit=10):
+        """This user's other recipes that share ingredients with recipe_id, most shared first"""
+        rows = self.read(lambda conn: conn.execute("""
+            SELECT recipes.id, recipes.category, recipes.name, recipes.ingredients, recipes.directions, shared.count
+            FROM (
+                SELECT other.recipe_id, COUNT(*) AS count FROM recipe_ingredients AS mine
+                JOIN recipe_ingredients AS other
+                  ON other.user_id = mine.user_id AND other.ingredient_id = mine.ingredient_id AND other.recipe_id != mine.recipe_id
+                WHERE mine.recipe_id = ? AND mine.user_id = ?
+                GROUP BY other.recipe_id
+            ) AS shared JOIN recipes ON recipes.id = shared.recipe_id
+            ORDER BY shared.count DESC, recipes.id LIMIT ?
+        """, (recipe_id, self.user_id, limit)).fetchall())
+        return [dict(zip(RECIPE_FIELDS + ["Shared Ingredients"], row)) for row in rows]
+
+    ###### Similar recipes ######
+    @timed("search.similar_recipes")
+    def similar_recipes(self, recipe_id, k=10, everyone=False, metric="jaccard"):
+        """The k recipes whose ingredients are most like those of this user's recipe_id, from
+        this user's book or, with everyone, from every user's, with their "Similarity" score"""
+        if self.get_recipe(recipe_id) is None:
+            return []
+        with similarity_lock:
+            similarity = similarity_indexes.get(self.db_file)
+            if similarity is None:
+                similarity = similarity_indexes[self.db_file] = RecipeSimilarity(self.db_file)
+            matches = similarity.similar(recipe_id, k, metric, None if everyone else self.user_id)
+        if not matches:
+            return []
+        conn = get_connection(self.db_file)
+        cursor = conn.execute(f"""
+            SELECT id, category, name, ingredients, directions FROM recipes
+            WHERE id IN ({', '.join('?' * len(matches))})
+        """, [match_id for match_id, _ in matches])
+        recipes = {row[0]: dict(zip(RECIPE_FIELDS, row)) for row in cursor.fetchall()}
+        return [{**recipes[match_id], "Similarity": round(score, 3)} for match_id, score in matches if match_id in recipes]
+
+    def track_similarity(self, recipe_id):
+        """Bring the similarity index, if one has been built, up to date with a recipe this
+        book just added, edited or deleted"""
+        if self.db_file not in similarity_indexes:
+            return
+        conn = get_connection(self.db_file)
+        ingredient_ids = [row[0] for row in conn.execute("SELECT ingredient_id FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))]
+        with similarity_lock:
+            similarity = similarity_indexes.get(self.db_file)
+            if similarity is not None:
+                similarity.set(recipe_id, self.user_id, ingredient_ids)
+
+    @timed("render.search_results")
+    def show_search_results(self, results):
+        if results:
+            from tabulate import tabulate  # only needed for search results
+            rows = [[r["Recipe ID"], r["Meal Category"], r["Dish Name"], "\n".join(textwrap.wrap(r["Match"], 50))] for r in results]
+            print(tabulate(rows, headers=["Recipe ID", "Meal Category", "Dish Name", "Match"], tablefmt="rounded_grid"))
+        else:
+            print("No matching recipes found.")
+
+    def search_recipes(self):
+        choice = input("1 - Search recipes, 2 - Recipes with all of some ingredients, 3 - Most used ingredients, "
+                       "4 - Recipes sharing ingredients with a recipe, 5 - Recipes like one of mine: ").strip()
+        if choice == "1":
+            query = input("Search for: ").strip()
+            self.show_search_results(self.search(query, markers=("\033[1m", "\033[0m")))
+        elif choice == "2":
+            self.list_recipes(self.recipes_with_ingredients(input("Enter the ingredients (comma-separated): ").split(",")))
+        elif choice == "3":
+            top = self.top_ingredients()
+            for ingredient, count in top:
+                print(f"{ingredient}: {count} recipe{'s' if count != 1 else ''}")
+            if not top:
+                print("No recipes found.")
+        elif choice == "4":
+            recipe_id = self.pick_recipe("compare")
+            if recipe_id is not None:
+                self.list_recipes(self.recipes_sharing_ingredients(recipe_id))
+        elif choice == "5":
+            recipe_id = self.pick_recipe("compare")
+            if recipe_id is not None:
+                everyone = input("Look in every user's recipes? (y/n): ").strip().lower() == "y"
+                self.list_recipes(self.similar_recipes(recipe_id, everyone=everyone))
+        else:
+            print("Invalid choice.")
+
+
+###### Query cache updates ######
+# How this session's own writes change the cached rows ("recipe", ID), pages ("page", after
+# ID, limit) and count ("count",) of a user, run by QueryCache.write_through with the cache locked
+def cache_inserted(cache, user_id, row):
+    cache.store(user_id, ("recipe", row[0]), row)
+    for key in cache.keys(user_id):
+        if key[0] == "page":
+            page = cache.peek(user_id, key)
+            if len(page) < key[2] and row[0] > key[1]:
+                # Recipe IDs only grow, so a new recipe joins the end of the short page it comes after
+                cache.store(user_id, key, page + (row,))
+    count = cache.peek(user_id, ("count",))
+    if count is not None:
+        cache.store(user_id, ("count",), count + 1)
+
+
+def cache_updated(cache, user_id, recipe_id, changes):
+    """changes maps positions in a cached row to their new values"""
+    def updated(row):
+        return tuple(changes.get(position, value) for position, value in enumerate(row))
+
+    for key in cache.keys(user_id):
+        if key == ("recipe", recipe_id):
+            cache.store(user_id, key, updated(cache.peek(user_id, key)))
+        elif key[0] == "page":
+            page = cache.peek(user_id, key)
+            if any(row[0] == recipe_id for row in page):
+                cache.store(user_id, key, tuple(updated(row) if row[0] == recipe_id else row for row in page))
+
+
+def cache_deleted(cache, user_id, recipe_id):
+    cache.discard(user_id, ("recipe", recipe_id))
+    for key in cache.keys(user_id):
+        # The page the recipe was on now ends with a recipe that isn't cached
+        if key[0] == "page" and any(row[0] == recipe_id for row in cache.peek(user_id, key)):
+            cache.discard(user_id, key)
+    count = cache.peek(user_id, ("count",))
+    if count is not None:
+        cache.store(user_id, ("count",), count - 1)
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a word or a word prefix"""
+    words = re.findall(r"\w+", text)
+    return " AND ".join(f'"{word}"*' for word in words)
+
+###### Similar Recipes ######
+class RecipeSimilarity:
+    """A SimilarityIndex over every recipe in a database, grouped by user.
+
+    Built from recipe_ingredients, so each bit is an ingredient ID. RecipeBook keeps it in
+    step with the recipes it adds, edits and deletes (imports drop it to be rebuilt); changes
+    made by other processes are seen once this process rebuilds it. Callers hold similarity_lock.
+    """
+
+    def __init__(self, db_file=None):
+        conn = get_connection(db_file)
+        rows = conn.execute("SELECT recipe_id, user_id, ingredient_id FROM recipe_ingredients ORDER BY recipe_id")
+        self.ids, groups, ingredient_sets = [], [], []
+        for (recipe_id, user_id), links in groupby(rows, key=lambda row: row[:2]):
+            self.ids.append(recipe_id)
+            groups.append(user_id)
+            ingredient_sets.append([link[2] for link in links])
+        self.rows = {recipe_id: row for row, recipe_id in enumerate(self.ids)}
+        self.index = SimilarityIndex.build(ingredient_sets, groups)
+
+    def set(self, recipe_id, user_id, ingredient_ids):
+        """Add, update or (with no ingredients, as for a deleted recipe) clear a recipe"""
+        row = self.rows.get(recipe_id)
+        if row is None:
+            if not ingredient_ids:
+                return
+            self.rows[recipe_id] = len(self.ids)
+            self.ids.append(recipe_id)
+            self.index.add(ingredient_ids, user_id)
+        else:
+            # A cleared row stays behind, empty, so no other row has to move
+            self.index.update(row, ingredient_ids, user_id)
+
+    def similar(self, recipe_id, k=10, metric="jaccard", user_id=None):
+        row = self.rows.get(recipe_id)
+        if row is None:
+            return []
+        return [(self.ids[match], score) for match, score in self.index.similar(row, k, metric, user_id)]
+
+###### Batch Mode ######
+class BatchBook:
+    """A user's book for the batch commands in batch.py. Keys are Recipe IDs."""
+
+    def __init__(self, username):
+        ensure_database()
+        if not get_connection().execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+            raise ValueError(f"Unknown user {username}")
+        self.book = RecipeBook(username)
+
+    def get(self, key):
+        recipe = self.book.get_recipe(int(key))
+        if recipe is None:
+            raise KeyError(f"No recipe with ID {key}")
+        return recipe
+
+    def add(self, recipe):
+        return self.book.get_recipe(self.book.insert_recipe(Recipe.from_dict(recipe)))
+
+    def list(self, offset=0, limit=None):
+        recipes = self.book.iter_recipes(batch_size=5000)
+        return list(islice(recipes, offset, None if limit is None else offset + limit))
+
+    def edit(self, key, changes):
+        if not self.book.update_recipe(int(key), **{FIELD_ATTRIBUTES[field]: value for field, value in changes.items()}):
+            raise KeyError(f"No recipe with ID {key}")
+        return self.get(key)
+
+    def delete(self, key):
+        recipe = self.get(key)
+        self.book.delete_recipe(recipe["Recipe ID"])
+        return recipe
+
+    def search(self, query, limit=10):
+        return self.book.search(query, limit)
+
+    def import_file(self, path):
+        return self.book.import_recipes(path)
+
+    def export_file(self, path):
+        return self.book.export_recipes(path)
+
+    def flush(self):
+        pass
+
+    def recover(self, error):
+        pass
+
 ###### Recipe Book App (flow) ######
 class RecipeBookApp:
     @staticmethod
     def main_menu():
-        print(f.renderText("Welcome to your digital Recipe Book"))
+        ensure_database()  # upgrade the schema at startup, not on the first login
+        print(banner.render_banner("Welcome to your digital Recipe Book"))
         while True:
             choice = input("1 to Register, 2 to Login, 3 to Exit: ").strip()
             if choice == "1":
@@ -234,31 +788,17 @@ class RecipeBookApp:
 
     @staticmethod
     def recipes_menu(user):
-        recipe_book = RecipeBook(user.username)
-        while True:
-            choice = input("\n1 - Add Recipe, 2 - Edit Recipe, 3 - Delete Recipe, 4 - View Recipes, 5 - Logout: ").strip()
-            if choice == "1":
-                recipe_book.add_recipe()
-            elif choice == "2":
-                recipe_book.edit_recipe()
-            elif choice == "3":
-                recipe_book.delete_recipe()
-            elif choice == "4":
-                recipe_book.list_recipes()
-            elif choice == "5":
-                print("Logging out...")
-                exit_choice = input("Do you want to exit the program? (y/n): ").strip().lower()
-                if exit_choice == "y":
-                    print("Goodbye!")
-                    exit()  # Exit the program entirely
-                elif exit_choice == "n":
-                    print("Returning to your recipes menu...")
-                    continue  # Stay in the recipes menu
-                else:
-                    print("Invalid input, returning to your recipes menu...")
-            else:
-                print("Invalid option.")
+        recipes_menu(RecipeBook(user.username))
 
 # Entry point
 if __name__ == "__main__":
+    import argparse
+    from batch import add_batch_commands, run_batch
+    parser = argparse.ArgumentParser(description="Digital Recipe Book")
+    banner.add_banner_option(parser)
+    add_batch_commands(parser)
+    args = parser.parse_args()
+    if args.command or args.stdin_jsonl:
+        raise SystemExit(run_batch(args, BatchBook, group=transaction))
+    banner.show_banner = not args.no_banner
     RecipeBookApp.main_menu()
\ No newline at end of file
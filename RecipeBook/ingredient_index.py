@@ -0,0 +1,349 @@
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+numpy = None  # imported by load_numpy on first use
+
+
+def normalize_ingredient(ingredient):
+    """Lowercase an ingredient and collapse its whitespace so "Olive  Oil" matches "olive oil" """
+    return re.sub(r"\s+", " ", ingredient).strip().lower()
+
+
+def split_ingredients(text):
+    """Split a comma-separated ingredients string into unique, normalized ingredients"""
+    return unique_ingredients(text.split(","))
+
+
+def unique_ingredients(items):
+    ingredients = []
+    for item in items:
+        ingredient = normalize_ingredient(item)
+        if ingredient and ingredient not in ingredients:
+            ingredients.append(ingredient)
+    return ingredients
+
+
+def file_stamp(*paths):
+    """Size and modification time of each path (None if missing), used to spot stale sidecar files"""
+    stamp = []
+    for path in paths:
+        if os.path.exists(path):
+            info = os.stat(path)
+            stamp.append([info.st_size, info.st_mtime_ns])
+        else:
+            stamp.append(None)
+    return stamp
+
+
+###### Ingredient Index ######
+class IngredientIndex:
+    """Inverted index from normalized ingredient to the positions of the recipes that use it.
+
+    Positions are indexes into the recipe book's list, so the index has to be told about
+    every add, edit and delete to stay in step with it.
+    """
+
+    def __init__(self):
+        self.postings = {}       # ingredient -> set of recipe positions
+        self.ingredients = []    # recipe position -> tuple of its normalized ingredients
+        self.similarity = None   # SimilarityIndex over the same positions, built by the first similar()
+
+    def __len__(self):
+        return len(self.ingredients)
+
+    @classmethod
+    def build(cls, ingredient_texts):
+        index = cls()
+        for text in ingredient_texts:
+            index.add(text)
+        return index
+
+    ###### Keeping the index in step with the book ######
+    def add(self, text):
+        self._link(len(self.ingredients), split_ingredients(text))
+        if self.similarity is not None:
+            self.similarity.add(self.ingredients[-1])
+
+    def update(self, position, text):
+        self._unlink(position)
+        self._link(position, split_ingredients(text))
+        if self.similarity is not None:
+            self.similarity.update(position, self.ingredients[position])
+
+    def remove(self, position):
+        self._unlink(position)
+        del self.ingredients[position]
+        if self.similarity is not None:
+            self.similarity.remove(position)
+        # Every recipe after the removed one moves up a place
+        for moved in range(position, len(self.ingredients)):
+            for ingredient in self.ingredients[moved]:
+                recipes = self.postings[ingredient]
+                recipes.discard(moved + 1)
+                recipes.add(moved)
+
+    def _link(self, position, ingredients):
+        if position == len(self.ingredients):
+            self.ingredients.append(tuple(ingredients))
+        else:
+            self.ingredients[position] = tuple(ingredients)
+        for ingredient in ingredients:
+            self.postings.setdefault(ingredient, set()).add(position)
+
+    def _unlink(self, position):
+        for ingredient in self.ingredients[position]:
+            recipes = self.postings[ingredient]
+            recipes.discard(position)
+            if not recipes:
+                del self.postings[ingredient]
+        self.ingredients[position] = ()
+
+    ###### Queries ######
+    def contains_all(self, ingredients):
+        """Positions of recipes that use every one of the given ingredients"""
+        wanted = [self.postings.get(i, set()) for i in unique_ingredients(ingredients)]
+        if not wanted:
+            return []
+        wanted.sort(key=len)  # intersect starting from the rarest ingredient
+        matches = set(wanted[0])
+        for recipes in wanted[1:]:
+            if not matches:
+                break
+            matches &= recipes
+        return sorted(matches)
+
+    def contains_any(self, ingredients):
+        """Positions of recipes that use at least one of the given ingredients"""
+        matches = set()
+        for ingredient in unique_ingredients(ingredients):
+            matches |= self.postings.get(ingredient, set())
+        return sorted(matches)
+
+    def missing_at_most(self, ingredients, k):
+        """Positions of recipes that need at most k ingredients besides the given ones,
+        fewest missing first. Only recipes that use at least one given ingredient count."""
+        hits = Counter()
+        for ingredient in unique_ingredients(ingredients):
+            hits.update(self.postings.get(ingredient, ()))
+        missing = {position: len(self.ingredients[position]) - count for position, count in hits.items()}
+        return sorted((p for p, m in missing.items() if m <= k), key=lambda p: (missing[p], p))
+
+    def missing_ingredients(self, position, ingredients):
+        have = set(unique_ingredients(ingredients))
+        return [i for i in self.ingredients[position] if i not in have]
+
+    def similar(self, position, k=10, metric="jaccard"):
+        """The k recipes whose ingredients are most like recipe position's, as (position, score)"""
+        if self.similarity is None:
+            self.similarity = SimilarityIndex.build(self.ingredients)
+        return self.similarity.similar(position, k, metric)
+
+    ###### Sidecar file ######
+    def save(self, path, stamp):
+        """Write the index next to the recipe book, tagged with the book's file stamp"""
+        with open(path, mode="w") as file:
+            # dumps encodes in C in one go; dump would go through the pure-Python encoder
+            file.write(json.dumps({"stamp": stamp, "ingredients": self.ingredients}))
+
+    @classmethod
+    def load(cls, path, stamp):
+        """Read a saved index, or return None if it is missing or the book has changed since"""
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get("stamp") != stamp:
+            return None
+        index = cls()
+        for ingredients in data["ingredients"]:
+            index._link(len(index.ingredients), ingredients)
+        return index
+
+
+###### Similar Recipes ######
+BLOCK_ROWS = 65536  # recipes scored per NumPy block, which bounds a query's temporary arrays
+
+
+def load_numpy():
+    """NumPy, or None if it is not installed. Imported on first use: it takes longer to
+    import than the apps take to start."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as np
+        except ImportError:
+            np = False
+        numpy = np
+    return numpy or None
+
+
+class SimilarityIndex:
+    """Each recipe's ingredient set as a bitset, so one recipe is scored against all the
+    others at once.
+
+    With NumPy the bitsets are the rows of a packed uint64 matrix, and a query reads only
+    the columns (64 ingredients each) where it has bits, a block of rows at a time. Without it every bitset is a
+    Python int and a query is a loop of & and bit_count. Rows are positions like the
+    IngredientIndex's, and each can carry a group (such as the user who owns the recipe)
+    that a query can be limited to.
+    """
+
+    def __init__(self, use_numpy=None):
+        self.bits = {}  # ingredient -> bit number
+        self.np = load_numpy() if use_numpy is None or use_numpy else None
+        if use_numpy and self.np is None:
+            raise ImportError("NumPy is not installed")
+        self.count = 0
+        if self.np:
+            # Column-major, so a query reads each of its words for every recipe as one contiguous run
+            self.matrix = self.np.zeros((16, 1), dtype=self.np.uint64, order="F")
+            self.sizes = self.np.zeros(16, dtype=self.np.int64)   # ingredients per row
+            self.groups = self.np.zeros(16, dtype=self.np.int64)
+        else:
+            self.sets, self.sizes, self.groups = [], [], []
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def build(cls, ingredient_sets, groups=None, use_numpy=None):
+        index = cls(use_numpy)
+        groups = groups or [0] * len(ingredient_sets)
+        if not index.np:
+            for ingredients, group in zip(ingredient_sets, groups):
+                index.add(ingredients, group)
+            return index
+        # Set every bit with one scatter instead of a NumPy call per ingredient
+        np = index.np
+        rows, bits = [], []
+        for row, ingredients in enumerate(ingredient_sets):
+            for ingredient in ingredients:
+                rows.append(row)
+                bits.append(index.bit(ingredient))
+        index.reserve(len(ingredient_sets), len(index.bits))
+        rows, bits = np.array(rows, dtype=np.int64), np.array(bits, dtype=np.uint64)
+        np.bitwise_or.at(index.matrix, (rows, (bits >> np.uint64(6)).astype(np.int64)), np.uint64(1) << (bits & np.uint64(63)))
+        index.count = len(ingredient_sets)
+        index.sizes[:index.count] = np.bincount(rows, minlength=index.count)
+        index.groups[:index.count] = groups
+        return index
+
+    def bit(self, ingredient):
+        return self.bits.setdefault(ingredient, len(self.bits))
+
+    def reserve(self, rows, bits):
+        """Grow the matrix (doubling) to hold at least rows rows of bits bits"""
+        np = self.np
+        capacity, words = self.matrix.shape
+        needed_words = max(1, -(-bits // 64))
+        if rows <= capacity and needed_words <= words:
+            return
+        if rows > capacity:
+            capacity = max(rows, 2 * capacity)
+        if needed_words > words:
+            words = max(needed_words, 2 * words)
+        matrix = np.zeros((capacity, words), dtype=np.uint64, order="F")
+        matrix[:self.count, :self.matrix.shape[1]] = self.matrix[:self.count]
+        self.matrix = matrix
+        self.sizes = np.resize(self.sizes, capacity)
+        self.groups = np.resize(self.groups, capacity)
+
+    ###### Keeping the index in step with the book ######
+    def add(self, ingredients, group=0):
+        if self.np:
+            self.reserve(self.count + 1, len(self.bits))
+        else:
+            self.sets.append(0)
+            self.sizes.append(0)
+            self.groups.append(group)
+        self.count += 1
+        self.update(self.count - 1, ingredients, group)
+
+    def update(self, row, ingredients, group=None):
+        bits = [self.bit(ingredient) for ingredient in set(ingredients)]
+        if self.np:
+            self.reserve(self.count, len(self.bits))
+            words = self.matrix[row]
+            words[:] = 0
+            for bit in bits:
+                words[bit >> 6] |= self.np.uint64(1 << (bit & 63))
+        else:
+            self.sets[row] = sum(1 << bit for bit in bits)
+        self.sizes[row] = len(bits)
+        if group is not None:
+            self.groups[row] = group
+
+    def remove(self, row):
+        """Delete a row; the rows after it move up a place"""
+        if self.np:
+            for array in (self.matrix, self.sizes, self.groups):
+                array[row:self.count - 1] = array[row + 1:self.count]
+            self.matrix[self.count - 1] = 0
+        else:
+            for values in (self.sets, self.sizes, self.groups):
+                del values[row]
+        self.count -= 1
+
+    ###### Queries ######
+    def similar(self, row, k=10, metric="jaccard", group=None):
+        """The k rows most like row (not row itself), best first, as (row, score). Rows that
+        share no ingredients are left out; group limits the search to rows in that group."""
+        if metric not in ("jaccard", "cosine"):
+            raise ValueError(f"Unknown similarity metric: {metric}")
+        if self.np:
+            return self._similar_numpy(row, k, metric, group)
+        query, size = self.sets[row], self.sizes[row]
+        scores = []
+        for other, (bits, other_size) in enumerate(zip(self.sets, self.sizes)):
+            shared = (query & bits).bit_count()
+            if shared and other != row and (group is None or self.groups[other] == group):
+                if metric == "jaccard":
+                    scores.append((shared / (size + other_size - shared), -other))
+                else:
+                    scores.append((shared / math.sqrt(size * other_size), -other))
+        return [(-other, score) for score, other in heapq.nlargest(k, scores)]
+
+    def _similar_numpy(self, row, k, metric, group):
+        np = self.np
+        query = self.matrix[row].copy()
+        columns = np.flatnonzero(query)  # only the words where the query has bits can match
+        size = self.sizes[row]
+        best_rows, best_scores = [], []
+        for start in range(0, self.count, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, self.count)
+            shared = np.zeros(end - start, dtype=np.int64)
+            for column in columns:
+                shared += popcount(np, self.matrix[start:end, column] & query[column])
+            sizes = self.sizes[start:end]
+            if metric == "jaccard":
+                scores = shared / np.maximum(size + sizes - shared, 1)
+            else:
+                scores = shared / np.sqrt(np.maximum(size * sizes, 1))
+            scores[shared == 0] = 0
+            if group is not None:
+                scores[self.groups[start:end] != group] = 0
+            if start <= row < end:
+                scores[row - start] = 0
+            # Keep this block's top k (and anything tied with the kth); the blocks' winners are merged below
+            if len(scores) > k:
+                top = np.flatnonzero(scores >= -np.partition(-scores, k - 1)[k - 1])
+            else:
+                top = np.arange(len(scores))
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        order = np.lexsort((rows, -scores))[:k]
+        return [(int(rows[i]), float(scores[i])) for i in order if scores[i] > 0]
+
+
+def popcount(np, words):
+    """Set bits in each element of a uint64 array"""
+    if hasattr(np, "bitwise_count"):  # NumPy 2
+        return np.bitwise_count(words)
+    table = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+    return table[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1)
@@ -0,0 +1,181 @@
+"""Per-operation timings and profiling for the recipe book apps, switched on by environment variables.
+
+    RECIPE_BOOK_TIMINGS=1 python project.py            # timings summary on stderr at exit
+    RECIPE_BOOK_TIMINGS=timings.txt python project.py  # ... appended to timings.txt instead
+    RECIPE_BOOK_PROFILE=1 python project.py            # cProfile the main thread, top functions on stderr at exit
+    RECIPE_BOOK_PROFILE=run.prof python project.py     # ... saved for pstats instead
+
+The apps wrap their storage, login and rendering functions with timed(), and with timings on,
+database.get_connection times every SQLite statement and counts each run of it through
+set_trace_callback. With RECIPE_BOOK_TIMINGS unset, timed() hands back the function
+untouched, so the apps run exactly as they would without this module.
+"""
+import atexit
+import functools
+import os
+import sys
+from contextlib import nullcontext
+from time import perf_counter
+
+TIMINGS = os.environ.get("RECIPE_BOOK_TIMINGS")
+PROFILE = os.environ.get("RECIPE_BOOK_PROFILE")
+enabled = bool(TIMINGS)
+
+BUCKETS = 40         # histogram buckets: bucket b holds latencies under 2**b microseconds
+PROFILE_LINES = 30   # functions listed by RECIPE_BOOK_PROFILE=1
+
+operations = {}      # operation name -> Histogram
+statements = {}      # SQL with literals replaced by ? -> [runs seen by the trace callback, Histogram of execute calls]
+if enabled:
+    import threading  # only needed when recording, so importing the apps stays cheap
+    _lock = threading.Lock()  # the JSON API records from its worker threads
+else:
+    _lock = nullcontext()
+
+
+###### Histograms ######
+class Histogram:
+    """Latencies counted in power-of-two buckets of microseconds, with the exact count, total and maximum"""
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count, self.total, self.max = 0, 0.0, 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        """Seconds under which fraction of the latencies fell, rounded up to a bucket boundary"""
+        rank, seen = fraction * self.count, 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+
+###### Recording ######
+def record(name, seconds):
+    with _lock:
+        histogram = operations.get(name)
+        if histogram is None:
+            histogram = operations[name] = Histogram()
+        histogram.add(seconds)
+
+
+def timed(name):
+    """Decorator recording the latency of every call under name, when timings are on"""
+    def decorate(func):
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+###### SQLite statements ######
+@functools.lru_cache(maxsize=4096)
+def statement_key(sql):
+    """sql on one line with its literals and parameters replaced by ?, so every run of a
+    statement is counted together whatever values it was run with"""
+    import re
+    sql = " ".join(sql.split())
+    return re.sub(r"(?<![.\w])'(?:[^']|'')*'(?!\.)|(?<![\w.])-?\d+(?:\.\d+)?\b|[:@$]\w+|\?\d*", "?", sql)
+
+
+def _statement(sql):
+    key = statement_key(sql)
+    entry = statements.get(key)
+    if entry is None:
+        entry = statements[key] = [0, Histogram()]
+    return entry
+
+
+def count_statement(sql):
+    """set_trace_callback target: SQLite is starting to run sql (expanded with its values)"""
+    with _lock:
+        _statement(sql)[0] += 1
+
+
+def record_statement(sql, seconds):
+    with _lock:
+        _statement(sql)[1].add(seconds)
+
+
+def trace_statements(conn):
+    conn.set_trace_callback(count_statement)
+
+
+###### Reports ######
+def report(file=None):
+    """Write the timings recorded so far: operations, then SQLite statements, slowest first"""
+    file = file or sys.stdout
+    with _lock:
+        rows = sorted(operations.items(), key=lambda item: item[1].total, reverse=True)
+        sql_rows = sorted(((key, runs, histogram) for key, (runs, histogram) in statements.items()),
+                          key=lambda row: (row[2].total, row[1]), reverse=True)
+        if not rows and not sql_rows:
+            print("No timings recorded.", file=file)
+            return
+        columns = f"{'Count':>8} {'Total ms':>10} {'Mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'Max ms':>8}"
+        if rows:
+            width = max(len("Operation"), *(len(name) for name, _ in rows))
+            print(f"{'Operation':<{width}} {columns}", file=file)
+            for name, histogram in rows:
+                print(f"{name:<{width}} {summary(histogram)}", file=file)
+        if sql_rows:
+            # Runs counts every row of an executemany, and grows with each trigger a statement fires
+            print(f"\n{'Runs':>8} {columns}  SQLite statement", file=file)
+            for key, runs, histogram in sql_rows:
+                print(f"{runs:>8} {summary(histogram)}  {key[:100]}", file=file)
+
+
+def summary(histogram):
+    if not histogram.count:
+        return f"{0:>8} {'':>10} {'':>9} {'':>8} {'':>8} {'':>8} {'':>8}"
+    ms = [value * 1000 for value in (histogram.total, histogram.total / histogram.count, histogram.percentile(0.5),
+                                     histogram.percentile(0.95), histogram.percentile(0.99), histogram.max)]
+    return f"{histogram.count:>8} {ms[0]:>10.2f} {ms[1]:>9.3f} {ms[2]:>8.3f} {ms[3]:>8.3f} {ms[4]:>8.3f} {ms[5]:>8.3f}"
+
+
+def write_report():
+    if TIMINGS == "1":
+        report(sys.stderr)
+    else:
+        with open(TIMINGS, "a") as file:
+            report(file)
+
+
+###### Profiling ######
+def start_profiling():
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    atexit.register(stop_profiling, profiler)
+
+
+def stop_profiling(profiler):
+    profiler.disable()
+    if PROFILE == "1":
+        import pstats
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    else:
+        profiler.dump_stats(PROFILE)
+
+
+if enabled:
+    atexit.register(write_report)
+if PROFILE:
+    start_profiling()
@@ -0,0 +1,96 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, sessions are not protected from each other
+    fcntl = None
+
+
+class StaleBookError(Exception):
+    """The book on disk was changed by another session after this one read it"""
+
+
+###### Locks ######
+_local = threading.local()  # .held: lock path -> [open lock file, depth, shared], so a thread can take a lock it already holds
+
+
+@contextmanager
+def file_lock(lock_path, shared=False):
+    """Hold an advisory lock on lock_path for the duration of the block.
+
+    Each user's book has its own lock file, so sessions only wait for sessions of the same
+    user. Shared locks are for reading; an exclusive lock waits until nobody else holds either.
+    Nesting inside a lock this thread already holds just joins it, except that an exclusive
+    lock can't be taken inside a shared one (RuntimeError): flock would let go of the shared
+    lock to upgrade it. Other threads wait for the lock like other processes do.
+    """
+    lock_path = os.path.abspath(lock_path)
+    held_locks = getattr(_local, "held", None)
+    if held_locks is None:
+        held_locks = _local.held = {}
+    held = held_locks.get(lock_path)
+    if held is not None:
+        if held[2] and not shared:
+            raise RuntimeError(f"{lock_path} is already held shared: take the exclusive lock first")
+        held[1] += 1
+        try:
+            yield
+        finally:
+            held[1] -= 1
+        return
+
+    file = open(lock_path, "a")
+    try:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        held_locks[lock_path] = [file, 1, shared]
+        try:
+            yield
+        finally:
+            del held_locks[lock_path]
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+    finally:
+        file.close()
+
+
+###### Atomic Writes ######
+@contextmanager
+def atomic_write(path, newline=""):
+    """Write a file under a temporary name and rename it over path once it is complete.
+
+    Readers see either the old file or the new one, never a half-written one, and an error
+    part way through leaves the old file untouched.
+    """
+    import tempfile  # only needed when saving, so importing the apps stays cheap
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with open(fd, mode="w", newline=newline) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def version_stamp(*paths):
+    """Identity, size and modification time of each path (None if missing).
+
+    A book whose stamp differs from the one taken when it was read has been changed since;
+    the inode catches a file replaced by atomic_write even within the same clock tick.
+    """
+    stamp = []
+    for path in paths:
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            stamp.append(None)
+        else:
+            stamp.append((info.st_ino, info.st_size, info.st_mtime_ns))
+    return tuple(stamp)
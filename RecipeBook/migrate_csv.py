@@ -0,0 +1,141 @@
+"""Copy CSV recipe books and their users into the SQLite database.
+
+Reads project.py's users.csv and <username>.csv files and oop_project.py's oopusers.csv
+and recipes/<username>.csv, and streams them into recipes.db one chunk per transaction, so
+the CSV apps can keep running and the database stays readable while it works. Progress is
+kept in the database: run it again to resume an interrupted migration or to pick up new
+users, and books that are already copied are skipped.
+
+    python migrate_csv.py
+    python migrate_csv.py --source ../users.csv .. --db /tmp/recipes.db
+"""
+import csv
+import json
+import os
+from itertools import islice
+from config import BASE_DIR, DB_FILE, RECIPES_DIR, USER_FILE
+from database import transaction
+from schema import last_recipe_id, link_recipes_after, migrate
+from bulk_io import Progress, chunked, read_recipes
+from ingredient_index import file_stamp
+from locking import file_lock
+from offset_index import finish_tail_rewrite, redo_file
+
+CHUNK_SIZE = 5000
+
+# (users file, directory of <username>.csv books) for project.py and oop_project.py
+DEFAULT_SOURCES = [
+    (os.path.join(BASE_DIR, "..", "users.csv"), os.path.join(BASE_DIR, "..")),
+    (USER_FILE, RECIPES_DIR),
+]
+
+
+def read_users(users_file):
+    """Yield (username, password) pairs from either app's users file"""
+    with open(users_file, mode="r", newline="") as file:
+        for row in csv.reader(file):
+            # oopusers.csv has a header, project.py's users.csv does not
+            if len(row) == 2 and row != ["user", "password"]:
+                yield row[0], row[1]
+
+
+def migrate_users(users_file, db_file=None, chunk_size=CHUNK_SIZE):
+    """Add every user in users_file to the database. Existing usernames keep their password."""
+    count = 0
+    for chunk in chunked(read_users(users_file), chunk_size):
+        with transaction(db_file) as conn:
+            cursor = conn.executemany("INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)", chunk)
+        count += cursor.rowcount
+    return count
+
+
+def migrate_book(username, path, db_file=None, chunk_size=CHUNK_SIZE, show_progress=False):
+    """Copy one user's CSV book, resuming after the rows an earlier run already copied.
+
+    Returns the number of recipes copied, or None if the book was skipped because it has
+    changed since its migration started (its copy in the database would no longer match).
+    The book is read under its user's shared lock, so no session saves it meanwhile.
+    """
+    source = os.path.abspath(path)
+    lock = os.path.join(os.path.dirname(source), f"{username}.lock")
+    if os.path.exists(redo_file(source)):
+        with file_lock(lock):
+            finish_tail_rewrite(source)  # a save oop_project.py was interrupted in
+    with file_lock(lock, shared=True):
+        return copy_book(username, source, db_file, chunk_size, show_progress)
+
+
+def copy_book(username, source, db_file, chunk_size, show_progress):
+    stamp = json.dumps(file_stamp(source))
+    with transaction(db_file) as conn:
+        user_id = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()[0]
+        progress_row = conn.execute("SELECT stamp, rows, finished FROM csv_migrations WHERE username = ? AND source = ?",
+                                    (username, source)).fetchone()
+        if progress_row is None:
+            conn.execute("INSERT INTO csv_migrations (username, source, stamp) VALUES (?, ?, ?)", (username, source, stamp))
+            progress_row = (stamp, 0, 0)
+    started_stamp, done, finished = progress_row
+    if started_stamp != stamp:
+        return None
+    if finished:
+        return 0
+
+    progress = Progress(f"Migrating {username}")
+    rows = islice(read_recipes(source), done, None)
+    if show_progress:
+        rows = progress.track(rows)
+    count = 0
+    for chunk in chunked(rows, chunk_size):
+        # The rows and the progress that records them commit together, so a crash never
+        # copies a chunk twice
+        with transaction(db_file) as conn:
+            last_id = last_recipe_id(conn)
+            conn.executemany("""
+                INSERT INTO recipes (user_id, category, name, ingredients, directions)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(user_id, r["Meal Category"], r["Dish Name"], r["Ingredients"], r["Cooking Directions"]) for r in chunk])
+            link_recipes_after(conn, last_id)
+            conn.execute("UPDATE csv_migrations SET rows = rows + ? WHERE username = ? AND source = ?",
+                         (len(chunk), username, source))
+        count += len(chunk)
+    with transaction(db_file) as conn:
+        conn.execute("UPDATE csv_migrations SET finished = 1 WHERE username = ? AND source = ?", (username, source))
+    if show_progress:
+        progress.report(finished=True)
+    return count
+
+
+def migrate_all(sources=DEFAULT_SOURCES, db_file=None, chunk_size=CHUNK_SIZE, show_progress=False):
+    """Migrate every users file and the books of the users it lists. Returns (users, recipes) added."""
+    migrate(db_file)
+    users = recipes = 0
+    for users_file, books_dir in sources:
+        if not os.path.exists(users_file):
+            continue
+        users += migrate_users(users_file, db_file, chunk_size)
+        for username in dict(read_users(users_file)):
+            path = os.path.join(books_dir, f"{username}.csv")
+            if not os.path.exists(path):
+                continue
+            if os.path.exists(os.path.join(books_dir, f"{username}.journal")):
+                # project.py has changes that are not in the CSV yet
+                print(f"Skipped {username}: log in and out of project.py once to fold in {username}.journal")
+                continue
+            copied = migrate_book(username, path, db_file, chunk_size, show_progress)
+            if copied is None:
+                print(f"Skipped {username}: {path} changed after it was migrated")
+            else:
+                recipes += copied
+    return users, recipes
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", nargs=2, action="append", metavar=("USERS_FILE", "BOOKS_DIR"),
+                        help="a users file and the directory holding its books (default: both apps' data)")
+    parser.add_argument("--db", default=DB_FILE, help="database to migrate into")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="recipes per transaction")
+    args = parser.parse_args()
+    users, recipes = migrate_all(args.source or DEFAULT_SOURCES, args.db, args.chunk_size, show_progress=True)
+    print(f"Migrated {users:,} users and {recipes:,} recipes into {args.db}")
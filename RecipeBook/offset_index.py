@@ -0,0 +1,188 @@
+import csv
+import io
+import json
+import mmap
+import os
+from array import array
+
+
+def text_encoding():
+    """CSV books are written in text mode, so their bytes are in the locale's encoding"""
+    import locale  # only needed to read or write a recipe, so importing the apps stays cheap
+    return locale.getpreferredencoding(False)
+
+
+def scan_records(data, start=0):
+    """Byte offsets at which each CSV record in data begins, from start on, then the end.
+
+    A newline inside a quoted field does not end a record: a record ends at the first
+    newline after an even number of quotes. Blank lines are skipped, as csv.DictReader
+    skips them.
+    """
+    offsets = array("q")
+    position, end = start, len(data)
+    while position < end:
+        record_start, quotes = position, 0
+        while True:
+            newline = data.find(b"\n", position)
+            if newline == -1:
+                position = end
+                break
+            quotes += data[position:newline].count(b'"')
+            position = newline + 1
+            if quotes % 2 == 0:
+                break
+        if data[record_start:position].strip():
+            offsets.append(record_start)
+    offsets.append(end)
+    return offsets
+
+
+def map_file(path):
+    """Memory-map path for reading (None if it is empty, which mmap cannot map)"""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+###### Tail Rewrites ######
+def redo_file(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.redo")
+
+
+def rewrite_tail(path, offset, data):
+    """Overwrite path from byte offset on with data, in place.
+
+    Only the tail is written, so this is not atomic like locking.atomic_write. Instead the
+    new tail is first saved to a redo file; if the rewrite is interrupted, finish_tail_rewrite
+    completes it before the book is next read.
+    """
+    redo = redo_file(path)
+    with open(redo, "wb") as file:
+        file.write(offset.to_bytes(8, "little") + len(data).to_bytes(8, "little") + data)
+        file.flush()
+        os.fsync(file.fileno())
+    apply_tail(path, offset, data)
+    os.remove(redo)
+
+
+def apply_tail(path, offset, data):
+    with open(path, "r+b") as file:
+        file.seek(offset)
+        file.write(data)
+        file.truncate()
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def finish_tail_rewrite(path):
+    """Complete a rewrite_tail that was interrupted. Callers hold the book's exclusive lock."""
+    redo = redo_file(path)
+    try:
+        with open(redo, "rb") as file:
+            saved = file.read()
+    except FileNotFoundError:
+        return
+    offset, length = int.from_bytes(saved[:8], "little"), int.from_bytes(saved[8:16], "little")
+    if len(saved) == 16 + length:
+        apply_tail(path, offset, saved[16:])
+    # else the redo file itself was cut short, so the book was never touched
+    os.remove(redo)
+
+
+###### Offset Index ######
+class OffsetIndex:
+    """Where each recipe starts in a CSV book, so recipe N can be read without parsing the rest.
+
+    offsets holds the byte offset of every recipe after the header row, followed by the
+    end of the file. The index describes the file as it was when built, saved or written
+    by write_tail; anything else that changes the file has to be followed by build or extend.
+    """
+
+    def __init__(self, offsets):
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def build(cls, path):
+        """Index a CSV book in one pass over its bytes"""
+        data = map_file(path)
+        if data is None:
+            return cls(array("q", [0]))
+        with data:
+            offsets = scan_records(data)
+        return cls(offsets[1:] if len(offsets) > 1 else offsets)  # the first record is the header
+
+    def extend(self, path):
+        """Index the recipes appended to the book since the index was last brought up to date"""
+        data = map_file(path)
+        if data is None:
+            return
+        with data:
+            self.offsets[-1:] = scan_records(data, self.offsets[-1])
+
+    ###### Reading ######
+    def read(self, path, position):
+        """The fields of recipe position (from 0), parsing only that record"""
+        data = map_file(path)
+        with data:
+            header = parse_record(data[:self.offsets[0]])
+            return dict(zip(header, parse_record(data[self.offsets[position]:self.offsets[position + 1]])))
+
+    ###### Writing ######
+    def splice(self, path, position, removed, rows):
+        """Replace the removed recipes from position on with rows, rewriting the CSV only from
+        position on. The recipes after the replaced ones are copied across as bytes rather
+        than encoded again. Callers hold the book's lock."""
+        encoding = text_encoding()
+        buffer = io.StringIO(newline="")
+        writer = csv.writer(buffer)
+        offsets = array("q")
+        chunks = []
+        offset = self.offsets[position]
+        for row in rows:
+            writer.writerow(row)
+            chunk = buffer.getvalue().encode(encoding)
+            buffer.seek(0)
+            buffer.truncate()
+            offsets.append(offset)
+            chunks.append(chunk)
+            offset += len(chunk)
+        kept = self.offsets[position + removed]
+        with open(path, "rb") as file:
+            file.seek(kept)
+            chunks.append(file.read())
+        rewrite_tail(path, self.offsets[position], b"".join(chunks))
+        shift = offset - kept
+        offsets.extend(start + shift for start in self.offsets[position + removed:])
+        self.offsets[position:] = offsets
+
+    ###### Sidecar file ######
+    def save(self, path, stamp):
+        """Write the offsets next to the recipe book, after a line holding the book's file stamp"""
+        # Renamed into place, so a session reading the offsets never sees them half written
+        temp_path = os.path.join(os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.{os.getpid()}.tmp")
+        with open(temp_path, mode="wb") as file:
+            file.write(json.dumps(stamp).encode() + b"\n")
+            self.offsets.tofile(file)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, stamp):
+        """Read saved offsets, or return None if they are missing or the book has changed since"""
+        try:
+            with open(path, mode="rb") as file:
+                saved_stamp = json.loads(file.readline())
+                offsets = array("q", file.read())
+        except (OSError, ValueError):
+            return None
+        if saved_stamp != stamp or not offsets:
+            return None
+        return cls(offsets)
+
+
+def parse_record(data):
+    return next(csv.reader(io.StringIO(data.decode(text_encoding()), newline="")), [])
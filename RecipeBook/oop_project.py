@@ -1,16 +1,24 @@
 import csv
 import os
 import getpass
-import textwrap
-from tabulate import tabulate
-from pyfiglet import Figlet
+import sys
 from pathlib import Path
 from config import USER_FILE, RECIPES_DIR
+import banner
+from bulk_io import Progress, read_recipes, write_recipes
+from ingredient_index import IngredientIndex, file_stamp
+from instrumentation import timed
+from locking import StaleBookError, atomic_write, file_lock, version_stamp
+from offset_index import OffsetIndex, finish_tail_rewrite, redo_file
+from pager import PAGE_SIZE, page_count, view_pages
+from table_renderer import RecipeTable
+from storage import RecipeStore, recipes_menu
+from user_directory import UserDirectory
+from batch import FIELD_ATTRIBUTES
 
-if not os.path.exists(RECIPES_DIR):
-    os.makedirs(RECIPES_DIR)
-
-f = Figlet(font="small")
+# Registered users, re-read from USER_FILE only when it changes
+user_directory = UserDirectory(USER_FILE, header=True)
+recipe_table = RecipeTable(["No.", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"])
 
 ###### User Management ######
 class User:
@@ -21,12 +29,10 @@ class User:
     @classmethod
     def register(cls):
         """Creates a new user or redirects to login if username already exists"""
-        users_data = cls.load_users()
-
         while True:
             username = input("Enter a username: ").lower().strip()
 
-            if username in users_data:
+            if username in user_directory:
                 print("Username already exists. Redirecting to login...")
                 # Redirect to the login process for the existing username
                 user = cls.login(existing_user=username)
@@ -36,34 +42,20 @@ class User:
             else:
                 # If username doesn't exist, proceed to register
                 password = getpass.getpass(f"Enter a password for {username}: ").strip()
-
-                if not os.path.exists(USER_FILE):
-                    with open(USER_FILE, mode="w", newline="") as file:
-                        writer = csv.DictWriter(file, fieldnames=["user", "password"])
-                        writer.writeheader()
-
-                with open(USER_FILE, "a", newline="") as file:
-                    writer = csv.DictWriter(file, fieldnames=["user", "password"])
-                    writer.writerow({"user": username, "password": password})
+                user_directory.register(username, password)
 
                 print(f"User {username} has been registered successfully!")
                 return cls(username, password)
 
     @staticmethod
+    @timed("auth.load_users")
     def load_users():
-        """Load all users from CSV"""
-        users = {}
-        if os.path.exists(USER_FILE):
-            with open(USER_FILE, mode="r", newline="") as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    users[row["user"]] = row["password"]
-        return users
+        """All users from CSV, as username -> stored password"""
+        return user_directory.users()
 
     @classmethod
     def login(cls, existing_user=None):
         """Authenticate user login"""
-        users_data = cls.load_users()
         attempts = 0
         while attempts < 3:
             if existing_user:
@@ -73,9 +65,10 @@ class User:
 
             password = getpass.getpass("Enter your password: ").strip()
 
-            if username in users_data and users_data[username] == password:
+            user = cls.authenticate(username, password)
+            if user:
                 print(f"Welcome, {username}!")
-                return cls(username, password)
+                return user
             else:
                 attempts += 1
                 print(f"Invalid credentials. Attempts left: {3 - attempts}")
@@ -83,15 +76,35 @@ class User:
         print("Failed to login after 3 attempts.")
         return None
 
+    @classmethod
+    @timed("auth.authenticate")
+    def authenticate(cls, username, password):
+        """Return the user if the password matches, otherwise None"""
+        return cls(username, password) if user_directory.verify(username, password) else None
+
 
 ##### Recipe ######
+FIELDNAMES = ["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
+
 class Recipe:
+    # A book holds many recipes: __slots__ drops the per-object __dict__, and the handful of
+    # meal categories are interned so every recipe in a category shares one string
+    __slots__ = ("category", "name", "ingredients", "directions")
+
     def __init__(self, category, name, ingredients, directions):
-        self.category = category
+        self.category = sys.intern(category)
         self.name = name
         self.ingredients = ingredients
         self.directions = directions
 
+    @classmethod
+    def from_dict(cls, row):
+        return cls(row.get("Meal Category") or "", row.get("Dish Name") or "",
+                   row.get("Ingredients") or "", row.get("Cooking Directions") or "")
+
+    def to_row(self):
+        return (self.category, self.name, self.ingredients, self.directions)
+
     def to_dict(self):
         return {
             "Meal Category": self.category,
@@ -101,86 +114,360 @@ class Recipe:
         }
 
 ###### Recipe Book ######
-class RecipeBook:
+class RecipeBook(RecipeStore):
+    search_label = "Find by Ingredients"
+
     def __init__(self, username):
         self.username = username
+        self.version = None  # version stamp of the CSV as last read or written by this book
+        self.offsets = None  # where each recipe starts in the CSV, when they line up with self.recipes
         self.recipes = self.load_user_recipes()
+        self.index = self.load_ingredient_index()
 
-    def load_user_recipes(self):
-        filename = Path(RECIPES_DIR) / f"{self.username}.csv"
-        recipes = []
+    def reload(self):
+        self.recipes = self.load_user_recipes()
+        self.index = self.load_ingredient_index()
+
+    def book_file(self):
+        return Path(RECIPES_DIR) / f"{self.username}.csv"
+
+    def lock(self, shared=False):
+        """Lock this user's book against other sessions (other users' books are not affected)"""
+        os.makedirs(RECIPES_DIR, exist_ok=True)
+        return file_lock(Path(RECIPES_DIR) / f"{self.username}.lock", shared)
+
+    def check_version(self):
+        if version_stamp(self.book_file()) != self.version:
+            raise StaleBookError(f"{self.username}'s recipe book was changed in another session")
+
+    def iter_recipes(self):
+        """Yield the recipes in the user's CSV file one row at a time"""
+        filename = self.book_file()
         if filename.exists():
+            with self.lock(shared=True), open(filename, mode='r', newline='') as file:
+                yield from csv.DictReader(file)
+
+    @timed("storage.load_user_recipes")
+    def load_user_recipes(self):
+        """Read the user's CSV into Recipe objects. Raises ValueError if a row is malformed."""
+        filename = self.book_file()
+        if os.path.exists(redo_file(filename)):
+            with self.lock():
+                finish_tail_rewrite(filename)  # a save that was interrupted part way through
+        with self.lock(shared=True):
+            self.version = version_stamp(filename)
+            self.offsets = None
+            if not filename.exists():
+                return []
             with open(filename, mode='r', newline='') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    recipes.append(row)
-        return recipes
-
-    def save_user_recipes(self):
-        filename = Path(RECIPES_DIR) / f"{self.username}.csv"
-        with open(filename, mode='w', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"])
-            writer.writeheader()
-            writer.writerows(self.recipes)
-
-    def add_recipe(self):
-        category = input("Enter Meal Category: ").strip()
-        name = input("Enter Dish Name: ").strip()
-        ingredients = input("Enter Ingredients (comma-separated): ").strip()
-        directions = input("Enter Cooking Directions: ").strip()
-
-        recipe = Recipe(category, name, ingredients, directions)
-        self.recipes.append(recipe.to_dict())
-        self.save_user_recipes()
+                reader = csv.reader(file)
+                header = next(reader, None)
+                if header != FIELDNAMES:
+                    return [Recipe.from_dict(dict(zip(header, row))) for row in reader]
+                # The usual layout: skip building a dict for every row (blank lines are skipped, as csv.DictReader does)
+                try:
+                    recipes = [Recipe(*row) for row in reader if row]
+                except TypeError:  # not four fields: refuse the book rather than lose the row at the next save
+                    raise ValueError(f"{filename} line {reader.line_num} does not have the 4 recipe fields; "
+                                     "fix it by hand before opening the book") from None
+            offsets = OffsetIndex.load(self.offsets_file(), file_stamp(filename))
+            if offsets is not None and len(offsets) == len(recipes):
+                self.offsets = offsets
+            return recipes
+
+    @timed("storage.save_user_recipes")
+    def save_user_recipes(self, position=None, removed=None, added=None):
+        """Save the book to the user's CSV.
+
+        When the recipe offsets are known and the change is described, only the CSV from
+        recipe position on is rewritten: removed recipes there were replaced by the next added
+        recipes in self.recipes (by default, everything from position on changed). Otherwise
+        the whole book is written to a temporary file and renamed over the CSV. Raises
+        StaleBookError, leaving the file alone, if another session saved the book since this
+        one read it.
+        """
+        filename = self.book_file()
+        with self.lock():
+            self.check_version()
+            if position is not None and self.offsets is not None and position <= len(self.offsets):
+                removed = len(self.offsets) - position if removed is None else removed
+                added = len(self.recipes) - position if added is None else added
+                rows = (recipe.to_row() for recipe in self.recipes[position:position + added])
+                self.offsets.splice(filename, position, removed, rows)
+            else:
+                with atomic_write(filename) as file:
+                    writer = csv.writer(file)
+                    writer.writerow(FIELDNAMES)
+                    writer.writerows(recipe.to_row() for recipe in self.recipes)
+                self.offsets = OffsetIndex.build(filename)
+            self.version = version_stamp(filename)
+            self.offsets.save(self.offsets_file(), file_stamp(filename))
+        self.index.save(self.index_file(), file_stamp(filename))
+
+    def offsets_file(self):
+        return Path(RECIPES_DIR) / f"{self.username}.offsets"
+
+    def index_file(self):
+        return Path(RECIPES_DIR) / f"{self.username}.ingredients.json"
+
+    @timed("storage.load_ingredient_index")
+    def load_ingredient_index(self):
+        """Load the saved ingredient index, or build it if the book changed since it was saved"""
+        stamp = file_stamp(self.book_file())
+        index = IngredientIndex.load(self.index_file(), stamp)
+        if index is None or len(index) != len(self.recipes):
+            index = IngredientIndex.build(recipe.ingredients for recipe in self.recipes)
+        return index
+
+    def count_recipes(self):
+        return len(self.recipes)
+
+    def add_recipe(self, recipe=None):
+        if isinstance(recipe, dict):
+            recipe = Recipe.from_dict(recipe)
+        elif recipe is None:
+            category = input("Enter Meal Category: ").strip()
+            name = input("Enter Dish Name: ").strip()
+            ingredients = input("Enter Ingredients (comma-separated): ").strip()
+            directions = input("Enter Cooking Directions: ").strip()
+            recipe = Recipe(category, name, ingredients, directions)
+
+        self.recipes.append(recipe)
+        self.index.add(recipe.ingredients)
+        self.save_user_recipes(len(self.recipes) - 1, removed=0, added=1)
         print("Recipe added successfully!")
 
-    def edit_recipe(self):
-        self.list_recipes()
+    def edit_recipe(self, choice=None, changes=None):
+        """Edit the recipe at position choice. changes maps attribute names (category, name,
+        ingredients, directions) to new values; without them the user is asked."""
         try:
-            choice = int(input("Enter the number of the recipe to edit: ")) - 1
-            if 0 <= choice < len(self.recipes):
+            if choice is None:
+                self.view_recipes("Choose a recipe")
+                choice = int(input("Enter the number of the recipe to edit: ")) - 1
+            if 0 <= choice < len(self.recipes) and changes is not None:
+                recipe = self.recipes[choice]
+                for attribute, value in changes.items():
+                    if attribute in Recipe.__slots__:
+                        setattr(recipe, attribute, sys.intern(value) if attribute == "category" else value)
+                self.index.update(choice, recipe.ingredients)
+                self.save_user_recipes(choice, removed=1, added=1)
+                print("Recipe updated successfully!")
+            elif 0 <= choice < len(self.recipes):
                 recipe = self.recipes[choice]
-                recipe["Meal Category"] = input(f"Enter new Meal Category (current: {recipe['Meal Category']}): ").strip() or recipe["Meal Category"]
-                recipe["Dish Name"] = input(f"Enter new Dish Name (current: {recipe['Dish Name']}): ").strip() or recipe["Dish Name"]
-                recipe["Ingredients"] = input(f"Enter new Ingredients (current: {recipe['Ingredients']}): ").strip() or recipe["Ingredients"]
-                recipe["Cooking Directions"] = input(f"Enter new Cooking Directions (current: {recipe['Cooking Directions']}): ").strip() or recipe["Cooking Directions"]
-                self.save_user_recipes()
+                recipe.category = sys.intern(input(f"Enter new Meal Category (current: {recipe.category}): ").strip() or recipe.category)
+                recipe.name = input(f"Enter new Dish Name (current: {recipe.name}): ").strip() or recipe.name
+                recipe.ingredients = input(f"Enter new Ingredients (current: {recipe.ingredients}): ").strip() or recipe.ingredients
+                recipe.directions = input(f"Enter new Cooking Directions (current: {recipe.directions}): ").strip() or recipe.directions
+                self.index.update(choice, recipe.ingredients)
+                self.save_user_recipes(choice, removed=1, added=1)
                 print("Recipe updated successfully!")
             else:
                 print("Invalid choice.")
         except ValueError:
             print("Invalid input.")
 
-    def delete_recipe(self):
-        self.list_recipes()
+    def delete_recipe(self, choice=None):
         try:
-            choice = int(input("Enter the number of the recipe to delete: ")) - 1
+            if choice is None:
+                self.view_recipes("Choose a recipe")
+                choice = int(input("Enter the number of the recipe to delete: ")) - 1
             if 0 <= choice < len(self.recipes):
                 del self.recipes[choice]
-                self.save_user_recipes()
+                self.index.remove(choice)
+                self.save_user_recipes(choice, removed=1, added=0)
                 print("Recipe deleted successfully!")
             else:
                 print("Invalid choice.")
         except ValueError:
             print("Invalid input.")
 
-    def list_recipes(self):
-        if self.recipes:
-            headers = ["No.", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
+    @timed("storage.import_recipes")
+    def import_recipes(self, source, show_progress=False):
+        """Append every recipe in a CSV or JSONL file (such as another user's book) in one buffered write"""
+        filename = self.book_file()
+        if filename.exists() and os.path.exists(source) and os.path.samefile(source, filename):
+            raise ValueError("A recipe book cannot be imported into itself")
+
+        progress = Progress(f"Importing into {self.username}")
+        rows = read_recipes(source)
+        if show_progress:
+            rows = progress.track(rows)
+
+        def remember(rows):
+            for row in rows:
+                recipe = Recipe.from_dict(row)
+                self.recipes.append(recipe)
+                self.index.add(recipe.ingredients)
+                yield row
+
+        with self.lock():
+            self.check_version()
+            count = write_recipes(remember(rows), filename, header=not filename.exists(), mode="a")
+            self.version = version_stamp(filename)
+            if self.offsets is not None:
+                self.offsets.extend(filename)
+                self.offsets.save(self.offsets_file(), file_stamp(filename))
+        self.index.save(self.index_file(), file_stamp(filename))
+        if show_progress:
+            progress.report(finished=True)
+        return count
+
+    @timed("storage.export_recipes")
+    def export_recipes(self, destination, show_progress=False):
+        """Stream the saved book to a CSV or JSONL file"""
+        progress = Progress(f"Exporting {self.username}")
+        rows = self.iter_recipes()
+        if show_progress:
+            rows = progress.track(rows)
+        count = write_recipes(rows, destination)
+        if show_progress:
+            progress.report(finished=True)
+        return count
+
+    def find_recipes(self):
+        """Find recipes that can be made with the ingredients the user has on hand"""
+        have = input("Enter the ingredients you have (comma-separated), or nothing to find recipes like one of yours: ")
+        if not have.strip():
+            self.find_similar_recipes()
+            return
+        have = have.split(",")
+        mode = input("Show recipes that use 1 - all of them, 2 - any of them, 3 - them with a few missing: ").strip()
+        if mode == "1":
+            positions = self.index.contains_all(have)
+        elif mode == "2":
+            positions = self.index.contains_any(have)
+        elif mode == "3":
+            try:
+                positions = self.index.missing_at_most(have, int(input("How many missing ingredients are OK? ")))
+            except ValueError:
+                print("Invalid input.")
+                return
+        else:
+            print("Invalid choice.")
+            return
+        self.list_recipes(positions)
+
+    def find_similar_recipes(self):
+        """Show the recipes whose ingredients are most like those of a recipe the user picks"""
+        try:
+            choice = int(input("Enter the number of the recipe: ")) - 1
+        except ValueError:
+            choice = -1
+        if 0 <= choice < len(self.recipes):
+            self.list_recipes([position for position, _ in self.index.similar(choice)])
+        else:
+            print("Invalid choice.")
+
+    search_recipes = find_recipes
+
+    def view_recipes(self, done_label="Back to menu"):
+        """Show the book one page at a time"""
+        if not self.recipes:
+            print("No recipes found.")
+            return
+
+        def show_page(page):
+            start = page * PAGE_SIZE
+            self.list_recipes(range(start, min(start + PAGE_SIZE, len(self.recipes))))
+
+        view_pages(show_page, page_count(len(self.recipes)), done_label)
+
+    @timed("render.list_recipes")
+    def list_recipes(self, positions=None):
+        if positions is None:
+            positions = range(len(self.recipes))
+        if positions:
             rows = []
-            for idx, recipe in enumerate(self.recipes, start=1):
-                wrapped_ingredients = "\n".join(textwrap.wrap(recipe.get("Ingredients", ""), width=25))
-                wrapped_directions = "\n".join(textwrap.wrap(recipe.get("Cooking Directions", ""), width=40))
-                rows.append([idx, recipe.get("Meal Category", ""), recipe.get("Dish Name", ""), wrapped_ingredients, wrapped_directions])
-            print(tabulate(rows, headers=headers, tablefmt="rounded_grid"))
+            for position in positions:
+                rows.append((position + 1, *self.recipes[position].to_row()))
+            recipe_table.write(rows)
         else:
             print("No recipes found.")
 
+###### Batch Mode ######
+class BatchBook:
+    """A user's book for the batch commands in batch.py. Keys are recipe numbers, from 1.
+
+    Changes are saved once, when the batch is done, instead of rewriting the CSV after
+    every command, and only from the first recipe they touched on.
+    """
+
+    def __init__(self, username):
+        if username not in user_directory:
+            raise ValueError(f"Unknown user {username}")
+        self.book = RecipeBook(username)
+        self.first_changed = None  # position of the first recipe changed since the last save
+
+    def changed(self, position):
+        self.first_changed = position if self.first_changed is None else min(self.first_changed, position)
+
+    def numbered(self, position):
+        return {"No.": position + 1, **self.book.recipes[position].to_dict()}
+
+    def position(self, key):
+        position = int(key) - 1
+        if not 0 <= position < len(self.book.recipes):
+            raise KeyError(f"No recipe number {key}")
+        return position
+
+    def add(self, recipe):
+        recipe = Recipe.from_dict(recipe)
+        self.book.recipes.append(recipe)
+        self.book.index.add(recipe.ingredients)
+        self.changed(len(self.book.recipes) - 1)
+        return self.numbered(len(self.book.recipes) - 1)
+
+    def get(self, key):
+        return self.numbered(self.position(key))
+
+    def list(self, offset=0, limit=None):
+        end = len(self.book.recipes) if limit is None else min(offset + limit, len(self.book.recipes))
+        return [self.numbered(position) for position in range(offset, end)]
+
+    def edit(self, key, changes):
+        position = self.position(key)
+        recipe = self.book.recipes[position]
+        for field, value in changes.items():
+            setattr(recipe, FIELD_ATTRIBUTES[field], sys.intern(value) if field == "Meal Category" else value)
+        self.book.index.update(position, recipe.ingredients)
+        self.changed(position)
+        return self.numbered(position)
+
+    def delete(self, key):
+        position = self.position(key)
+        recipe = self.numbered(position)
+        del self.book.recipes[position]
+        self.book.index.remove(position)
+        self.changed(position)
+        return recipe
+
+    def search(self, query, limit=10):
+        """Recipes that use every one of the comma-separated ingredients in query"""
+        return [self.numbered(position) for position in self.book.index.contains_all(query.split(","))[:limit]]
+
+    def import_file(self, path):
+        self.flush()
+        return self.book.import_recipes(path)
+
+    def export_file(self, path):
+        self.flush()
+        return self.book.export_recipes(path)
+
+    def flush(self):
+        if self.first_changed is not None:
+            self.book.save_user_recipes(self.first_changed)
+            self.first_changed = None
+
+    def recover(self, error):
+        if isinstance(error, StaleBookError):
+            self.book.reload()
+            self.first_changed = None
+
 ###### Recipe Book App (flow) ######
 class RecipeBookApp:
     @staticmethod
     def main_menu():
-        print(f.renderText("Welcome to your digital Recipe Book"))
+        print(banner.render_banner("Welcome to your digital Recipe Book"))
         while True:
             choice = input("1 to Register, 2 to Login, 3 to Exit: ").strip()
             if choice == "1":
@@ -199,31 +486,22 @@ class RecipeBookApp:
 
     @staticmethod
     def recipes_menu(user):
-        recipe_book = RecipeBook(user.username)
-        while True:
-            choice = input("\n1 - Add Recipe, 2 - Edit Recipe, 3 - Delete Recipe, 4 - View Recipes, 5 - Logout: ").strip()
-            if choice == "1":
-                recipe_book.add_recipe()
-            elif choice == "2":
-                recipe_book.edit_recipe()
-            elif choice == "3":
-                recipe_book.delete_recipe()
-            elif choice == "4":
-                recipe_book.list_recipes()
-            elif choice == "5":
-                print("Logging out...")
-                exit_choice = input("Do you want to exit the program? (y/n): ").strip().lower()
-                if exit_choice == "y":
-                    print("Goodbye!")
-                    exit()  # Exit the program entirely
-                elif exit_choice == "n":
-                    print("Returning to your recipes menu...")
-                    continue  # Stay in the recipes menu
-                else:
-                    print("Invalid input, returning to your recipes menu...")
-            else:
-                print("Invalid option.")
+        try:
+            book = RecipeBook(user.username)
+        except ValueError as error:
+            print(error)
+            return
+        recipes_menu(book)
 
 # Entry point
 if __name__ == "__main__":
+    import argparse
+    from batch import add_batch_commands, run_batch
+    parser = argparse.ArgumentParser(description="Digital Recipe Book")
+    banner.add_banner_option(parser)
+    add_batch_commands(parser)
+    args = parser.parse_args()
+    if args.command or args.stdin_jsonl:
+        raise SystemExit(run_batch(args, BatchBook))
+    banner.show_banner = not args.no_banner
     RecipeBookApp.main_menu()
@@ -0,0 +1,48 @@
+import math
+
+PAGE_SIZE = 10
+
+
+def page_count(total, page_size=PAGE_SIZE):
+    return max(1, math.ceil(total / page_size))
+
+
+def view_pages(show_page, pages, done_label="Back to menu"):
+    """Let the user move through pages one screen at a time.
+
+    show_page(page) renders a single page (numbered from 0), so only the rows on screen
+    are ever formatted, however big the book is.
+    """
+    page, shown = 0, None
+    while True:
+        if page != shown:
+            show_page(page)
+            shown = page
+        if pages == 1:
+            return
+        print(f"Page {page + 1} of {pages}")
+        choice = input(f"n - Next, p - Previous, j - Jump to page, q - {done_label}: ").strip().lower()
+        if choice in ("n", ""):
+            if page + 1 < pages:
+                page += 1
+            else:
+                print("This is the last page.")
+        elif choice == "p":
+            if page > 0:
+                page -= 1
+            else:
+                print("This is the first page.")
+        elif choice == "j":
+            try:
+                number = int(input(f"Page number (1-{pages}): "))
+            except ValueError:
+                print("Invalid page number.")
+                continue
+            if 1 <= number <= pages:
+                page = number - 1
+            else:
+                print("Invalid page number.")
+        elif choice == "q":
+            return
+        else:
+            print("Invalid option.")
@@ -0,0 +1,103 @@
+import sys
+import threading
+from collections import OrderedDict
+
+MAX_BYTES = 64 * 1024 * 1024  # default bound on the cached values of one database
+
+
+###### Query Cache ######
+class QueryCache:
+    """Recent query results of every user of one database, least recently used evicted first.
+
+    Each user's entries are tagged with the generation their rows were read at: a counter in
+    users.generation that triggers bump on every insert, update and delete of one of the
+    user's recipes, whichever process made it. A lookup is given the generation the database
+    holds now, and when it has moved on all of that user's entries are dropped. A session's
+    own writes are applied to the cache instead (write_through), so they don't empty it.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (user ID, key) -> (value, size in bytes)
+        self.user_keys = {}           # user ID -> keys of that user's entries
+        self.generations = {}         # user ID -> generation that user's entries were read at
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()  # the JSON API shares one cache between its threads
+
+    def get(self, user_id, generation, key):
+        """The cached value, or None if it isn't cached for this generation"""
+        with self.lock:
+            self._check(user_id, generation)
+            entry = self.entries.get((user_id, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((user_id, key))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, generation, key, value):
+        """Cache a value read at generation (ignored if the user has written since)"""
+        with self.lock:
+            if self.generations.setdefault(user_id, generation) == generation:
+                self.store(user_id, key, value)
+
+    def write_through(self, user_id, before, after, update):
+        """Move the user's entries from generation before to after, the generation a write this
+        session just committed left behind, by calling update(cache) to apply the write to
+        them. If another session wrote in between, the entries are dropped instead."""
+        with self.lock:
+            if self.generations.get(user_id) == before:
+                update(self)
+            else:
+                self._clear(user_id)
+            self.generations[user_id] = after
+
+    # Used by write_through updates, which already hold the lock
+    def peek(self, user_id, key):
+        entry = self.entries.get((user_id, key))
+        return None if entry is None else entry[0]
+
+    def store(self, user_id, key, value):
+        size = value_size(key) + value_size(value)
+        if size > self.max_bytes:
+            return
+        self.discard(user_id, key)
+        self.entries[(user_id, key)] = (value, size)
+        self.user_keys.setdefault(user_id, set()).add(key)
+        self.size += size
+        while self.size > self.max_bytes:
+            (old_user, old_key), (_, old_size) = self.entries.popitem(last=False)
+            self.user_keys[old_user].discard(old_key)
+            self.size -= old_size
+            self.evictions += 1
+
+    def discard(self, user_id, key):
+        entry = self.entries.pop((user_id, key), None)
+        if entry is not None:
+            self.user_keys[user_id].discard(key)
+            self.size -= entry[1]
+
+    def keys(self, user_id):
+        return list(self.user_keys.get(user_id, ()))
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    def _check(self, user_id, generation):
+        if self.generations.get(user_id) != generation:
+            self._clear(user_id)
+            self.generations[user_id] = generation
+
+    def _clear(self, user_id):
+        for key in self.user_keys.pop(user_id, ()):
+            self.size -= self.entries.pop((user_id, key))[1]
+
+
+def value_size(value):
+    """Roughly how many bytes value takes, counting the items of tuples"""
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(value_size(item) for item in value)
+    return sys.getsizeof(value)
@@ -0,0 +1,211 @@
+from database import transaction
+from ingredient_index import split_ingredients
+
+# Schema migrations, applied in order. The database records the last one it has run in
+# PRAGMA user_version, so existing recipes.db files are upgraded in place at startup.
+# Never edit a migration that has shipped; append a new one instead.
+MIGRATIONS = []
+
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+
+@migration
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recipes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            name TEXT NOT NULL,
+            ingredients TEXT NOT NULL,
+            directions TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+
+@migration
+def add_recipe_indexes(conn):
+    # Listing a user's book in id order (and paging through it) walks this index
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recipes_user_id ON recipes (user_id, id)")
+    # Browsing a user's book by category and dish name
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recipes_user_category_name ON recipes (user_id, category, name)")
+    conn.execute("ANALYZE")
+
+
+@migration
+def add_recipe_search(conn):
+    # Full-text index over recipes. The owner column holds "u<user_id>" so a search can be
+    # limited to one user's book inside the index itself. It is computed by the view the
+    # index reads its content from (needed for snippets), and kept in sync by the triggers.
+    # owner comes last so snippets prefer the recipe columns.
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS recipes_fts_source AS
+        SELECT id, category, name, ingredients, directions, 'u' || user_id AS owner FROM recipes
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+            category, name, ingredients, directions, owner,
+            content='recipes_fts_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    # (executescript would commit the migration's transaction, so one statement at a time)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recipes_fts_insert AFTER INSERT ON recipes BEGIN
+            INSERT INTO recipes_fts (rowid, category, name, ingredients, directions, owner)
+            VALUES (new.id, new.category, new.name, new.ingredients, new.directions, 'u' || new.user_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recipes_fts_delete AFTER DELETE ON recipes BEGIN
+            INSERT INTO recipes_fts (recipes_fts, rowid, category, name, ingredients, directions, owner)
+            VALUES ('delete', old.id, old.category, old.name, old.ingredients, old.directions, 'u' || old.user_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recipes_fts_update AFTER UPDATE ON recipes BEGIN
+            INSERT INTO recipes_fts (recipes_fts, rowid, category, name, ingredients, directions, owner)
+            VALUES ('delete', old.id, old.category, old.name, old.ingredients, old.directions, 'u' || old.user_id);
+            INSERT INTO recipes_fts (rowid, category, name, ingredients, directions, owner)
+            VALUES (new.id, new.category, new.name, new.ingredients, new.directions, 'u' || new.user_id);
+        END
+    """)
+    conn.execute("INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild')")
+
+
+@migration
+def add_csv_migrations(conn):
+    # Progress of migrate_csv.py: how many rows of each CSV book have been copied, so an
+    # interrupted migration picks up where it stopped and a finished one is not repeated
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS csv_migrations (
+            username TEXT NOT NULL,
+            source TEXT NOT NULL,
+            stamp TEXT NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            finished INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, source)
+        )
+    """)
+
+
+@migration
+def add_recipe_ingredients(conn):
+    # Each recipe's normalized ingredients (ingredient_index.split_ingredients), so ingredient
+    # queries use indexes instead of LIKE scans. recipes.ingredients stays as the text people
+    # typed, which is what the apps show and the search index reads. recipe_ingredients
+    # repeats the recipe's user_id so questions about one user's book are answered from its
+    # own index.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingredients (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recipe_ingredients (
+            recipe_id INTEGER NOT NULL,
+            ingredient_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (recipe_id, ingredient_id),
+            FOREIGN KEY (recipe_id) REFERENCES recipes (id),
+            FOREIGN KEY (ingredient_id) REFERENCES ingredients (id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_user ON recipe_ingredients (user_id, ingredient_id, recipe_id)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recipe_ingredients_delete AFTER DELETE ON recipes BEGIN
+            DELETE FROM recipe_ingredients WHERE recipe_id = old.id;
+        END
+    """)
+    link_recipes_after(conn, 0)  # every recipe already in the database
+    conn.execute("ANALYZE")
+
+
+@migration
+def add_user_generations(conn):
+    # A counter per user, bumped by every insert, update and delete of one of their recipes
+    # from any process, so a session can tell whether its cached queries are still current
+    # (query_cache.QueryCache) with one primary key lookup
+    conn.execute("ALTER TABLE users ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recipes_generation_insert AFTER INSERT ON recipes BEGIN
+            UPDATE users SET generation = generation + 1 WHERE id = new.user_id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recipes_generation_update AFTER UPDATE ON recipes BEGIN
+            UPDATE users SET generation = generation + 1 WHERE id IN (old.user_id, new.user_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS recipes_generation_delete AFTER DELETE ON recipes BEGIN
+            UPDATE users SET generation = generation + 1 WHERE id = old.user_id;
+        END
+    """)
+
+
+def schema_version(db_file=None):
+    with transaction(db_file, write=False) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_file=None):
+    """Bring the database up to the latest schema version, one transaction per migration.
+    The version is read again once each transaction holds the write lock, so processes
+    starting together never run the same migration twice."""
+    if schema_version(db_file) >= len(MIGRATIONS):  # up to date, without waiting for the write lock
+        return len(MIGRATIONS)
+    while True:
+        with transaction(db_file) as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                return len(MIGRATIONS)
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
+
+###### Ingredients ######
+# Recipes are added and edited from Python, which splits their ingredients the same way the
+# CSV apps do, so these are called inside the transaction that writes the recipes.
+def link_ingredients(conn, recipes):
+    """Record the ingredients of each (recipe ID, user ID, ingredients text) in recipes,
+    replacing any the recipe had before"""
+    recipes = [(recipe_id, user_id, split_ingredients(text)) for recipe_id, user_id, text in recipes]
+    names = list({name for _, _, ingredients in recipes for name in ingredients})
+    conn.executemany("INSERT OR IGNORE INTO ingredients (name) VALUES (?)", ((name,) for name in names))
+    ids = ingredient_ids(conn, names)
+    conn.executemany("DELETE FROM recipe_ingredients WHERE recipe_id = ?", ((recipe_id,) for recipe_id, _, _ in recipes))
+    conn.executemany("INSERT INTO recipe_ingredients (recipe_id, ingredient_id, user_id) VALUES (?, ?, ?)",
+                     ((recipe_id, ids[name], user_id) for recipe_id, user_id, ingredients in recipes for name in ingredients))
+
+
+def link_recipes_after(conn, recipe_id, batch_size=5000):
+    """link_ingredients for every recipe with an ID above recipe_id, such as those a bulk insert just added"""
+    cursor = conn.execute("SELECT id, user_id, ingredients FROM recipes WHERE id > ? ORDER BY id", (recipe_id,))
+    while rows := cursor.fetchmany(batch_size):
+        link_ingredients(conn, rows)
+
+
+def last_recipe_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM recipes").fetchone()[0]
+
+
+def ingredient_ids(conn, names, batch_size=500):
+    """Ingredient name -> ID for names that are in the ingredients table"""
+    ids = {}
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        ids.update(conn.execute(f"SELECT name, id FROM ingredients WHERE name IN ({', '.join('?' * len(batch))})", batch))
+    return ids
@@ -0,0 +1,302 @@
+"""Sharded SQLite storage: each user's recipes live in one of several database files.
+
+SQLite lets one writer at a time into a database, so with every user in recipes.db all of
+their writes queue behind each other. In sharded mode users are spread over recipes-0.db,
+recipes-1.db, ... in SHARD_DIR, each an ordinary recipe database that db_recipes.RecipeBook
+works on unchanged, and writes to different shards go through different write locks.
+
+A small catalog (catalog.db) lists the shards and the shard of every user. A new user is
+placed by rendezvous hashing of their username: the shard whose hash with the username is
+highest. When the number of shards changes, only the users whose highest-hashing shard has
+changed are moved, one at a time while the recipe book stays in use:
+
+    python shards.py resize 8          # add shards 4-7, then move the users that belong there
+    python shards.py status
+    python shards.py count             # users and recipes over every shard
+    python shards.py search "garlic bread"
+"""
+import hashlib
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from config import SHARD_DIR
+from database import get_connection, transaction
+from db_recipes import User, ensure_database, fts_query, similarity_indexes
+from schema import last_recipe_id, link_recipes_after
+from write_queue import WriteQueue
+
+FAN_OUT_WORKERS = 8  # threads querying shards at once for queries over every shard
+MOVE_CHUNK = 1000    # recipes copied per transaction when moving a user
+MOVE_ATTEMPTS = 5    # copies of a user who keeps writing made before a move gives up
+USER_ROW = "SELECT id, password, generation FROM users WHERE username = ?"
+
+
+def shard_for(username, shards):
+    """The shard number, of shards, that username belongs on"""
+    return max(shards, key=lambda shard: hashlib.blake2b(f"{shard}:{username}".encode(), digest_size=8).digest())
+
+
+###### Shard Catalog ######
+class ShardCatalog:
+    """The shards of one sharded recipe book and the users on each.
+
+    Moving a user copies their recipes to the target shard a chunk at a time, without the
+    source shard's write lock, so their writes carry on meanwhile. The move then takes that
+    lock just long enough to compare the user's generation: if it changed during the copy,
+    the copy is dropped and made again, up to MOVE_ATTEMPTS times, after which the user is
+    left for the next rebalance. The copy commits to the target shard before the catalog
+    points there, and the source copy is deleted last, still under the lock. A RecipeBook
+    that was still reading the source notices the user is gone (UserMoved) and follows them.
+    If a move is interrupted, repair() (run first by every rebalance) removes the copy left
+    behind or points the catalog back at the one that survived.
+    """
+
+    def __init__(self, directory=SHARD_DIR, workers=FAN_OUT_WORKERS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.catalog_file = os.path.join(directory, "catalog.db")
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.write_queues = {}      # shard file -> WriteQueue, once start_write_queues has been called
+        self.queue_options = None
+        with transaction(self.catalog_file) as conn:
+            # Shards are never renumbered: shrinking deactivates the highest ones, which empty as users move off
+            conn.execute("CREATE TABLE IF NOT EXISTS shards (number INTEGER PRIMARY KEY, active INTEGER NOT NULL DEFAULT 1)")
+            conn.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, shard INTEGER NOT NULL) WITHOUT ROWID")
+
+    def shard_file(self, number):
+        return os.path.join(self.directory, f"recipes-{number}.db")
+
+    def shards(self, active_only=True):
+        conn = get_connection(self.catalog_file)
+        return [row[0] for row in conn.execute(
+            f"SELECT number FROM shards {'WHERE active' if active_only else ''} ORDER BY number")]
+
+    def shard_of(self, username):
+        row = get_connection(self.catalog_file).execute("SELECT shard FROM users WHERE username = ?", (username,)).fetchone()
+        return row and row[0]
+
+    def locate(self, username):
+        """(database file, write queue or None) holding username's recipes"""
+        shard = self.shard_of(username)
+        if shard is None:
+            raise LookupError(f"No user named {username}")
+        db_file = self.shard_file(shard)
+        return db_file, self.write_queues.get(db_file)
+
+    def resize(self, count):
+        """Use shards 0 to count - 1 for new users. Existing users move with rebalance()."""
+        for number in range(count):
+            ensure_database(self.shard_file(number))  # before any user can be placed there
+        with transaction(self.catalog_file) as conn:
+            conn.executemany("INSERT OR IGNORE INTO shards (number) VALUES (?)", ((number,) for number in range(count)))
+            conn.execute("UPDATE shards SET active = number < ?", (count,))
+        if self.queue_options is not None:
+            self.start_write_queues(**self.queue_options)
+
+    def start_write_queues(self, **options):
+        """Give every shard its own write_queue.WriteQueue, used by the RecipeBooks opened with this catalog"""
+        self.queue_options = options
+        for number in self.shards(active_only=False):
+            db_file = self.shard_file(number)
+            if db_file not in self.write_queues:
+                self.write_queues[db_file] = WriteQueue(db_file, **options)
+
+    ###### Users ######
+    def create_user(self, username, password):
+        """Register a user on the shard their username hashes to. Raises ValueError if it is taken."""
+        with transaction(self.catalog_file) as conn:
+            shards = self.shards()
+            if not shards:
+                raise RuntimeError("The sharded recipe book has no shards yet: resize it first")
+            shard = shard_for(username, shards)
+            if conn.execute("INSERT OR IGNORE INTO users (username, shard) VALUES (?, ?)", (username, shard)).rowcount == 0:
+                raise ValueError(f"Username {username} already exists")
+        try:
+            return User.create(username, password, self.shard_file(shard))
+        except BaseException:
+            with transaction(self.catalog_file) as conn:
+                conn.execute("DELETE FROM users WHERE username = ? AND shard = ?", (username, shard))
+            raise
+
+    def authenticate(self, username, password):
+        """The user if the password matches, otherwise None"""
+        for _ in range(2):  # a second time if the user moved while we looked
+            shard = self.shard_of(username)
+            if shard is None:
+                return None
+            user = User.authenticate(username, password, self.shard_file(shard))
+            if user or self.shard_of(username) == shard:
+                return user
+        return None
+
+    ###### Rebalancing ######
+    def misplaced(self):
+        """(username, shard, shard they belong on) of every user not on the shard they hash to"""
+        shards = self.shards()
+        conn = get_connection(self.catalog_file)
+        return [(username, shard, target) for username, shard in conn.execute("SELECT username, shard FROM users").fetchall()
+                if (target := shard_for(username, shards)) != shard]
+
+    def rebalance(self, progress=None):
+        """Move every misplaced user to the shard they belong on; returns how many moved"""
+        self.repair()
+        moved = 0
+        for username, source, target in self.misplaced():
+            if self.move_user(username, source, target):
+                moved += 1
+                if progress:
+                    progress(username, source, target)
+        return moved
+
+    def move_user(self, username, source, target):
+        """Move a user's account and recipes from shard source to target, while it is in use.
+        Returns False if the user was no longer on source, or wrote during every attempt to copy them."""
+        source_file, target_file = self.shard_file(source), self.shard_file(target)
+        for _ in range(MOVE_ATTEMPTS):
+            if self.shard_of(username) != source:
+                return False
+            user = get_connection(source_file).execute(USER_ROW, (username,)).fetchone()
+            if user is None:
+                return False
+            copy_id = copy_user(source_file, target_file, username, user)  # the user's writes carry on meanwhile
+            with transaction(source_file) as src:  # they wait only while the move checks the copy and commits it
+                if src.execute(USER_ROW, (username,)).fetchone() == user and self.shard_of(username) == source:
+                    with transaction(self.catalog_file) as conn:  # only once the copy has committed
+                        conn.execute("UPDATE users SET shard = ? WHERE username = ?", (target, username))
+                    remove_user(src, user[0])
+                    break
+            with transaction(target_file) as dst:  # written to during the copy: drop it and copy again
+                remove_user(dst, copy_id)
+        else:
+            return False  # still busy: the next rebalance tries again
+        for db_file in (source_file, target_file):
+            similarity_indexes.pop(db_file, None)  # rebuilt by the next query
+        return True
+
+    def repair(self):
+        """Clean up after interrupted moves: drop each account a shard holds for a user the
+        catalog places elsewhere, unless the catalog's shard lacks it (the move stopped before
+        its copy committed), in which case point the catalog back at this one"""
+        for number in self.shards(active_only=False):
+            with transaction(self.shard_file(number)) as conn:
+                for user_id, username in conn.execute("SELECT id, username FROM users").fetchall():
+                    shard = self.shard_of(username)
+                    if shard == number:
+                        continue
+                    if shard is not None and get_connection(self.shard_file(shard)).execute(
+                            "SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+                        remove_user(conn, user_id)
+                    else:
+                        with transaction(self.catalog_file) as catalog:
+                            catalog.execute("INSERT OR REPLACE INTO users (username, shard) VALUES (?, ?)", (username, number))
+
+    ###### Queries over every shard ######
+    def fan_out(self, query):
+        """[query(conn) for the connection to each shard], run on the shards in parallel"""
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="shard")
+        files = [self.shard_file(number) for number in self.shards(active_only=False)]
+        return list(self.pool.map(lambda db_file: query(get_connection(db_file)), files))
+
+    def count_users(self):
+        return sum(self.fan_out(lambda conn: conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]))
+
+    def count_recipes(self):
+        return sum(self.fan_out(lambda conn: conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]))
+
+    def shard_sizes(self):
+        """shard number -> (users, recipes)"""
+        counts = self.fan_out(lambda conn: conn.execute(
+            "SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM recipes)").fetchone())
+        return dict(zip(self.shards(active_only=False), counts))
+
+    def search(self, query, limit=10):
+        """Every user's recipes matching query, best match first. Each shard ranks its own
+        matches; bm25 scores are close enough between shards of similar size to merge."""
+        match = fts_query(query)
+        if not match:
+            return []
+
+        def search_shard(conn):
+            return conn.execute("""
+                SELECT bm25(recipes_fts, 2.0, 5.0, 3.0, 1.0, 0.0) AS score, users.username,
+                       recipes.id, recipes.category, recipes.name
+                FROM recipes_fts JOIN recipes ON recipes.id = recipes_fts.rowid
+                JOIN users ON users.id = recipes.user_id
+                WHERE recipes_fts MATCH ?
+                ORDER BY score LIMIT ?
+            """, (f"{{category name ingredients directions}} : ({match})", limit)).fetchall()
+
+        best = islice(heapq.merge(*self.fan_out(search_shard)), limit)
+        return [dict(zip(["Username", "Recipe ID", "Meal Category", "Dish Name"], row[1:])) for row in best]
+
+
+def copy_user(source_file, target_file, username, user):
+    """Copy an account (its USER_ROW) and its recipes from one shard to another, MOVE_CHUNK
+    recipes per transaction; returns its ID on the target shard"""
+    with transaction(target_file) as dst:
+        copy_id = dst.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, user[1])).lastrowid
+    after_id = 0
+    while True:
+        recipes = get_connection(source_file).execute("""
+            SELECT id, category, name, ingredients, directions FROM recipes
+            WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?
+        """, (user[0], after_id, MOVE_CHUNK)).fetchall()
+        if not recipes:
+            return copy_id
+        with transaction(target_file) as dst:
+            last_id = last_recipe_id(dst)
+            dst.executemany("INSERT INTO recipes (user_id, category, name, ingredients, directions) VALUES (?, ?, ?, ?, ?)",
+                            [(copy_id, *recipe[1:]) for recipe in recipes])
+            link_recipes_after(dst, last_id)
+        after_id = recipes[-1][0]
+
+
+def remove_user(conn, user_id):
+    """Delete an account and its recipes from one shard (the triggers clean up the rest)"""
+    conn.execute("DELETE FROM recipes WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=SHARD_DIR, help="directory of the catalog and shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="users and recipes on each shard, and users waiting to move")
+    resize = commands.add_parser("resize", help="change the number of shards and move users to match")
+    resize.add_argument("count", type=int)
+    commands.add_parser("rebalance", help="move users that are not on the shard they belong on")
+    commands.add_parser("count", help="users and recipes over every shard")
+    search = commands.add_parser("search", help="search every user's recipes")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    catalog = ShardCatalog(args.dir)
+    if args.command == "status":
+        active = set(catalog.shards())
+        for number, (users, recipes) in catalog.shard_sizes().items():
+            print(f"Shard {number}: {users} users, {recipes} recipes{'' if number in active else ' (being emptied)'}")
+        print(f"{len(catalog.misplaced())} users to move")
+    elif args.command in ("resize", "rebalance"):
+        if args.command == "resize":
+            if args.count < 1:
+                parser.error("there must be at least one shard")
+            catalog.resize(args.count)
+        moved = catalog.rebalance(lambda username, source, target: print(f"Moved {username} from shard {source} to {target}"))
+        print(f"Moved {moved} users")
+    elif args.command == "count":
+        print(f"{catalog.count_users()} users, {catalog.count_recipes()} recipes")
+    else:
+        for result in catalog.search(args.query, args.limit):
+            print(f"{result['Username']}: {result['Dish Name']} ({result['Meal Category']}, Recipe ID {result['Recipe ID']})")
+
+
+if __name__ == "__main__":
+    main()
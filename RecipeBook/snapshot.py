@@ -0,0 +1,378 @@
+"""Online, incremental snapshots of every recipe book: recipes.db, its shards and the CSV books.
+
+    python snapshot.py create               # a new snapshot in SNAPSHOT_DIR, while the apps keep running
+    python snapshot.py list
+    python snapshot.py verify [NAME]        # checksums, and quick_check of each database (latest by default)
+    python snapshot.py restore NAME         # put the snapshot's files back in place
+    python snapshot.py restore NAME --to DIR
+
+A snapshot is a directory named for when it was taken, holding a copy of each file and a
+manifest.json with the checksum of every copy. It only appears once complete.
+
+SQLite databases are copied with the backup API, a batch of pages per step, from a read
+transaction opened on all of them at once (while holding the shard catalog's write lock, so
+no shard move is half way through). In WAL mode a reader never blocks writers, so the apps
+keep writing throughout, and the copies all show the same moment. Each CSV book (the CSV and
+project.py's journal) is copied under its user's shared lock, so it is never caught part way
+through a change, after finishing any save oop_project.py left interrupted (its .redo file);
+users files are cut back to their last complete line.
+
+Snapshots are incremental. A file whose inode, size and modification time match those it had
+at the previous snapshot is hard-linked to that snapshot's copy rather than read again, so a
+snapshot costs only what changed since the last one, and unchanged copies share disk space.
+Copies are never modified after they are written, which makes sharing them safe; the live
+files are always copied, since the apps append to them in place.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from config import DB_FILE, SHARD_DIR, SNAPSHOT_DIR
+from database import transaction
+from locking import file_lock, version_stamp
+from migrate_csv import DEFAULT_SOURCES, read_users
+from offset_index import finish_tail_rewrite, redo_file
+
+BACKUP_PAGES = 16384     # database pages copied per backup step (64 MB at the default page size)
+CHUNK_SIZE = 1 << 20     # bytes read at a time when copying or checksumming a file
+BOOK_SUFFIXES = [".csv", ".journal"]  # the files of one CSV book; .offsets and .ingredients.json are rebuilt when missing
+MANIFEST = "manifest.json"
+
+
+###### Files ######
+def file_digest(path):
+    """(size, sha256 hex digest) of a file"""
+    digest, size = hashlib.sha256(), 0
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def copy_file(source, target, whole_lines=False):
+    """Copy source to target and return (size, sha256) of the copy. With whole_lines, a line
+    still being appended to source is left out."""
+    digest, size = hashlib.sha256(), 0
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        if whole_lines:  # only used for users files, which are small
+            data = src.read()
+            chunks = [data[:data.rfind(b"\n") + 1]]
+        else:
+            chunks = iter(lambda: src.read(CHUNK_SIZE), b"")
+        for chunk in chunks:
+            dst.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def stamp(*paths):
+    """version_stamp as it is stored in a manifest"""
+    return [list(part) if part else None for part in version_stamp(*paths)]
+
+
+###### Taking Snapshots ######
+def databases():
+    """(name in a snapshot, path) of every SQLite database of the recipe book, shard catalog first"""
+    found = [("recipes.db", DB_FILE)] if os.path.exists(DB_FILE) else []
+    if os.path.isdir(SHARD_DIR):
+        names = sorted(name for name in os.listdir(SHARD_DIR) if name.endswith(".db"))
+        names.sort(key=lambda name: name != "catalog.db")
+        found += [(f"shards/{name}", os.path.join(SHARD_DIR, name)) for name in names]
+    return found
+
+
+def books(sources=DEFAULT_SOURCES):
+    """(name in a snapshot, users file) of each CSV app's users, and (folder in a snapshot, lock
+    file, {suffix: path}) of each book that exists"""
+    users_files, found = [], []
+    for number, (users_file, books_dir) in enumerate(sources, start=1):
+        if not os.path.exists(users_file):
+            continue
+        folder = f"csv-{number}"
+        users_files.append((f"{folder}/{os.path.basename(users_file)}", users_file))
+        for username in dict(read_users(users_file)):
+            paths = {suffix: os.path.join(books_dir, username + suffix) for suffix in BOOK_SUFFIXES}
+            if os.path.exists(paths[".csv"]):
+                found.append((f"{folder}/{username}", os.path.join(books_dir, f"{username}.lock"), paths))
+    return users_files, found
+
+
+def latest_snapshot(directory=SNAPSHOT_DIR):
+    """(path, manifest) of the newest complete snapshot in directory, or None"""
+    names = list_snapshots(directory)
+    return (os.path.join(directory, names[-1]), read_manifest(os.path.join(directory, names[-1]))) if names else None
+
+
+def list_snapshots(directory=SNAPSHOT_DIR):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if os.path.exists(os.path.join(directory, name, MANIFEST)))
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as file:
+        return json.load(file)
+
+
+class Snapshot:
+    """A snapshot being written: copies and hard links into work, recorded in files"""
+
+    def __init__(self, work, previous):
+        self.work = work
+        self.previous = previous  # (path, manifest) of the last snapshot, to link unchanged files to
+        self.files = {}           # name -> {"source", "kind", "size", "sha256", "stamp", "copied"}
+        self.copied = self.linked = 0  # bytes
+
+    def target(self, name):
+        path = os.path.join(self.work, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def link(self, name, source, kind, source_stamp):
+        """Hard-link the previous snapshot's copy of name, if source hasn't changed since it; returns whether it did"""
+        old = self.previous and self.previous[1]["files"].get(name)
+        if not old or old["stamp"] != source_stamp or old["source"] != os.path.abspath(source):
+            return False
+        try:
+            os.link(os.path.join(self.previous[0], name), self.target(name))
+        except OSError:  # e.g. a file system without hard links: copy it instead
+            return False
+        self.files[name] = dict(old, kind=kind, copied=False)
+        self.linked += old["size"]
+        return True
+
+    def add(self, name, source, kind, source_stamp, size, sha256):
+        self.files[name] = {"source": os.path.abspath(source), "kind": kind, "size": size, "sha256": sha256,
+                            "stamp": source_stamp, "copied": True}
+        self.copied += size
+
+    def copy(self, name, source, kind, whole_lines=False):
+        source_stamp = stamp(source)
+        if not self.link(name, source, kind, source_stamp):
+            self.add(name, source, kind, source_stamp, *copy_file(source, self.target(name), whole_lines))
+
+    def backup(self, name, path, conn, source_stamp):
+        """Copy a database from conn, which holds a read transaction on it"""
+        if self.link(name, path, "database", source_stamp):
+            return
+        target = self.target(name)
+        copy = sqlite3.connect(target)
+        try:
+            conn.backup(copy, pages=BACKUP_PAGES)
+            copy.execute("PRAGMA journal_mode=DELETE")  # a single file that opening never changes
+        finally:
+            copy.close()
+        self.add(name, path, "database", source_stamp, *file_digest(target))
+
+
+def create_snapshot(directory=SNAPSHOT_DIR, sources=DEFAULT_SOURCES):
+    """Snapshot every database and CSV book; returns the new snapshot's path"""
+    previous = latest_snapshot(directory)
+    name = time.strftime("%Y%m%d-%H%M%S")
+    while os.path.exists(os.path.join(directory, name)):
+        name += "+"
+    work = os.path.join(directory, f".{name}.tmp")
+    os.makedirs(work)
+    snapshot = Snapshot(work, previous)
+    try:
+        backup_databases(snapshot)
+        users_files, found = books(sources)
+        for name_in_snapshot, users_file in users_files:
+            snapshot.copy(name_in_snapshot, users_file, "users", whole_lines=True)
+        for folder, lock, paths in found:
+            if os.path.exists(redo_file(paths[".csv"])):
+                with file_lock(lock):
+                    finish_tail_rewrite(paths[".csv"])  # a save that was interrupted part way through
+            with file_lock(lock, shared=True):
+                for suffix, path in paths.items():
+                    if os.path.exists(path):
+                        snapshot.copy(folder + suffix, path, "book")
+        with open(os.path.join(work, MANIFEST), "w") as file:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "copied_bytes": snapshot.copied,
+                       "linked_bytes": snapshot.linked, "files": snapshot.files}, file, indent=1)
+        if hasattr(os, "sync"):
+            os.sync()  # every copy on disk before the snapshot appears (once, rather than an fsync per file)
+        final = os.path.join(directory, name)
+        os.rename(work, final)
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    return final
+
+
+def backup_databases(snapshot):
+    """Copy every database from read transactions started together, so they agree with each other"""
+    found = databases()
+    stamps = [stamp(path, path + "-wal") for _, path in found]  # before the transactions: a later write changes them
+    catalog = os.path.join(SHARD_DIR, "catalog.db")
+    connections = []
+    try:
+        # No user can move between shards while the catalog is locked, so no move is caught half done
+        with transaction(catalog) if os.path.exists(catalog) else nullcontext():
+            for _, path in found:
+                conn = sqlite3.connect(path, isolation_level=None)
+                connections.append(conn)
+                conn.execute("BEGIN")
+                conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # starts the read transaction
+        for (name, path), conn, source_stamp in zip(found, connections, stamps):
+            snapshot.backup(name, path, conn, source_stamp)
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+###### Verifying and Restoring ######
+def verify_snapshot(path):
+    """Problems with a snapshot: copies that are missing or don't match their checksum, and
+    databases that fail quick_check. An empty list means the snapshot is sound."""
+    problems = []
+    for name, entry in read_manifest(path)["files"].items():
+        target = os.path.join(path, name)
+        if not os.path.exists(target):
+            problems.append(f"{name}: missing")
+            continue
+        size, sha256 = file_digest(target)
+        if (size, sha256) != (entry["size"], entry["sha256"]):
+            problems.append(f"{name}: checksum does not match")
+        elif entry["kind"] == "database":
+            conn = sqlite3.connect(Path(target).resolve().as_uri() + "?mode=ro&immutable=1", uri=True)
+            try:
+                result = conn.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                conn.close()
+            if result != "ok":
+                problems.append(f"{name}: {result}")
+    return problems
+
+
+def restore_snapshot(path, to=None):
+    """Put a verified snapshot's files back where they were taken from, or under the directory to.
+
+    Databases are restored through the backup API, so the apps can stay running; each book is
+    replaced under its user's lock, which the apps notice as a change made by another session.
+    Raises ValueError, restoring nothing, if the snapshot fails verification.
+    """
+    problems = verify_snapshot(path)
+    if problems:
+        raise ValueError(f"{path} is damaged: " + "; ".join(problems))
+    files = read_manifest(path)["files"]
+    if to is not None:
+        for name in files:
+            os.makedirs(os.path.dirname(os.path.join(to, name)), exist_ok=True)
+            shutil.copyfile(os.path.join(path, name), os.path.join(to, name))
+        return
+
+    book_files = {}  # book folder -> {suffix: manifest entry}
+    shard_dir = None
+    for name, entry in files.items():
+        if entry["kind"] == "database":
+            restore_database(os.path.join(path, name), entry["source"])
+            if name == "shards/catalog.db":
+                shard_dir = os.path.dirname(entry["source"])
+        elif entry["kind"] == "users":
+            replace_file(os.path.join(path, name), entry["source"])
+        else:
+            folder, suffix = os.path.splitext(name)
+            book_files.setdefault(folder, {})[suffix] = entry
+    for folder, entries in book_files.items():
+        live = os.path.splitext(entries[".csv"]["source"])[0]
+        with file_lock(live + ".lock"):
+            if os.path.exists(redo_file(live + ".csv")):
+                os.remove(redo_file(live + ".csv"))  # its tail belongs to the live book, not the restored one
+            for suffix in BOOK_SUFFIXES:
+                if suffix in entries:
+                    replace_file(os.path.join(path, folder + suffix), live + suffix)
+                elif os.path.exists(live + suffix):
+                    os.remove(live + suffix)  # e.g. a journal of changes made after the snapshot
+    if shard_dir is not None:
+        from shards import ShardCatalog  # only needed for a sharded recipe book
+        ShardCatalog(shard_dir).repair()  # a user whose move was committing as the snapshot was taken
+
+
+def replace_file(copy, path):
+    """Replace path with a copy of copy in one step, as locking.atomic_write does"""
+    temp_path = os.path.join(os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.restore.tmp")
+    shutil.copyfile(copy, temp_path)
+    os.replace(temp_path, path)
+
+
+def restore_database(copy, path):
+    """Overwrite the live database at path with a snapshot's copy, in one backup step.
+
+    Every user's generation is first moved past any the live database has reached, so query
+    caches (query_cache.QueryCache) can't take a restored book for the one they cached.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = os.path.join(os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.restore.tmp")
+    shutil.copyfile(copy, temp_path)
+    try:
+        restored = sqlite3.connect(temp_path, isolation_level=None)
+        live = sqlite3.connect(path, isolation_level=None)
+        try:
+            if has_generations(live) and has_generations(restored):
+                offset = live.execute("SELECT COALESCE(MAX(generation), 0) + 1 FROM users").fetchone()[0]
+                restored.execute("UPDATE users SET generation = generation + ?", (offset,))
+            restored.backup(live)
+            live.execute("PRAGMA journal_mode=WAL")
+        finally:
+            restored.close()
+            live.close()
+    finally:
+        os.remove(temp_path)
+
+
+def has_generations(conn):
+    return any(column[1] == "generation" for column in conn.execute("PRAGMA table_info(users)"))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="directory holding the snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="take a snapshot")
+    commands.add_parser("list", help="list the snapshots")
+    verify = commands.add_parser("verify", help="check a snapshot against its checksums")
+    verify.add_argument("name", nargs="?", help="snapshot to check (default: the latest)")
+    restore = commands.add_parser("restore", help="put a snapshot's files back")
+    restore.add_argument("name")
+    restore.add_argument("--to", help="copy the files into this directory instead")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        start = time.perf_counter()
+        path = create_snapshot(args.dir)
+        manifest = read_manifest(path)
+        print(f"Snapshot {os.path.basename(path)}: {len(manifest['files'])} files, "
+              f"{manifest['copied_bytes']:,} bytes copied, {manifest['linked_bytes']:,} linked "
+              f"from the last snapshot, in {time.perf_counter() - start:.2f} s")
+    elif args.command == "list":
+        for name in list_snapshots(args.dir):
+            manifest = read_manifest(os.path.join(args.dir, name))
+            print(f"{name}: {len(manifest['files'])} files, {manifest['copied_bytes']:,} bytes copied")
+    else:
+        name = args.name or (list_snapshots(args.dir) or [None])[-1]
+        if name is None or not os.path.exists(os.path.join(args.dir, name, MANIFEST)):
+            parser.error(f"no snapshot {name or ''} in {args.dir}")
+        path = os.path.join(args.dir, name)
+        if args.command == "verify":
+            problems = verify_snapshot(path)
+            for problem in problems:
+                print(problem)
+            print(f"{name}: {'damaged' if problems else 'OK'}")
+            raise SystemExit(1 if problems else 0)
+        try:
+            restore_snapshot(path, args.to)
+        except ValueError as error:
+            raise SystemExit(str(error))
+        print(f"Restored {name}" + (f" into {args.to}" if args.to else ""))
+
+
+if __name__ == "__main__":
+    main()
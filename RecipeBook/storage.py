@@ -0,0 +1,106 @@
+from abc import ABC, abstractmethod
+import instrumentation
+from locking import StaleBookError
+
+
+###### Storage Protocol ######
+class RecipeStore(ABC):
+    """What the menus need from a recipe book, whatever it is stored in.
+
+    oop_project.RecipeBook (a CSV per user) and db_recipes.RecipeBook (SQLite) both
+    implement it, so either can be handed to recipes_menu or opened with open_recipe_book.
+    A recipe is identified by a key: its position in the book for CSV, its Recipe ID for
+    SQLite. Methods called without their optional arguments ask the user instead. A book
+    that leaves out any of the abstract methods cannot be created.
+    """
+    search_label = "Search Recipes"
+
+    def reload(self):
+        """Re-read the book after StaleBookError (engines that cannot go stale do nothing)"""
+
+    @abstractmethod
+    def iter_recipes(self):
+        """Yield every recipe as a dict keyed by the CSV field names"""
+
+    @abstractmethod
+    def count_recipes(self):
+        ...
+
+    @abstractmethod
+    def add_recipe(self, recipe=None):
+        """recipe may be the engine's Recipe or a dict keyed by the CSV field names"""
+
+    @abstractmethod
+    def edit_recipe(self, key=None, changes=None):
+        """changes maps attribute names (category, name, ingredients, directions) to new values"""
+
+    @abstractmethod
+    def delete_recipe(self, key=None):
+        ...
+
+    @abstractmethod
+    def view_recipes(self, done_label="Back to menu"):
+        ...
+
+    @abstractmethod
+    def search_recipes(self):
+        ...
+
+    @abstractmethod
+    def import_recipes(self, source, show_progress=False):
+        ...
+
+    @abstractmethod
+    def export_recipes(self, destination, show_progress=False):
+        ...
+
+
+ENGINES = ("csv", "sqlite")
+
+
+def open_recipe_book(username, engine="csv"):
+    """Open username's book with the named storage engine"""
+    # Imported here so each app only loads the engine it uses
+    if engine == "csv":
+        from oop_project import RecipeBook
+    elif engine == "sqlite":
+        from db_recipes import RecipeBook
+    else:
+        raise ValueError(f"Unknown storage engine: {engine}")
+    return RecipeBook(username)
+
+
+###### Recipes Menu ######
+def recipes_menu(recipe_book):
+    """The logged-in menu, shared by every storage engine"""
+    actions = {
+        "1": recipe_book.add_recipe,
+        "2": recipe_book.edit_recipe,
+        "3": recipe_book.delete_recipe,
+        "4": recipe_book.view_recipes,
+        "5": recipe_book.search_recipes,
+    }
+    timings_option = ", 7 - Show Timings" if instrumentation.enabled else ""
+    while True:
+        choice = input(f"\n1 - Add Recipe, 2 - Edit Recipe, 3 - Delete Recipe, 4 - View Recipes, 5 - {recipe_book.search_label}, 6 - Logout{timings_option}: ").strip()
+        if choice in actions:
+            try:
+                actions[choice]()
+            except StaleBookError as error:
+                print(f"{error}. Your recipes have been reloaded, please try again.")
+                recipe_book.reload()
+        elif choice == "6":
+            print("Logging out...")
+            exit_choice = input("Do you want to exit the program? (y/n): ").strip().lower()
+            if exit_choice == "y":
+                print("Goodbye!")
+                exit()  # Exit the program entirely
+            elif exit_choice == "n":
+                print("Returning to your recipes menu...")
+                continue  # Stay in the recipes menu
+            else:
+                print("Invalid input, returning to your recipes menu...")
+        elif choice == "7" and instrumentation.enabled:
+            instrumentation.report()
+        else:
+            print("Invalid option.")
@@ -0,0 +1,102 @@
+import sys
+import textwrap
+try:
+    from .instrumentation import timed  # imported as RecipeBook.table_renderer, by project.py
+except ImportError:
+    from instrumentation import timed  # imported by name, by the apps in RecipeBook/
+
+INGREDIENTS_WIDTH = 25
+DIRECTIONS_WIDTH = 40
+MAX_CACHED_RECIPES = 100_000
+
+
+@timed("render.textwrap")
+def wrap_cells(ingredients, directions):
+    """A recipe's ingredients and directions wrapped to their column widths"""
+    return textwrap.wrap(ingredients, width=INGREDIENTS_WIDTH), textwrap.wrap(directions, width=DIRECTIONS_WIDTH)
+
+
+class _CachedRecipe:
+    """A recipe's wrapped cells, and its last rendered table lines"""
+    __slots__ = ("cells", "widths", "height", "block_key", "block")
+
+    def __init__(self, category, name, ingredients, directions):
+        self.cells = (category.split("\n"), name.split("\n"), *wrap_cells(ingredients, directions))
+        self.widths = tuple(max(map(len, lines), default=0) for lines in self.cells)
+        self.height = max(1, *map(len, self.cells))
+        self.block_key = None
+        self.block = None
+
+
+###### Recipe Table ######
+class RecipeTable:
+    """Draws recipes the way tabulate(..., tablefmt="rounded_grid") does, without redoing work.
+
+    Wrapped cells are cached per recipe, keyed by the recipe's contents, so only a recipe
+    that was edited gets wrapped again. Each recipe also keeps its finished table lines
+    while the column widths and its number stay the same, so showing an unchanged book
+    again is mostly a string join.
+    """
+
+    def __init__(self, headers):
+        self.headers = headers  # label column (No. / Recipe ID) followed by the four recipe columns
+        self._recipes = {}
+        self._last = (None, None)
+
+    def _cached(self, fields):
+        recipe = self._recipes.get(fields)
+        if recipe is None:
+            if len(self._recipes) >= MAX_CACHED_RECIPES:
+                self._recipes.clear()
+            recipe = self._recipes[fields] = _CachedRecipe(*fields)
+        return recipe
+
+    @timed("render.table")
+    def render(self, rows):
+        """rows is a list of (label, category, name, ingredients, directions) tuples"""
+        key = tuple(rows)
+        if key == self._last[0]:
+            return self._last[1]
+
+        recipes = [self._cached(row[1:]) for row in rows]
+        labels = [str(row[0]) for row in rows]
+        widths = [max(len(self.headers[0]) + 2, max(map(len, labels), default=0))]
+        for column in range(4):
+            widths.append(max(len(self.headers[column + 1]) + 2, max((r.widths[column] for r in recipes), default=0)))
+        widths = tuple(widths)
+
+        separator = "├" + "┼".join("─" * (w + 2) for w in widths) + "┤"
+        lines = [
+            "╭" + "┬".join("─" * (w + 2) for w in widths) + "╮",
+            self._line(list(self.headers), widths),
+            separator,
+        ]
+        for number, (label, recipe) in enumerate(zip(labels, recipes)):
+            if number:
+                lines.append(separator)
+            block_key = (widths, label)
+            if recipe.block_key != block_key:
+                recipe.block = "\n".join(
+                    self._line([label if i == 0 else ""] + [c[i] if i < len(c) else "" for c in recipe.cells], widths)
+                    for i in range(recipe.height)
+                )
+                recipe.block_key = block_key
+            lines.append(recipe.block)
+        lines.append("╰" + "┴".join("─" * (w + 2) for w in widths) + "╯")
+
+        output = "\n".join(lines)
+        self._last = (key, output)
+        return output
+
+    @staticmethod
+    def _line(cells, widths):
+        return "│ " + " │ ".join(
+            [cells[0].rjust(widths[0])] + [cell.ljust(width) for cell, width in zip(cells[1:], widths[1:])]
+        ) + " │"
+
+    def write(self, rows, title=None, file=None):
+        """Render the table and send it to the terminal in a single write"""
+        output = self.render(rows)
+        if title:
+            output = f"{title}\n{output}"
+        (file or sys.stdout).write(output + "\n")
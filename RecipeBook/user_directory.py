@@ -0,0 +1,112 @@
+import csv
+import hashlib
+import hmac
+import os
+
+HASH_SCHEME = "pbkdf2_sha256"
+HASH_ITERATIONS = 200_000
+MAX_CACHED_VERIFICATIONS = 10_000
+
+
+###### Passwords ######
+def hash_password(password, salt=None, iterations=HASH_ITERATIONS):
+    """Return a salted PBKDF2 hash of password, in the form stored in the users file"""
+    if salt is None:
+        import secrets  # only needed to register someone
+        salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iterations).hex()
+    return f"{HASH_SCHEME}${iterations}${salt}${digest}"
+
+
+# (stored password, sha256 of the password tried) -> result, so a session only pays for
+# the deliberately slow hash once per user
+_verified = {}
+
+
+def verify_password(password, stored):
+    """Check password against a stored hash (or a plain-text password from an older users file)"""
+    key = (stored, hashlib.sha256(password.encode()).digest())
+    result = _verified.get(key)
+    if result is None:
+        if stored.startswith(HASH_SCHEME + "$"):
+            _, iterations, salt, _ = stored.split("$")
+            result = hmac.compare_digest(hash_password(password, salt, int(iterations)), stored)
+        else:
+            result = hmac.compare_digest(password.encode(), stored.encode())
+        if len(_verified) >= MAX_CACHED_VERIFICATIONS:
+            _verified.clear()
+        _verified[key] = result
+    return result
+
+
+###### User Directory ######
+class UserDirectory:
+    """The users in a users CSV file, kept in memory and re-read only when the file changes.
+
+    The file is re-read when its size or modification time differs from when it was last
+    read, e.g. after another session registered someone. Registering here appends one line
+    and updates the map in place, so the file is never parsed again for our own changes.
+    """
+
+    def __init__(self, path, header=False):
+        self.path = path
+        self.header = header  # oopusers.csv starts with a user,password header; users.csv does not
+        self._users = {}
+        self._stamp = None
+
+    def _file_stamp(self):
+        # The path may be relative to a working directory that changes, so it is part of the stamp
+        path = os.path.abspath(self.path)
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            return (path, None, None)
+        return (path, info.st_size, info.st_mtime_ns)
+
+    def refresh(self):
+        stamp = self._file_stamp()
+        if stamp != self._stamp:
+            users = {}
+            if stamp[1] is not None:
+                with open(self.path, mode="r", newline="") as file:
+                    for row in csv.reader(file):
+                        if len(row) == 2 and row != ["user", "password"]:
+                            users[row[0]] = row[1]
+            self._users = users
+            self._stamp = stamp
+        return self._users
+
+    def users(self):
+        """username -> stored password for every registered user"""
+        return self.refresh()
+
+    def __contains__(self, username):
+        return username in self.refresh()
+
+    def __len__(self):
+        return len(self.refresh())
+
+    def register(self, username, password):
+        """Add a user with a salted password hash. Raises ValueError if the username is taken."""
+        if username in self:
+            raise ValueError(f"Username {username} already exists")
+        stored = hash_password(password)
+        before = self._file_stamp()
+        with open(self.path, mode="a", newline="") as file:
+            writer = csv.writer(file)
+            if self.header and before[1] is None:
+                writer.writerow(["user", "password"])
+            writer.writerow([username, stored])
+            written = file.tell()
+        after = self._file_stamp()
+        if before == self._stamp and written == after[1]:
+            # Nobody else wrote to the file meanwhile, so the map just needs our line
+            self._users[username] = stored
+            self._stamp = after
+        else:
+            self._stamp = None
+        return stored
+
+    def verify(self, username, password):
+        stored = self.refresh().get(username)
+        return stored is not None and verify_password(password, stored)
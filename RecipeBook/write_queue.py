@@ -0,0 +1,106 @@
+import threading
+import time
+from concurrent.futures import Future
+from database import get_connection, transaction
+
+MAX_BATCH = 500     # writes committed together at most
+MAX_DELAY = 0.0     # seconds the writer waits, after a write arrives, for more to commit with it
+                    # (by default, a commit holds whatever was queued while the last one ran)
+
+
+###### Group Commit ######
+class WriteQueue:
+    """Commits the writes of many sessions together, from one writer thread.
+
+    submit(write) queues write(conn) and returns a Future for its result, which is set once
+    the transaction holding it has committed. The writer starts a transaction when a write
+    arrives, gathers every write that arrives within max_delay (up to max_batch) and runs each
+    in a savepoint, so one that fails is rolled back alone, then commits them all at once.
+
+    Commits use the connection's synchronous=NORMAL: a committed write survives the app
+    crashing, but not a power cut. A durable write (durable=True here or in submit) is only
+    acknowledged once its commit has been synced to disk (synchronous=FULL).
+    """
+
+    def __init__(self, db_file=None, max_batch=MAX_BATCH, max_delay=MAX_DELAY, durable=False):
+        self.db_file = db_file
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.durable = durable
+        self.pending = []  # (write, durable, future) in the order they were submitted
+        self.condition = threading.Condition()
+        self.closed = False
+        self.commits = self.writes = 0
+        self.thread = threading.Thread(target=self.run, name="sqlite-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, write, durable=None):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The write queue is closed")
+            self.pending.append((write, self.durable if durable is None else durable, future))
+            self.condition.notify()
+        return future
+
+    def flush(self, durable=None):
+        """Wait until every write submitted so far has been committed"""
+        self.submit(lambda conn: None, durable).result()
+
+    def close(self):
+        """Commit the writes still queued and stop the writer thread"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    ###### Writer thread ######
+    def run(self):
+        while batch := self.next_batch():
+            self.commit(batch)
+
+    def next_batch(self):
+        """The next writes to commit together; empty once the queue is closed and drained"""
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            deadline = time.monotonic() + self.max_delay
+            while len(self.pending) < self.max_batch and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            return batch
+
+    def commit(self, batch):
+        durable = any(write_durable for _, write_durable, _ in batch)
+        outcomes = []  # (future, result, error) of each write
+        conn = get_connection(self.db_file)
+        try:
+            if durable:
+                conn.execute("PRAGMA synchronous=FULL")
+            try:
+                with transaction(self.db_file) as conn:
+                    for write, _, future in batch:
+                        conn.execute("SAVEPOINT queued_write")
+                        try:
+                            outcomes.append((future, write(conn), None))
+                        except Exception as error:
+                            conn.execute("ROLLBACK TO queued_write")
+                            outcomes.append((future, None, error))
+                        conn.execute("RELEASE queued_write")
+            finally:
+                if durable:
+                    conn.execute("PRAGMA synchronous=NORMAL")
+        except Exception as error:  # the commit itself failed, so none of the writes happened
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
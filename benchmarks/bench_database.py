@@ -0,0 +1,99 @@
+"""Before/after microbenchmark for the SQLite backend's shared connection manager.
+
+"before" opens and closes a connection per operation with SQLite's default rollback
+journal, the way db_recipes.py used to. "after" goes through database.py (one
+long-lived connection per thread, WAL, synchronous=NORMAL).
+
+    python benchmarks/bench_database.py --adds 2000 --lists 200
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RecipeBook"))
+
+from database import close_connections  # noqa: E402
+from db_recipes import Recipe, RecipeBook, initialize_database  # noqa: E402
+
+SCHEMA = """
+    CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL);
+    CREATE TABLE recipes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, category TEXT NOT NULL,
+                          name TEXT NOT NULL, ingredients TEXT NOT NULL, directions TEXT NOT NULL);
+    INSERT INTO users (username, password) VALUES ('bench', 'bench');
+"""
+
+
+def sample_recipe(n):
+    return Recipe("Dinner", f"Dish {n}", "Flour, Water, Salt, Yeast", "Mix everything, rest for an hour, bake at 220C.")
+
+
+def bench_before(db_file, adds, lists):
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA)
+    conn.close()
+
+    start = time.perf_counter()
+    for n in range(adds):
+        recipe = sample_recipe(n)
+        conn = sqlite3.connect(db_file)
+        conn.execute("INSERT INTO recipes (user_id, category, name, ingredients, directions) VALUES (?, ?, ?, ?, ?)",
+                     (1, recipe.category, recipe.name, recipe.ingredients, recipe.directions))
+        conn.commit()
+        conn.close()
+    add_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(lists):
+        conn = sqlite3.connect(db_file)
+        cursor = conn.execute("SELECT id, category, name, ingredients, directions FROM recipes WHERE user_id = ?", (1,))
+        [dict(zip(["Recipe ID", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"], row)) for row in cursor.fetchall()]
+        conn.close()
+    list_time = time.perf_counter() - start
+    return add_time, list_time
+
+
+def bench_after(db_file, adds, lists):
+    initialize_database(db_file)
+    sqlite3.connect(db_file).execute("INSERT INTO users (username, password) VALUES ('bench', 'bench')").connection.commit()
+    book = RecipeBook("bench", db_file=db_file)
+
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")  # add_recipe prints a confirmation
+    try:
+        start = time.perf_counter()
+        for n in range(adds):
+            book.add_recipe(sample_recipe(n))
+        add_time = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    start = time.perf_counter()
+    for _ in range(lists):
+        book.load_user_recipes()
+    list_time = time.perf_counter() - start
+    close_connections()
+    return add_time, list_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--adds", type=int, default=1000, help="recipes to add one at a time")
+    parser.add_argument("--lists", type=int, default=100, help="times to list the whole book")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            "before": bench_before(os.path.join(tmp, "before.db"), args.adds, args.lists),
+            "after": bench_after(os.path.join(tmp, "after.db"), args.adds, args.lists),
+        }
+
+    print(f"{'':8}{'adds/sec':>12}{'lists/sec':>12}")
+    for label, (add_time, list_time) in results.items():
+        print(f"{label:8}{args.adds / add_time:12.0f}{args.lists / list_time:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
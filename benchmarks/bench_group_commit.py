@@ -0,0 +1,82 @@
+"""Sustained write throughput of the SQLite backend with and without group commit.
+
+Several sessions (threads, each with its own RecipeBook) insert recipes as fast as they can.
+"direct" commits every insert in its own transaction, the way db_recipes.py does on its own;
+"queued" sends them through one write_queue.WriteQueue, which commits them in groups. The
+durable rows sync every commit to disk before acknowledging it (synchronous=FULL). Failed
+counts the direct inserts that gave up waiting for the write lock ("database is locked").
+
+    python benchmarks/bench_group_commit.py --sessions 8 --writes 500
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RecipeBook"))
+
+from database import close_connections, get_connection  # noqa: E402
+from db_recipes import Recipe, RecipeBook, User  # noqa: E402
+from write_queue import WriteQueue  # noqa: E402
+
+
+def sample_recipe(n):
+    return Recipe("Dinner", f"Dish {n}", "Flour, Water, Salt, Yeast", "Mix everything, rest for an hour, bake at 220C.")
+
+
+def bench(db_file, sessions, writes, queued, durable):
+    """Seconds for sessions threads to insert writes recipes each, the commits it took and the inserts that failed"""
+    users = [f"bench{n}" for n in range(sessions)]
+    for username in users:
+        User.create(username, "bench", db_file)
+    write_queue = WriteQueue(db_file, durable=durable) if queued else None
+    barrier = threading.Barrier(sessions + 1)
+    failed = []
+
+    def session(username):
+        book = RecipeBook(username, db_file, write_queue=write_queue)
+        if durable and not queued:
+            get_connection(db_file).execute("PRAGMA synchronous=FULL")
+        barrier.wait()
+        for n in range(writes):
+            try:
+                book.insert_recipe(sample_recipe(n))
+            except sqlite3.OperationalError:
+                failed.append(n)
+        close_connections()
+
+    threads = [threading.Thread(target=session, args=(username,)) for username in users]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if write_queue is None:
+        return elapsed, sessions * writes - len(failed), len(failed)
+    write_queue.close()
+    return elapsed, write_queue.commits, len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=8, help="threads writing at once")
+    parser.add_argument("--writes", type=int, default=500, help="recipes each session inserts")
+    args = parser.parse_args()
+
+    print(f"{'':16}{'writes/sec':>12}{'commits':>10}{'failed':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for durable in (False, True):
+            for queued in (False, True):
+                label = ("queued" if queued else "direct") + (" durable" if durable else "")
+                db_file = os.path.join(tmp, label.replace(" ", "_") + ".db")
+                elapsed, commits, failed = bench(db_file, args.sessions, args.writes, queued, durable)
+                print(f"{label:16}{(args.sessions * args.writes - failed) / elapsed:12.0f}{commits:10}{failed:8}")
+
+
+if __name__ == "__main__":
+    main()
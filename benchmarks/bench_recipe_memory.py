@@ -0,0 +1,75 @@
+"""Memory and load time of an in-memory recipe book: one dict per recipe vs Recipe objects.
+
+Writes a synthetic book to a temporary directory, then loads it the old way (csv.DictReader,
+a dict per row) and through oop_project.RecipeBook (Recipe objects with __slots__).
+
+    python benchmarks/bench_recipe_memory.py --recipes 100000
+"""
+import argparse
+import csv
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RecipeBook"))
+
+CATEGORIES = ["Breakfast", "Lunch", "Dinner", "Snack", "Dessert"]
+WORDS = "garlic onion tomato basil chicken beef rice pasta butter cream cheese salt pepper lemon thyme".split()
+
+
+def write_book(path, count):
+    with open(path, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"])
+        for n in range(count):
+            writer.writerow([random.choice(CATEGORIES), f"Dish {n}", ", ".join(random.sample(WORDS, 6)),
+                             " ".join(random.choices(WORDS, k=20))])
+
+
+def measure(load):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    book = load()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return book, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["RECIPE_BOOK_DATA_DIR"] = data_dir
+        import oop_project
+
+        os.makedirs(oop_project.RECIPES_DIR)
+        path = os.path.join(oop_project.RECIPES_DIR, "bench.csv")
+        write_book(path, args.recipes)
+
+        def load_dicts():
+            with open(path, newline="") as file:
+                return list(csv.DictReader(file))
+
+        recipe_book = oop_project.RecipeBook("bench")
+        recipe_book.recipes = None
+        results = {
+            "dict per recipe": measure(load_dicts),
+            "Recipe objects": measure(recipe_book.load_user_recipes),
+        }
+
+    print(f"{args.recipes:,} recipes")
+    print(f"{'':18}{'bytes/recipe':>14}{'load (s)':>10}")
+    for label, (book, size, elapsed) in results.items():
+        print(f"{label:18}{size / len(book):14.0f}{elapsed:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Write throughput of separate writer processes, with every user in one database or sharded.
+
+Each process inserts recipes for its own users as fast as it can. With one shard, every
+process waits for the same SQLite write lock; with --shards N, users hash to N database
+files (RecipeBook/shards.py) and writers on different shards don't wait for each other.
+Then the shard count is doubled and the time to rebalance is reported.
+
+    python benchmarks/bench_shards.py --processes 8 --writes 300 --shards 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RecipeBook"))
+
+from db_recipes import Recipe, RecipeBook  # noqa: E402
+from shards import ShardCatalog  # noqa: E402
+
+USERS_PER_PROCESS = 4
+
+
+def sample_recipe(n):
+    return Recipe("Dinner", f"Dish {n}", "Flour, Water, Salt, Yeast", "Mix everything, rest for an hour, bake at 220C.")
+
+
+def write_recipes(job):
+    """Insert writes recipes, spread over usernames, from a process of its own"""
+    directory, usernames, writes = job
+    catalog = ShardCatalog(directory)
+    books = [RecipeBook(username, shards=catalog) for username in usernames]
+    for n in range(writes):
+        books[n % len(books)].insert_recipe(sample_recipe(n))
+
+
+def bench(directory, shards, processes, writes):
+    """Seconds for processes writers to insert writes recipes each"""
+    catalog = ShardCatalog(directory)
+    catalog.resize(shards)
+    jobs = []
+    for process in range(processes):
+        usernames = [f"bench{process}-{n}" for n in range(USERS_PER_PROCESS)]
+        for username in usernames:
+            catalog.create_user(username, "bench")
+        jobs.append((directory, usernames, writes))
+    with Pool(processes) as pool:
+        pool.map(write_recipes, jobs[:1])  # start every worker before timing (imports, migrations)
+        start = time.perf_counter()
+        pool.map(write_recipes, jobs, chunksize=1)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8, help="writer processes")
+    parser.add_argument("--writes", type=int, default=300, help="recipes each process inserts")
+    parser.add_argument("--shards", type=int, default=8, help="shards to compare with a single database")
+    args = parser.parse_args()
+
+    print(f"{'':12}{'writes/sec':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for shards in (1, args.shards):
+            directory = os.path.join(tmp, f"{shards}-shards")
+            elapsed = bench(directory, shards, args.processes, args.writes)
+            print(f"{f'{shards} shard' + 's' * (shards > 1):12}{args.processes * args.writes / elapsed:12.0f}")
+
+        catalog = ShardCatalog(directory)
+        catalog.resize(args.shards * 2)
+        start = time.perf_counter()
+        moved = catalog.rebalance()
+        print(f"Resized to {args.shards * 2} shards: moved {moved} of {catalog.count_users()} users "
+              f"({catalog.count_recipes()} recipes in all) in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
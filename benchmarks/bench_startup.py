@@ -0,0 +1,69 @@
+"""Import-time and cold-start benchmark, with budgets to catch startup regressions.
+
+Each measurement runs in a fresh interpreter and is reported as the median over --runs,
+minus the cost of starting a bare interpreter. Exits with status 1 if any measurement is
+over its budget, so it can run in CI.
+
+    python benchmarks/bench_startup.py --runs 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECIPE_BOOK = os.path.join(ROOT, "RecipeBook")
+
+# name: (working directory, python arguments, stdin, budget in milliseconds)
+MEASUREMENTS = {
+    "import project": (ROOT, ["-c", "import project"], "", 60),
+    "import oop_project": (RECIPE_BOOK, ["-c", "import oop_project"], "", 60),
+    "import db_recipes": (RECIPE_BOOK, ["-c", "import db_recipes"], "", 60),
+    "oop_project --no-banner to exit": (RECIPE_BOOK, ["oop_project.py", "--no-banner"], "3\n", 100),
+    "db_recipes --no-banner to exit": (RECIPE_BOOK, ["db_recipes.py", "--no-banner"], "3\n", 120),
+    "oop_project with banner to exit": (RECIPE_BOOK, ["oop_project.py"], "3\n", 150),
+}
+
+
+def run_once(cwd, args, stdin, env=None):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=cwd, input=stdin, text=True, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def median_ms(cwd, args, stdin, runs, env=None):
+    return statistics.median(run_once(cwd, args, stdin, env) for _ in range(runs)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=11, help="interpreter launches per measurement")
+    args = parser.parse_args()
+
+    # Keep the apps away from the real recipe data
+    data_dir = tempfile.TemporaryDirectory()
+    env = dict(os.environ, RECIPE_BOOK_DATA_DIR=data_dir.name)
+
+    # Warm the .pyc cache so the first measurement doesn't pay for compiling
+    for cwd, python_args, stdin, _ in MEASUREMENTS.values():
+        run_once(cwd, python_args, stdin, env)
+    baseline = median_ms(ROOT, ["-c", "pass"], "", args.runs, env)
+
+    over_budget = False
+    print(f"bare interpreter: {baseline:.1f} ms\n")
+    print(f"{'measurement':36}{'ms':>8}{'budget':>8}")
+    for name, (cwd, python_args, stdin, budget) in MEASUREMENTS.items():
+        elapsed = median_ms(cwd, python_args, stdin, args.runs, env) - baseline
+        flag = "" if elapsed <= budget else "  OVER BUDGET"
+        over_budget = over_budget or bool(flag)
+        print(f"{name:36}{elapsed:8.1f}{budget:8}{flag}")
+    data_dir.cleanup()
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
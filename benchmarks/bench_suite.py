@@ -0,0 +1,270 @@
+"""Times the same recipe operations on every storage backend, and saves the numbers as JSON.
+
+Backends: "project" (project.py, a CSV plus journal per user in the working directory),
+"oop" (oop_project.py, a CSV per user under RECIPES_DIR) and "db" (db_recipes.py, SQLite).
+For every --sizes book size each backend gets a synthetic book of that many recipes (see
+synthetic.py) next to --users other accounts, then these operations are timed:
+
+    load     read the whole book (and build or load its ingredient index)
+    add      add one recipe
+    edit     change one recipe's name
+    delete   delete one recipe
+    render   draw one page of the book as a table
+    login    check a username and password
+    search   find recipes by ingredient (full-text search on SQLite)
+
+Each operation runs --ops times per round and the fastest of --repeat rounds is kept.
+Everything happens in a temporary directory, away from the real recipe data.
+
+    python benchmarks/bench_suite.py --sizes 100 1000 10000 --output results.json
+    python benchmarks/bench_suite.py --output new.json --compare results.json
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "RecipeBook"))
+sys.path.insert(0, ROOT)
+
+from synthetic import generate_recipes, usernames, write_book  # noqa: E402
+
+BACKENDS = ["project", "oop", "db"]
+OPERATIONS = ["load", "add", "edit", "delete", "render", "login", "search"]
+SEARCH_TERMS = [["garlic"], ["salt", "pepper"], ["chicken", "rice"], ["lemon", "basil", "thyme"]]
+
+
+class Timings:
+    """Collects the fastest time seen for each operation"""
+
+    def __init__(self):
+        self.best = {}
+
+    @contextlib.contextmanager
+    def time(self, operation, ops=1):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        if operation not in self.best or elapsed < self.best[operation][0]:
+            self.best[operation] = (elapsed, ops)
+
+
+def new_recipes(count, seed):
+    return list(generate_recipes(count, seed=seed))
+
+
+###### Backends ######
+def bench_project(data_dir, username, size, args, timings):
+    import project
+
+    os.chdir(data_dir)
+    if not os.path.exists(project.data_file):
+        with open(project.data_file, mode="w", newline="") as file:
+            csv.writer(file).writerows([name, "secret"] for name in usernames(args.users))
+    with open(project.data_file, mode="a", newline="") as file:
+        csv.writer(file).writerow([username, "secret"])
+    write_book(f"{username}.csv", size)
+    rng = random.Random(size)
+
+    for round_number in range(args.repeat):
+        with timings.time("load"):
+            recipes = project.load_user_recipes(username)
+        with timings.time("add", args.ops):
+            for recipe in new_recipes(args.ops, seed=round_number + 1):
+                project.add_recipe(username, recipes, recipe)
+        with timings.time("edit", args.ops):
+            for n in range(args.ops):
+                project.edit_recipe(username, recipes, rng.randrange(len(recipes)), {"Dish Name": f"Edited {n}"})
+        with timings.time("delete", args.ops):
+            for _ in range(args.ops):
+                project.delete_recipe(username, recipes, rng.randrange(len(recipes)))
+        with timings.time("render", args.ops):
+            for _ in range(args.ops):
+                start = rng.randrange(max(1, len(recipes) - project.PAGE_SIZE))
+                page = range(start, min(start + project.PAGE_SIZE, len(recipes)))
+                project.print_recipes([recipes[n] for n in page], numbers=[n + 1 for n in page])
+        with timings.time("login", args.ops):
+            for _ in range(args.ops):
+                project.check_login(username, "secret")
+        with timings.time("search", args.ops):
+            for n in range(args.ops):
+                project.ingredient_indexes[username].contains_all(SEARCH_TERMS[n % len(SEARCH_TERMS)])
+        project.compact_user_recipes(username)
+
+
+def bench_oop(data_dir, username, size, args, timings):
+    import oop_project
+    from oop_project import Recipe, RecipeBook, User
+
+    os.makedirs(oop_project.RECIPES_DIR, exist_ok=True)
+    if not os.path.exists(oop_project.USER_FILE):
+        with open(oop_project.USER_FILE, mode="w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["user", "password"])
+            writer.writerows([name, "secret"] for name in usernames(args.users))
+    with open(oop_project.USER_FILE, mode="a", newline="") as file:
+        csv.writer(file).writerow([username, "secret"])
+    write_book(os.path.join(oop_project.RECIPES_DIR, f"{username}.csv"), size)
+    rng = random.Random(size)
+
+    for round_number in range(args.repeat):
+        with timings.time("load"):
+            book = RecipeBook(username)
+        with timings.time("add", args.ops):
+            for recipe in new_recipes(args.ops, seed=round_number + 1):
+                book.add_recipe(Recipe.from_dict(recipe))
+        with timings.time("edit", args.ops):
+            for n in range(args.ops):
+                book.edit_recipe(rng.randrange(len(book.recipes)), {"name": f"Edited {n}"})
+        with timings.time("delete", args.ops):
+            for _ in range(args.ops):
+                book.delete_recipe(rng.randrange(len(book.recipes)))
+        with timings.time("render", args.ops):
+            for _ in range(args.ops):
+                start = rng.randrange(max(1, len(book.recipes) - oop_project.PAGE_SIZE))
+                book.list_recipes(range(start, min(start + oop_project.PAGE_SIZE, len(book.recipes))))
+        with timings.time("login", args.ops):
+            for _ in range(args.ops):
+                User.authenticate(username, "secret")
+        with timings.time("search", args.ops):
+            for n in range(args.ops):
+                book.index.contains_all(SEARCH_TERMS[n % len(SEARCH_TERMS)])
+
+
+def bench_db(data_dir, username, size, args, timings):
+    import db_recipes
+    from database import transaction
+    from db_recipes import Recipe, RecipeBook, User
+
+    db_recipes.ensure_database()
+    with transaction() as conn:
+        if not conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            conn.executemany("INSERT INTO users (username, password) VALUES (?, 'secret')",
+                             [(name,) for name in usernames(args.users)])
+        conn.execute("INSERT INTO users (username, password) VALUES (?, 'secret')", (username,))
+    book_file = os.path.join(data_dir, f"{username}-import.csv")
+    write_book(book_file, size)
+    RecipeBook(username).import_recipes(book_file)
+    os.remove(book_file)
+    rng = random.Random(size)
+
+    for round_number in range(args.repeat):
+        with timings.time("load"):
+            book = RecipeBook(username)
+            book.load_user_recipes()
+        ids = [row["Recipe ID"] for row in book.iter_recipes(batch_size=5000)]
+        with timings.time("add", args.ops):
+            for recipe in new_recipes(args.ops, seed=round_number + 1):
+                book.add_recipe(Recipe(*recipe.values()))
+        with timings.time("edit", args.ops):
+            for n in range(args.ops):
+                book.edit_recipe(rng.choice(ids), {"name": f"Edited {n}"})
+        with timings.time("delete", args.ops):
+            for _ in range(args.ops):
+                book.delete_recipe(ids.pop(rng.randrange(len(ids))))
+        with timings.time("render", args.ops):
+            for _ in range(args.ops):
+                book.list_recipes(book.fetch_page(rng.choice(ids) - 1))
+        with timings.time("login", args.ops):
+            for _ in range(args.ops):
+                User.authenticate(username, "secret")
+        with timings.time("search", args.ops):
+            for n in range(args.ops):
+                book.search(" ".join(SEARCH_TERMS[n % len(SEARCH_TERMS)]))
+
+
+BENCHMARKS = {"project": bench_project, "oop": bench_oop, "db": bench_db}
+
+
+###### Results ######
+def commit_hash():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as data_dir:
+        # config.py reads this when oop_project and db_recipes are first imported
+        os.environ["RECIPE_BOOK_DATA_DIR"] = data_dir
+        project_dir = os.path.join(data_dir, "project")
+        os.makedirs(project_dir)
+        try:
+            for size in args.sizes:
+                for backend in args.backends:
+                    timings = Timings()
+                    with contextlib.redirect_stdout(open(os.devnull, "w")):
+                        BENCHMARKS[backend](project_dir, f"bench{size}", size, args, timings)
+                    for operation in OPERATIONS:
+                        seconds, ops = timings.best[operation]
+                        results.append({"backend": backend, "size": size, "operation": operation,
+                                        "seconds": seconds, "ops": ops, "ops_per_sec": ops / seconds if seconds else None})
+                        print(f"{backend:8}{size:>10,}  {operation:8}{seconds / ops * 1000:12.3f} ms/op", file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+            from database import close_connections
+            close_connections()
+    return {
+        "commit": commit_hash(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "settings": {"sizes": args.sizes, "users": args.users, "ops": args.ops, "repeat": args.repeat},
+        "results": results,
+    }
+
+
+def compare(old, new, threshold):
+    """Print new vs old time per operation; returns True if anything got slower than threshold"""
+    previous = {(r["backend"], r["size"], r["operation"]): r for r in old["results"]}
+    regressed = False
+    print(f"{'backend':8}{'size':>10}  {'operation':10}{'old ms/op':>12}{'new ms/op':>12}{'change':>9}")
+    for result in new["results"]:
+        before = previous.get((result["backend"], result["size"], result["operation"]))
+        if before is None:
+            continue
+        old_ms = before["seconds"] / before["ops"] * 1000
+        new_ms = result["seconds"] / result["ops"] * 1000
+        ratio = new_ms / old_ms if old_ms else 1.0
+        flag = "  SLOWER" if ratio > threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"{result['backend']:8}{result['size']:>10,}  {result['operation']:10}{old_ms:12.3f}{new_ms:12.3f}{ratio:8.2f}x{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10_000], help="recipes per book, up to 1000000")
+    parser.add_argument("--users", type=int, default=1000, help="other registered accounts")
+    parser.add_argument("--ops", type=int, default=20, help="times each operation runs per round")
+    parser.add_argument("--repeat", type=int, default=3, help="rounds; the fastest is kept")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="compare against results saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio --compare reports as a regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            sys.exit(1 if compare(json.load(file), results, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Load generator for RecipeBook/api_server.py: reports requests/sec and p50/p99 latency.
+
+Starts a server on a temporary database (or uses --port for one already running), gives
+every simulated client its own account with a --recipes book, then has --clients
+keep-alive connections send a mix of list, get, search, add, edit and delete requests for
+--seconds.
+
+    python benchmarks/load_api.py --clients 50 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import generate_recipes  # noqa: E402
+
+# operation: share of requests
+MIX = {"list": 35, "get": 25, "search": 20, "add": 10, "edit": 7, "delete": 3}
+
+
+class Client:
+    """One keep-alive connection to the server"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.token = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        auth = f"Authorization: Bearer {self.token}\r\n" if self.token else ""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n{auth}"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        status = int(head.split(" ", 2)[1])
+        length = int(head.lower().split("content-length:", 1)[1].split("\r\n", 1)[0])
+        data = await self.reader.readexactly(length)
+        return status, json.loads(data) if data else None
+
+
+async def setup_client(host, port, number, recipes):
+    client = Client(host, port)
+    await client.connect()
+    username = f"load{number}-{os.getpid()}"
+    await client.request("POST", "/register", {"username": username, "password": "secret"})
+    _, login = await client.request("POST", "/login", {"username": username, "password": "secret"})
+    client.token = login["token"]
+    client.ids = []
+    for recipe in generate_recipes(recipes, seed=number):
+        _, created = await client.request("POST", "/recipes", recipe)
+        client.ids.append(created["Recipe ID"])
+    return client
+
+
+async def run_client(client, deadline, latencies, errors):
+    rng = random.Random(id(client))
+    operations, weights = list(MIX), list(MIX.values())
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        if operation in ("get", "edit", "delete") and not client.ids:
+            operation = "add"
+        if operation == "list":
+            request = ("GET", f"/recipes?after_id={rng.choice(client.ids or [1]) - 1}&limit=10", None)
+        elif operation == "get":
+            request = ("GET", f"/recipes/{rng.choice(client.ids)}", None)
+        elif operation == "search":
+            request = ("GET", f"/search?q={rng.choice(['garlic', 'salt', 'chicken', 'soup', 'bake'])}", None)
+        elif operation == "add":
+            request = ("POST", "/recipes", next(generate_recipes(1, seed=rng.random())))
+        elif operation == "edit":
+            request = ("PATCH", f"/recipes/{rng.choice(client.ids)}", {"Dish Name": f"Edited {rng.random():.6f}"})
+        else:
+            request = ("DELETE", f"/recipes/{client.ids.pop(rng.randrange(len(client.ids)))}", None)
+
+        start = time.perf_counter()
+        status, payload = await client.request(*request)
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append((operation, status))
+        elif operation == "add":
+            client.ids.append(payload["Recipe ID"])
+
+
+async def generate_load(host, port, clients, seconds, recipes):
+    pool = await asyncio.gather(*(setup_client(host, port, number, recipes) for number in range(clients)))
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(client, start + seconds, latencies, errors) for client in pool))
+    elapsed = time.perf_counter() - start
+    for client in pool:
+        client.writer.close()
+    return latencies, errors, elapsed
+
+
+def start_server(data_dir, workers, shards=None):
+    server = subprocess.Popen(
+        [sys.executable, "api_server.py", "--port", "0", "--workers", str(workers)] + (["--shards", str(shards)] if shards else []),
+        cwd=os.path.join(ROOT, "RecipeBook"), env=dict(os.environ, RECIPE_BOOK_DATA_DIR=data_dir),
+        stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()  # "Serving the recipe book API on http://host:port"
+    return server, int(line.rsplit(":", 1)[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="use a server that is already running instead of starting one")
+    parser.add_argument("--workers", type=int, default=8, help="SQLite threads for the server this starts")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent connections")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--recipes", type=int, default=50, help="recipes each client starts with")
+    parser.add_argument("--shards", type=int, help="start the server in sharded mode with this many shards")
+    args = parser.parse_args()
+
+    server = data_dir = None
+    port = args.port
+    if port is None:
+        data_dir = tempfile.TemporaryDirectory()
+        server, port = start_server(data_dir.name, args.workers, args.shards)
+    try:
+        latencies, errors, elapsed = asyncio.run(generate_load(args.host, port, args.clients, args.seconds, args.recipes))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            data_dir.cleanup()
+
+    latencies.sort()
+    print(f"{len(latencies):,} requests from {args.clients} clients in {elapsed:.1f} s")
+    print(f"{len(latencies) / elapsed:,.0f} requests/sec")
+    print(f"p50 {statistics.median(latencies) * 1000:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+    if errors:
+        print(f"{len(errors):,} errors, e.g. {errors[:5]}")
+
+
+if __name__ == "__main__":
+    main()
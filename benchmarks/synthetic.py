@@ -0,0 +1,52 @@
+"""Synthetic recipe books for the benchmarks.
+
+Books are generated from a fixed seed, so the same size always gives the same recipes.
+Categories are weighted like a real book (more dinners than snacks) and ingredients are
+drawn from a Zipf-like vocabulary: a few staples such as salt and garlic turn up in most
+recipes, while most ingredients are rare, which is what the ingredient index and full-text
+search actually have to deal with.
+"""
+import csv
+import random
+
+FIELDS = ["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
+CATEGORIES = {"Breakfast": 15, "Lunch": 20, "Dinner": 35, "Snack": 10, "Dessert": 15, "Drinks": 5}
+STAPLES = ("salt pepper garlic onion butter olive-oil flour sugar eggs milk water lemon tomato rice "
+           "chicken cheese cream basil thyme parsley").split()
+VERBS = "chop dice slice whisk stir fold simmer boil bake roast fry saute season toss serve".split()
+STYLES = "Grandma's Quick Spicy Roasted Creamy Crispy Classic Smoky Lemon Herb Summer Winter".split()
+DISHES = "Soup Salad Stew Pie Curry Pasta Tacos Bowl Casserole Bread Cake Omelette Smoothie".split()
+
+
+def vocabulary(size=2000):
+    """Staples first, then made-up rarer ingredients, with Zipf weights (1/rank)"""
+    words = STAPLES + [f"ingredient-{n}" for n in range(size - len(STAPLES))]
+    return words, [1 / rank for rank in range(1, len(words) + 1)]
+
+
+def generate_recipes(count, seed=0):
+    """Yield count recipes as dicts keyed by the CSV field names"""
+    rng = random.Random(seed)
+    words, weights = vocabulary()
+    categories, category_weights = list(CATEGORIES), list(CATEGORIES.values())
+    for n in range(count):
+        ingredients = list(dict.fromkeys(rng.choices(words, weights, k=rng.randint(3, 12))))
+        steps = [f"{rng.choice(VERBS)} the {rng.choice(ingredients)}" for _ in range(rng.randint(2, 8))]
+        yield {
+            "Meal Category": rng.choices(categories, category_weights)[0],
+            "Dish Name": f"{rng.choice(STYLES)} {rng.choice(DISHES)} {n}",
+            "Ingredients": ", ".join(word.replace("-", " ").title() for word in ingredients),
+            "Cooking Directions": ", ".join(steps).capitalize() + ".",
+        }
+
+
+def write_book(path, count, seed=0):
+    """Write a synthetic book as a recipe CSV, with the usual header"""
+    with open(path, mode="w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(generate_recipes(count, seed))
+
+
+def usernames(count):
+    return [f"user{n:06d}" for n in range(count)]
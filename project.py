@@ -23,21 +23,49 @@
 import csv
 import os
 import getpass
-import textwrap
-from tabulate import tabulate
-from pyfiglet import Figlet
+from RecipeBook import banner, instrumentation
+from RecipeBook.bulk_io import Progress, read_recipes, write_recipes
+from RecipeBook.ingredient_index import IngredientIndex, file_stamp
+from RecipeBook.instrumentation import timed
+from RecipeBook.locking import StaleBookError, atomic_write, file_lock, version_stamp
+from RecipeBook.offset_index import OffsetIndex
+from RecipeBook.pager import PAGE_SIZE, page_count, view_pages
+from RecipeBook.table_renderer import RecipeTable
+from RecipeBook.user_directory import UserDirectory
 
-f = Figlet(font='small')
 data_file = 'users.csv'
+fieldnames = ["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
+# Registered users, read from data_file on first use and again only when the file changes
+user_directory = UserDirectory(data_file)
+
+# Every add, edit and delete is appended to <username>.journal instead of rewriting
+# <username>.csv. Once the journal holds this many entries it is folded back into the CSV.
+JOURNAL_COMPACT_THRESHOLD = 500
+journal_sizes = {}
+# Version stamp of each user's CSV and journal as this session last read or wrote them.
+# A change made while the files hold a different stamp raises StaleBookError.
+book_versions = {}
+ingredient_indexes = {}
+recipe_table = RecipeTable(["No.", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"])
 
 def main():
+    import argparse  # only needed when run as a program, so importing project stays cheap
+    from RecipeBook.batch import add_batch_commands, run_batch
+    parser = argparse.ArgumentParser(description="Digital Recipe Book")
+    banner.add_banner_option(parser)
+    add_batch_commands(parser)
+    args = parser.parse_args()
+    if args.command or args.stdin_jsonl:
+        raise SystemExit(run_batch(args, BatchBook))
+    banner.show_banner = not args.no_banner
+
     main_menu()
     print("Thank you for using your Recipe Book!")
-    print(f.renderText("Goodbye!"))
+    print(banner.render_banner("Goodbye!"))
 
 def main_menu():
     """ Initiate the program asking the user to register or to enter the program"""
-    print(f.renderText("Welcome to your digital Recipe Book"))
+    print(banner.render_banner("Welcome to your digital Recipe Book"))
     while True:  
         print("\nMain Menu\n")
         try:
@@ -57,33 +85,24 @@ def main_menu():
 def create_user():
     """Creates new username and password, and creates a recipes file for the newly registered user."""
     register_user = input("Enter a username: ").lower().strip()
+    while register_user in user_directory:
+        print(f"The username {register_user} is already taken.")
+        register_user = input("Enter a different username: ").lower().strip()
     register_pwd = getpass.getpass(f"Enter a password for {register_user}: ").strip()
-
-    with open("users.csv", "a") as file:
-        writer = csv.DictWriter(file, fieldnames=["user", "password"])
-        writer.writerow({"user": register_user, "password": register_pwd})
+    user_directory.register(register_user, register_pwd)
 
     user_recipe_file = f"{register_user}.csv"
     with open(user_recipe_file, mode='w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"])
-
-    global users_data
-    users_data = load_users()
+        writer.writerow(fieldnames)
+    if os.path.exists(journal_file(register_user)):
+        os.remove(journal_file(register_user))
+    journal_sizes[register_user] = 0
 
+@timed("auth.load_users")
 def load_users():
-    """Load users from a CSV file and return a dictionary of username: password."""
-    users = {}
-    if os.path.exists(data_file):
-        with open(data_file, mode='r', newline='') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                if len(row) == 2:  
-                    username, password = row
-                    users[username] = password
-    return users
-
-users_data = load_users()
+    """Return a dictionary of username: stored password (a salted hash for newer users)."""
+    return dict(user_directory.users())
 
 def user_login():
     """Authenticate user login and proceed to recipes menu."""
@@ -92,8 +111,8 @@ def user_login():
         username = input("\nEnter your User Name: ").lower().strip()
         password = getpass.getpass("Enter your password: ").strip()
         
-        if username in users_data and users_data[username] == password:
-            print(f.renderText(f"{username}'s recipes!"))
+        if check_login(username, password):
+            print(banner.render_banner(f"{username}'s recipes!"))
             recipes_menu(username) 
             return True 
         else:
@@ -102,23 +121,185 @@ def user_login():
             print(f"Invalid username or password!\n{attempts_left} attempts left. Please try again.")
     return False
 
+@timed("auth.check_login")
+def check_login(username, password):
+    """Return True if the username and password match a registered user."""
+    return user_directory.verify(username, password)
+
+def journal_file(username):
+    """Return the name of the user's journal file."""
+    return f"{username}.journal"
+
+def lock_file(username):
+    """Return the name of the file that locks the user's recipe files between sessions."""
+    return f"{username}.lock"
+
+def book_version(username):
+    return version_stamp(f"{username}.csv", journal_file(username))
+
+def check_book_version(username):
+    """Raise StaleBookError if another session changed the user's book since this one last read or wrote it."""
+    expected = book_versions.get(username)
+    if expected is not None and expected != book_version(username):
+        raise StaleBookError(f"{username}'s recipe book was changed in another session")
+
+@timed("storage.load_user_recipes")
 def load_user_recipes(username):
-    """Load recipes for the given user."""
+    """Load recipes for the given user: the last CSV snapshot plus any journaled changes."""
     filename = f"{username}.csv"
     recipes = []
-    with open(filename, mode='r', newline='') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            recipes.append(row)
+    with file_lock(lock_file(username), shared=True):
+        with open(filename, mode='r', newline='') as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                recipes.append(row)
+        journal_sizes[username] = replay_journal(username, recipes)
+        book_versions[username] = book_version(username)
+    load_ingredient_index(username, recipes)
     return recipes
 
+def iter_user_recipes(username):
+    """Yield the user's recipes one at a time without loading the whole book.
+
+    With pending journal entries the book has to be replayed first, so it is loaded in full.
+    """
+    if os.path.exists(journal_file(username)):
+        yield from load_user_recipes(username)
+        return
+    with file_lock(lock_file(username), shared=True):
+        with open(f"{username}.csv", mode='r', newline='') as file:
+            yield from csv.DictReader(file)
+
+def replay_journal(username, recipes):
+    """Apply the user's journal entries, in order, to the recipes list. Returns the number of entries."""
+    entries = 0
+    if not os.path.exists(journal_file(username)):
+        return entries
+    with open(journal_file(username), mode='r', newline='') as file:
+        for row in csv.reader(file):
+            if len(row) != 6:
+                continue  # a torn write from an interrupted session
+            op, index, values = row[0], int(row[1]), row[2:]
+            recipe = dict(zip(fieldnames, values))
+            if op == "add":
+                recipes.append(recipe)
+            elif op == "edit" and 0 <= index < len(recipes):
+                recipes[index] = recipe
+            elif op == "delete":
+                # The tombstone carries the deleted recipe, so it still removes the right
+                # row if the caller's list did not match the book on disk.
+                if 0 <= index < len(recipes) and recipes[index] == recipe:
+                    del recipes[index]
+                elif recipe in recipes:
+                    recipes.remove(recipe)
+            entries += 1
+    return entries
+
+@timed("storage.append_journal")
+def append_journal(username, op, index, recipe):
+    """Record a single change in the user's journal, compacting it once it grows too large.
+
+    Callers hold the user's lock and have checked the book is not stale.
+    """
+    with open(journal_file(username), mode='a', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([op, index] + [recipe.get(field, "") for field in fieldnames])
+    book_versions[username] = book_version(username)
+    journal_sizes[username] = journal_sizes.get(username, 0) + 1
+    if journal_sizes[username] >= JOURNAL_COMPACT_THRESHOLD:
+        compact_user_recipes(username)
+
+@timed("storage.compact_user_recipes")
+def compact_user_recipes(username):
+    """Fold the user's journal back into their CSV file."""
+    with file_lock(lock_file(username)):
+        if os.path.exists(journal_file(username)):
+            save_user_recipes(username, load_user_recipes(username))
+
+@timed("storage.save_user_recipes")
 def save_user_recipes(username, recipes):
-    """Save recipes to the user's CSV file."""
+    """Replace the user's CSV file with recipes and start a fresh journal.
+
+    The new file is written under a temporary name and renamed into place, so other
+    sessions never read a half-written book.
+    """
+    filename = f"{username}.csv"
+    with file_lock(lock_file(username)):
+        with atomic_write(filename) as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(recipes)
+        OffsetIndex.build(filename).save(offsets_file(username), file_stamp(filename))
+        if os.path.exists(journal_file(username)):
+            os.remove(journal_file(username))
+        journal_sizes[username] = 0
+        book_versions[username] = book_version(username)
+
+def offsets_file(username):
+    """Return the name of the file that records where each recipe starts in the user's CSV."""
+    return f"{username}.offsets"
+
+@timed("storage.load_offset_index")
+def load_offset_index(username):
+    """Load the saved recipe offsets for the user's CSV, or index the CSV again if it changed since."""
     filename = f"{username}.csv"
-    with open(filename, mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=["Meal Category", "Dish Name", "Ingredients", "Cooking Directions"])
-        writer.writeheader()
-        writer.writerows(recipes)
+    index = OffsetIndex.load(offsets_file(username), file_stamp(filename))
+    if index is None:
+        index = OffsetIndex.build(filename)
+        index.save(offsets_file(username), file_stamp(filename))
+    return index
+
+@timed("storage.peek_recipe")
+def peek_recipe(username, number):
+    """Return recipe number (from 1) in the user's book, or None if there is no such recipe.
+
+    The CSV is memory-mapped and only that recipe is parsed, unless journaled changes are
+    pending, in which case the book has to be loaded and replayed.
+    """
+    if os.path.exists(journal_file(username)):
+        recipes = load_user_recipes(username)
+        return recipes[number - 1] if 0 < number <= len(recipes) else None
+    with file_lock(lock_file(username), shared=True):
+        index = load_offset_index(username)
+        return index.read(f"{username}.csv", number - 1) if 0 < number <= len(index) else None
+
+def index_file(username):
+    """Return the name of the file the user's ingredient index is saved in."""
+    return f"{username}.ingredients.json"
+
+def book_stamp(username):
+    """Size and modification time of the user's recipe files, to tell whether a saved index is stale."""
+    return file_stamp(f"{username}.csv", journal_file(username))
+
+@timed("storage.load_ingredient_index")
+def load_ingredient_index(username, recipes):
+    """Load the user's saved ingredient index, or build it from the recipes if it is out of date."""
+    index = IngredientIndex.load(index_file(username), book_stamp(username))
+    if index is None or len(index) != len(recipes):
+        index = IngredientIndex.build(recipe.get("Ingredients", "") for recipe in recipes)
+    ingredient_indexes[username] = index
+    return index
+
+@timed("storage.save_ingredient_index")
+def save_ingredient_index(username):
+    """Save the user's ingredient index next to their recipe file."""
+    if username in ingredient_indexes:
+        ingredient_indexes[username].save(index_file(username), book_stamp(username))
+
+def update_ingredient_index(username, recipes, op, position):
+    """Apply an add, edit or delete that was just made to recipes to the user's ingredient index."""
+    index = ingredient_indexes.get(username)
+    if index is None:
+        return
+    if op == "add" and len(index) + 1 == len(recipes):
+        index.add(recipes[position].get("Ingredients", ""))
+    elif op == "edit" and len(index) == len(recipes):
+        index.update(position, recipes[position].get("Ingredients", ""))
+    elif op == "delete" and len(index) - 1 == len(recipes):
+        index.remove(position)
+    else:
+        # The index was built for a different list, rebuild it the next time it is needed
+        del ingredient_indexes[username]
 
 def add_recipe(username, recipes, recipe=None):
     """Add a new recipe to the user's collection."""
@@ -134,22 +315,38 @@ def add_recipe(username, recipes, recipe=None):
             "Cooking Directions": directions
         }
     
-    recipes.append(recipe)
-    save_user_recipes(username, recipes)
+    with file_lock(lock_file(username)):
+        check_book_version(username)
+        recipes.append(recipe)
+        append_journal(username, "add", len(recipes) - 1, recipe)
+    update_ingredient_index(username, recipes, "add", len(recipes) - 1)
     print("Recipe added successfully!")
 
 
-def edit_recipe(username, recipes):
-    """Edit an existing recipe."""
-    print_recipes(recipes)
-    choice = int(input("Enter the number of the recipe to edit: ")) - 1
-    if 0 <= choice < len(recipes):
+def edit_recipe(username, recipes, recipe_index=None, changes=None):
+    """Edit an existing recipe. changes maps field names to new values; without it the user is asked."""
+    if recipe_index is None:
+        view_recipes(recipes, done_label="Choose a recipe")
+        choice = int(input("Enter the number of the recipe to edit: ")) - 1
+    else:
+        choice = recipe_index
+    if 0 <= choice < len(recipes) and changes is not None:
+        with file_lock(lock_file(username)):
+            check_book_version(username)
+            recipes[choice].update((field, value) for field, value in changes.items() if field in fieldnames)
+            append_journal(username, "edit", choice, recipes[choice])
+        update_ingredient_index(username, recipes, "edit", choice)
+        print("Recipe updated successfully!")
+    elif 0 <= choice < len(recipes):
         recipe = recipes[choice]
         recipe['Meal Category'] = input(f"Enter new Meal Category (current: {recipe['Meal Category']}): ").strip() or recipe['Meal Category']
         recipe['Dish Name'] = input(f"Enter new Dish Name (current: {recipe['Dish Name']}): ").strip() or recipe['Dish Name']
         recipe['Ingredients'] = input(f"Enter new Ingredients (current: {recipe['Ingredients']}): ").strip() or recipe['Ingredients']
         recipe['Cooking Directions'] = input(f"Enter new Cooking Directions (current: {recipe['Cooking Directions']}): ").strip() or recipe['Cooking Directions']
-        save_user_recipes(username, recipes)
+        with file_lock(lock_file(username)):
+            check_book_version(username)
+            append_journal(username, "edit", choice, recipe)
+        update_ingredient_index(username, recipes, "edit", choice)
         print("Recipe updated successfully!")
     else:
         print("Invalid choice. Returning to menu.")
@@ -157,7 +354,7 @@ def edit_recipe(username, recipes):
 def delete_recipe(username, recipes, recipe_index=None):
     """Delete a recipe from the user's collection."""
     if recipe_index is None:
-        print_recipes(recipes)
+        view_recipes(recipes, done_label="Choose a recipe")
         try:
             recipe_index = int(input("Enter the number of the recipe to delete: ")) - 1
         except ValueError:
@@ -166,26 +363,117 @@ def delete_recipe(username, recipes, recipe_index=None):
     
 
     if 0 <= recipe_index < len(recipes):
-        del recipes[recipe_index]
-        save_user_recipes(username, recipes)
+        with file_lock(lock_file(username)):
+            check_book_version(username)
+            recipe = recipes.pop(recipe_index)
+            append_journal(username, "delete", recipe_index, recipe)
+        update_ingredient_index(username, recipes, "delete", recipe_index)
         print("Recipe deleted successfully!")
     else:
         print("Invalid choice. Returning to menu.")
 
 
-def print_recipes(recipes):
+@timed("storage.import_recipes")
+def import_recipes(username, source, show_progress=False):
+    """Append every recipe in a CSV or JSONL file (such as another user's book) to the user's CSV.
+
+    The rows are streamed straight into the file through one large buffer, so memory stays
+    flat however big the source is. Returns the number of recipes imported; reload the
+    user's recipes afterwards to see them.
+    """
+    if os.path.exists(source) and os.path.samefile(source, f"{username}.csv"):
+        raise ValueError("A recipe book cannot be imported into itself")
+    progress = Progress(f"Importing into {username}")
+    rows = read_recipes(source)
+    if show_progress:
+        rows = progress.track(rows)
+    with file_lock(lock_file(username)):
+        compact_user_recipes(username)  # imported rows go after the snapshot, so fold the journal in first
+        offsets = OffsetIndex.load(offsets_file(username), file_stamp(f"{username}.csv"))
+        count = write_recipes(rows, f"{username}.csv", header=False, mode='a')
+        if offsets is not None:
+            offsets.extend(f"{username}.csv")  # index only the appended recipes
+            offsets.save(offsets_file(username), file_stamp(f"{username}.csv"))
+    ingredient_indexes.pop(username, None)
+    if show_progress:
+        progress.report(finished=True)
+    return count
+
+@timed("storage.export_recipes")
+def export_recipes(username, destination, show_progress=False):
+    """Stream the user's recipes to a CSV or JSONL file. Returns the number of recipes exported."""
+    progress = Progress(f"Exporting {username}")
+    rows = iter_user_recipes(username)
+    if show_progress:
+        rows = progress.track(rows)
+    count = write_recipes(rows, destination)
+    if show_progress:
+        progress.report(finished=True)
+    return count
+
+def find_recipes(username, recipes):
+    """Find the user's recipes that can be made with the ingredients they have on hand."""
+    have = input("Enter the ingredients you have (comma-separated), or nothing to find recipes like one of yours: ")
+    index = ingredient_indexes.get(username)
+    if index is None or len(index) != len(recipes):
+        index = load_ingredient_index(username, recipes)
+    if not have.strip():
+        find_similar_recipes(recipes, index)
+        return
+
+    have = have.split(",")
+    mode = input("Show recipes that use:\n 1 - all of them\n 2 - any of them\n 3 - them, with a few ingredients missing\nYour choice: ").strip()
+    if mode == "1":
+        positions = index.contains_all(have)
+    elif mode == "2":
+        positions = index.contains_any(have)
+    elif mode == "3":
+        try:
+            missing = int(input("How many missing ingredients are OK? "))
+        except ValueError:
+            print("Invalid input. Returning to menu.")
+            return
+        positions = index.missing_at_most(have, missing)
+    else:
+        print("Invalid choice. Returning to menu.")
+        return
+    print_recipes([recipes[position] for position in positions], numbers=[position + 1 for position in positions])
+
+def find_similar_recipes(recipes, index):
+    """Show the recipes whose ingredients are most like those of a recipe the user picks."""
+    try:
+        position = int(input("Enter the number of the recipe: ")) - 1
+    except ValueError:
+        position = -1
+    if not 0 <= position < len(recipes):
+        print("Invalid choice. Returning to menu.")
+        return
+    positions = [similar for similar, _ in index.similar(position)]
+    print_recipes([recipes[position] for position in positions], numbers=[position + 1 for position in positions])
+
+def view_recipes(recipes, page_size=PAGE_SIZE, done_label="Back to menu"):
+    """Display the recipes one page at a time, formatting only the page on screen."""
+    if not recipes:
+        print("No recipes found.")
+        return
+
+    def show_page(page):
+        start = page * page_size
+        end = min(start + page_size, len(recipes))
+        print_recipes(recipes[start:end], numbers=range(start + 1, end + 1))
+
+    view_pages(show_page, page_count(len(recipes), page_size), done_label)
+
+@timed("render.print_recipes")
+def print_recipes(recipes, numbers=None):
     """Display all recipes for the user in a tabular format with numbering and wrapped text."""
     if recipes:
-        print(f"\nMy Recipes:")
-        headers = ["No.", "Meal Category", "Dish Name", "Ingredients", "Cooking Directions"]
-        rows = []
-        for idx, recipe in enumerate(recipes, start=1):
-            wrapped_ingredients = "\n".join(textwrap.wrap(recipe.get("Ingredients", ""), width=25))
-            wrapped_directions = "\n".join(textwrap.wrap(recipe.get("Cooking Directions", ""), width=40))
-            row = [idx, recipe.get("Meal Category", ""), recipe.get("Dish Name", ""),
-                   wrapped_ingredients, wrapped_directions]
-            rows.append(row)
-        print(tabulate(rows, headers=headers, tablefmt="rounded_grid"))
+        rows = [
+            (idx, recipe.get("Meal Category", ""), recipe.get("Dish Name", ""),
+             recipe.get("Ingredients", ""), recipe.get("Cooking Directions", ""))
+            for idx, recipe in zip(numbers or range(1, len(recipes) + 1), recipes)
+        ]
+        recipe_table.write(rows, title="\nMy Recipes:")
     else:
         print("No recipes found.")
 
@@ -193,23 +481,110 @@ def recipes_menu(username):
     """Displays the recipe management menu for a logged-in user."""
     recipes = load_user_recipes(username)  # Load recipes for the logged-in user
     while True:
-        print(f"\nSelect an option:\n 1 - Add New Recipe\n 2 - Edit Existing Recipe\n 3 - Delete Recipe\n 4 - View {username}'s Recipes\n 5 - Logout")
+        print(f"\nSelect an option:\n 1 - Add New Recipe\n 2 - Edit Existing Recipe\n 3 - Delete Recipe\n 4 - View {username}'s Recipes\n 5 - Find Recipes by Ingredients\n 6 - Logout"
+              + ("\n 7 - Show Timings" if instrumentation.enabled else ""))
         choice = input("Your choice: ").strip()
-        if choice == "1":
-            add_recipe(username, recipes)
-        elif choice == "2":
-            edit_recipe(username, recipes)
-        elif choice == "3":
-            delete_recipe(username, recipes)
+        if choice in ("1", "2", "3"):
+            try:
+                if choice == "1":
+                    add_recipe(username, recipes)
+                elif choice == "2":
+                    edit_recipe(username, recipes)
+                else:
+                    delete_recipe(username, recipes)
+            except StaleBookError as error:
+                print(f"{error}. Your recipes have been reloaded, please try again.")
+                recipes = load_user_recipes(username)
         elif choice == "4":
-            print_recipes(recipes)
+            view_recipes(recipes)
         elif choice == "5":
+            find_recipes(username, recipes)
+        elif choice == "6":
             print("Logging out...")
+            compact_user_recipes(username)
+            save_ingredient_index(username)
             break
+        elif choice == "7" and instrumentation.enabled:
+            instrumentation.report()
         else:
             print("Invalid option, please try again.")
 
 
+class BatchBook:
+    """A user's recipes for the batch commands in RecipeBook/batch.py. Keys are recipe numbers, from 1."""
+
+    def __init__(self, username):
+        if not os.path.exists(f"{username}.csv"):
+            raise ValueError(f"No recipe book for {username}")
+        self.username = username
+        self._recipes = None  # the whole book, loaded by the first command that needs more than one recipe
+
+    @property
+    def recipes(self):
+        if self._recipes is None:
+            self._recipes = load_user_recipes(self.username)
+        return self._recipes
+
+    def numbered(self, position):
+        return {"No.": position + 1, **self.recipes[position]}
+
+    def position(self, key):
+        position = int(key) - 1
+        if not 0 <= position < len(self.recipes):
+            raise KeyError(f"No recipe number {key}")
+        return position
+
+    def add(self, recipe):
+        add_recipe(self.username, self.recipes, recipe)
+        return self.numbered(len(self.recipes) - 1)
+
+    def get(self, key):
+        if self._recipes is None:
+            # Read just this recipe rather than loading the book
+            recipe = peek_recipe(self.username, int(key))
+            if recipe is None:
+                raise KeyError(f"No recipe number {key}")
+            return {"No.": int(key), **recipe}
+        return self.numbered(self.position(key))
+
+    def list(self, offset=0, limit=None):
+        end = len(self.recipes) if limit is None else min(offset + limit, len(self.recipes))
+        return [self.numbered(position) for position in range(offset, end)]
+
+    def edit(self, key, changes):
+        position = self.position(key)
+        edit_recipe(self.username, self.recipes, position, changes)
+        return self.numbered(position)
+
+    def delete(self, key):
+        position = self.position(key)
+        recipe = self.numbered(position)
+        delete_recipe(self.username, self.recipes, position)
+        return recipe
+
+    def search(self, query, limit=10):
+        """Recipes that use every one of the comma-separated ingredients in query"""
+        index = ingredient_indexes.get(self.username)
+        if index is None or len(index) != len(self.recipes):
+            index = load_ingredient_index(self.username, self.recipes)
+        return [self.numbered(position) for position in index.contains_all(query.split(","))[:limit]]
+
+    def import_file(self, path):
+        count = import_recipes(self.username, path)
+        self._recipes = None
+        return count
+
+    def export_file(self, path):
+        return export_recipes(self.username, path)
+
+    def flush(self):
+        # Changes are already in the journal; only the ingredient index needs saving
+        save_ingredient_index(self.username)
+
+    def recover(self, error):
+        if isinstance(error, StaleBookError):
+            self._recipes = None
+
 
 # Call main
 if __name__ == "__main__":
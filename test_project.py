@@ -1,4 +1,31 @@
-from project import load_users, add_recipe, delete_recipe, load_user_recipes
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import pytest
+import project
+from project import load_users, add_recipe, edit_recipe, delete_recipe, load_user_recipes, save_user_recipes, compact_user_recipes, ingredient_indexes, save_ingredient_index, import_recipes, export_recipes
+from RecipeBook.batch import add_batch_commands, run_batch, run_jsonl
+from RecipeBook.ingredient_index import IngredientIndex, SimilarityIndex, load_numpy
+from RecipeBook.instrumentation import Histogram, statement_key
+from RecipeBook.locking import StaleBookError, file_lock
+from RecipeBook.offset_index import OffsetIndex, redo_file
+from RecipeBook.query_cache import QueryCache
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "RecipeBook"))  # the SQLite modules import each other by name
+import api_server
+import database
+import db_recipes
+import oop_project
+import schema
+import shards
+import snapshot
+import storage
+import write_queue
 
 def test_load_users():
     """Test if load_users correctly loads user data."""
@@ -45,4 +72,752 @@ def test_delete_recipe():
     
     updated_recipes = load_user_recipes(username)
     assert len(updated_recipes) == initial_count - 1
-    assert recipe_to_add_and_delete not in updated_recipes
\ No newline at end of file
+    assert recipe_to_add_and_delete not in updated_recipes
+
+def test_journal_appends_and_compacts(tmp_path, monkeypatch):
+    """Test that recipe changes are journaled instead of rewriting the CSV, and compacted later."""
+    monkeypatch.chdir(tmp_path)
+    username = "journaluser"
+    save_user_recipes(username, [])
+    snapshot = (tmp_path / "journaluser.csv").read_text()
+
+    recipes = load_user_recipes(username)
+    first = {"Meal Category": "Lunch", "Dish Name": "Soup", "Ingredients": "Water, Salt", "Cooking Directions": "Boil"}
+    second = {"Meal Category": "Dinner", "Dish Name": "Stew", "Ingredients": "Beef,\nCarrot", "Cooking Directions": "Simmer"}
+    add_recipe(username, recipes, recipe=first)
+    add_recipe(username, recipes, recipe=second)
+    delete_recipe(username, recipes, recipe_index=0)
+
+    assert (tmp_path / "journaluser.csv").read_text() == snapshot
+    assert os.path.exists(tmp_path / "journaluser.journal")
+    assert load_user_recipes(username) == [second]
+
+    compact_user_recipes(username)
+    assert not os.path.exists(tmp_path / "journaluser.journal")
+    assert load_user_recipes(username) == [second]
+
+def test_journal_threshold_triggers_compaction(tmp_path, monkeypatch):
+    """Test that the journal is folded into the CSV once it reaches the threshold."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(project, "JOURNAL_COMPACT_THRESHOLD", 3)
+    username = "journaluser"
+    save_user_recipes(username, [])
+    recipes = load_user_recipes(username)
+    for n in range(3):
+        add_recipe(username, recipes, recipe={"Meal Category": "Snack", "Dish Name": f"Dish {n}", "Ingredients": "", "Cooking Directions": ""})
+    assert not os.path.exists(tmp_path / "journaluser.journal")
+    assert [r["Dish Name"] for r in load_user_recipes(username)] == ["Dish 0", "Dish 1", "Dish 2"]
+
+def test_ingredient_index_follows_changes(tmp_path, monkeypatch):
+    """Test that the ingredient index answers queries and stays in step with adds and deletes."""
+    monkeypatch.chdir(tmp_path)
+    username = "indexuser"
+    save_user_recipes(username, [
+        {"Meal Category": "Lunch", "Dish Name": "Toast", "Ingredients": "Bread, Butter", "Cooking Directions": "Toast"},
+        {"Meal Category": "Dinner", "Dish Name": "Salad", "Ingredients": "Lettuce, Tomato, Olive  Oil", "Cooking Directions": "Toss"},
+    ])
+    recipes = load_user_recipes(username)
+    add_recipe(username, recipes, recipe={"Meal Category": "Lunch", "Dish Name": "Bruschetta", "Ingredients": "Bread, tomato, olive oil", "Cooking Directions": "Top"})
+    delete_recipe(username, recipes, recipe_index=0)
+
+    index = ingredient_indexes[username]
+    assert index.contains_all(["bread", "Tomato"]) == [1]
+    assert index.contains_any(["butter", "lettuce"]) == [0]
+    assert index.missing_at_most(["tomato", "olive oil"], 1) == [0, 1]
+
+    compact_user_recipes(username)
+    save_ingredient_index(username)
+    del ingredient_indexes[username]
+    load_user_recipes(username)
+    assert ingredient_indexes[username].contains_all(["olive oil"]) == [0, 1]
+
+def test_import_and_export_recipes(tmp_path, monkeypatch):
+    """Test that recipes can be bulk imported from JSONL and exported back to CSV."""
+    monkeypatch.chdir(tmp_path)
+    username = "bulkuser"
+    save_user_recipes(username, [])
+    recipes = load_user_recipes(username)
+    add_recipe(username, recipes, recipe={"Meal Category": "Lunch", "Dish Name": "Toast", "Ingredients": "Bread", "Cooking Directions": "Toast"})
+    (tmp_path / "import.jsonl").write_text(
+        '{"Meal Category": "Dinner", "Dish Name": "Stew", "Ingredients": "Beef", "Cooking Directions": "Simmer,\\nslowly"}\n'
+        '{"Dish Name": "Water"}\n'
+    )
+
+    assert import_recipes(username, "import.jsonl") == 2
+    assert [r["Dish Name"] for r in load_user_recipes(username)] == ["Toast", "Stew", "Water"]
+    assert load_user_recipes(username)[1]["Cooking Directions"] == "Simmer,\nslowly"
+
+    assert export_recipes(username, "export.csv") == 3
+    save_user_recipes("otheruser", [])
+    assert import_recipes("otheruser", "export.csv") == 3
+    assert load_user_recipes("otheruser") == load_user_recipes(username)
+
+def test_edit_recipe_with_changes(tmp_path, monkeypatch):
+    """Test that a recipe can be edited without prompting, changing only the given fields."""
+    monkeypatch.chdir(tmp_path)
+    username = "edituser"
+    save_user_recipes(username, [])
+    recipes = load_user_recipes(username)
+    add_recipe(username, recipes, recipe={"Meal Category": "Lunch", "Dish Name": "Soup", "Ingredients": "Water", "Cooking Directions": "Boil"})
+    edit_recipe(username, recipes, recipe_index=0, changes={"Dish Name": "Broth", "Ingredients": "Water, Salt"})
+
+    assert load_user_recipes(username) == [{"Meal Category": "Lunch", "Dish Name": "Broth", "Ingredients": "Water, Salt", "Cooking Directions": "Boil"}]
+    assert ingredient_indexes[username].contains_all(["salt"]) == [0]
+
+def test_user_directory_registers_hashed_users(tmp_path, monkeypatch):
+    """Test that new users get salted password hashes, unique names, and that outside changes are picked up."""
+    monkeypatch.chdir(tmp_path)
+    project.user_directory.register("alice", "secret")
+
+    assert load_users()["alice"].startswith("pbkdf2_sha256$")
+    assert project.check_login("alice", "secret")
+    assert not project.check_login("alice", "wrong")
+    with pytest.raises(ValueError):
+        project.user_directory.register("alice", "other")
+
+    with open("users.csv", "a", newline="") as file:
+        file.write("bob,plaintext\r\n")
+    assert "bob" in project.user_directory
+    assert project.check_login("bob", "plaintext")
+
+def test_stale_book_is_detected(tmp_path, monkeypatch):
+    """Test that a change to a book another session has changed is refused instead of clobbering it."""
+    monkeypatch.chdir(tmp_path)
+    username = "shareduser"
+    save_user_recipes(username, [])
+    recipes = load_user_recipes(username)
+    with open("shareduser.journal", "a", newline="") as file:
+        file.write("add,0,Lunch,Soup,Water,Boil\r\n")  # another session's change
+
+    with pytest.raises(StaleBookError):
+        add_recipe(username, recipes, recipe={"Meal Category": "Dinner", "Dish Name": "Stew", "Ingredients": "", "Cooking Directions": ""})
+    assert [r["Dish Name"] for r in load_user_recipes(username)] == ["Soup"]
+
+def add_recipes_in_session(username, count):
+    recipes = load_user_recipes(username)
+    added = 0
+    while added < count:
+        try:
+            add_recipe(username, recipes, recipe={"Meal Category": "Snack", "Dish Name": f"{os.getpid()}-{added}", "Ingredients": "", "Cooking Directions": ""})
+            added += 1
+        except StaleBookError:
+            recipes = load_user_recipes(username)
+
+def test_concurrent_sessions_keep_every_recipe(tmp_path, monkeypatch):
+    """Test that sessions in several processes adding to one book never lose each other's recipes."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(project, "JOURNAL_COMPACT_THRESHOLD", 7)
+    username = "shareduser"
+    save_user_recipes(username, [])
+    context = multiprocessing.get_context("fork")
+    sessions = [context.Process(target=add_recipes_in_session, args=(username, 20)) for _ in range(4)]
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.join()
+
+    assert all(session.exitcode == 0 for session in sessions)
+    assert len(load_user_recipes(username)) == 80
+
+def test_batch_commands_from_jsonl(tmp_path, monkeypatch):
+    """Test that JSON-lines batch commands run against one loaded book and report each result."""
+    monkeypatch.chdir(tmp_path)
+    save_user_recipes("batchuser", [])
+    commands = [
+        {"command": "add", "recipe": {"Dish Name": "Soup", "Ingredients": "Water, Salt"}},
+        {"command": "add", "recipe": {"Dish Name": "Toast", "Ingredients": "Bread"}},
+        {"command": "edit", "key": 2, "changes": {"Meal Category": "Breakfast"}},
+        {"command": "search", "query": "salt"},
+        {"command": "delete", "key": 7},
+        {"command": "list"},
+    ]
+    out = io.StringIO()
+    failures = run_jsonl(project.BatchBook, "batchuser", [json.dumps(c) for c in commands], out)
+    replies = [json.loads(line) for line in out.getvalue().splitlines()]
+
+    assert failures == 1 and not replies[4]["ok"]
+    assert [r["Dish Name"] for r in replies[3]["result"]] == ["Soup"]
+    assert [(r["No."], r["Meal Category"], r["Dish Name"]) for r in replies[5]["result"]] == [(1, "", "Soup"), (2, "Breakfast", "Toast")]
+    assert len(load_user_recipes("batchuser")) == 2
+
+def test_offset_index_reads_and_rewrites_single_recipes(tmp_path, monkeypatch):
+    """Test that recipes are read and rewritten through the offset index, multi-line fields included."""
+    monkeypatch.chdir(tmp_path)
+    username = "offsetuser"
+    save_user_recipes(username, [
+        {"Meal Category": "Dinner", "Dish Name": "Stew", "Ingredients": "Beef", "Cooking Directions": "Brown the beef,\n\nthen \"simmer\""},
+        {"Meal Category": "Lunch", "Dish Name": "Toast", "Ingredients": "Bread", "Cooking Directions": "Toast"},
+    ])
+    assert project.peek_recipe(username, 1)["Cooking Directions"] == 'Brown the beef,\n\nthen "simmer"'
+    assert project.peek_recipe(username, 2)["Dish Name"] == "Toast"
+    assert project.peek_recipe(username, 3) is None
+
+    (tmp_path / "import.jsonl").write_text('{"Dish Name": "Water"}\n')
+    import_recipes(username, "import.jsonl")
+    assert project.peek_recipe(username, 3)["Dish Name"] == "Water"
+
+    index = OffsetIndex.build(f"{username}.csv")
+    head = (tmp_path / f"{username}.csv").read_bytes()[:index.offsets[0]]
+    index.splice(f"{username}.csv", 0, 1, [["Dinner", "Stew", "Beef", "Simmer"], ["Lunch", "Rye Toast", "Rye", "Toast,\nbutter"]])
+    assert (tmp_path / f"{username}.csv").read_bytes().startswith(head)
+    assert list(index.offsets) == list(OffsetIndex.build(f"{username}.csv").offsets)
+    assert [r["Dish Name"] for r in load_user_recipes(username)] == ["Stew", "Rye Toast", "Toast", "Water"]
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=pytest.mark.skipif(load_numpy() is None, reason="NumPy is not installed"))])
+def test_similar_recipes_follow_changes(use_numpy):
+    """Test that similar recipes are ranked by shared ingredients and follow adds, edits and deletes."""
+    index = IngredientIndex.build(["Garlic, Onion", "garlic, onion, beef", "Bread", "beef"])
+    index.similarity = SimilarityIndex.build(index.ingredients, use_numpy=use_numpy)
+    assert index.similar(0) == [(1, 2 / 3)]
+    assert [position for position, _ in index.similar(1, metric="cosine")] == [0, 3]
+
+    index.remove(0)
+    index.add("Beef, Bread")
+    index.update(1, "bread")
+    assert index.similar(3) == [(1, 0.5), (2, 0.5), (0, 0.25)]
+    assert index.similar(1, k=1) == [(3, 0.5)]
+
+def test_timings_are_recorded_only_when_asked_for(tmp_path):
+    """Test that RECIPE_BOOK_TIMINGS reports timed operations at exit, and that timings are off by default."""
+    (tmp_path / "timeduser.csv").write_text("Meal Category,Dish Name,Ingredients,Cooking Directions\n")
+    command = [sys.executable, project.__file__, "--user", "timeduser", "add", "--name", "Soup"]
+    subprocess.run(command, cwd=tmp_path, check=True, capture_output=True,
+                   env=dict(os.environ, RECIPE_BOOK_TIMINGS=str(tmp_path / "timings.txt")))
+    timings = (tmp_path / "timings.txt").read_text()
+    assert "storage.load_user_recipes" in timings and "storage.append_journal" in timings
+    assert project.load_user_recipes.__name__ == "load_user_recipes" and not hasattr(project.load_user_recipes, "__wrapped__")
+
+    histogram = Histogram()
+    for seconds in [0.001] * 99 + [0.5]:
+        histogram.add(seconds)
+    assert 0.001 <= histogram.percentile(0.5) < 0.002 and histogram.percentile(1.0) == 0.5
+    assert statement_key("SELECT * FROM  recipes\n WHERE id = 12 AND name = 'it''s'") == statement_key("SELECT * FROM recipes WHERE id = ? AND name = ?")
+
+def test_query_cache_follows_generations():
+    """Test that cached queries are dropped when a user's generation moves on, and kept through own writes."""
+    cache = QueryCache()
+    cache.put(1, 5, ("count",), 2)
+    cache.put(2, 7, ("count",), 9)
+    assert cache.get(1, 5, ("count",)) == 2 and cache.get(2, 7, ("count",)) == 9
+
+    cache.write_through(1, 5, 6, lambda cache: cache.store(1, ("count",), 3))
+    assert cache.get(1, 6, ("count",)) == 3
+    cache.write_through(1, 5, 8, lambda cache: cache.store(1, ("count",), 4))  # another session wrote generation 7
+    assert cache.get(1, 8, ("count",)) is None
+    cache.put(1, 7, ("count",), 1)  # read before the write that made generation 8
+    assert cache.get(1, 8, ("count",)) is None
+    assert cache.get(1, 9, ("page", 0, 10)) is None and cache.get(2, 7, ("count",)) == 9
+    assert (cache.hits, cache.misses) == (4, 3)
+
+    small = QueryCache(max_bytes=1000)
+    for recipe_id in range(20):
+        small.put(1, 0, ("recipe", recipe_id), (recipe_id, "Soup", "x" * 50))
+        small.get(1, 0, ("recipe", 0))
+    assert small.size <= 1000 and small.evictions
+    assert small.get(1, 0, ("recipe", 0)) is not None and small.get(1, 0, ("recipe", 1)) is None
+
+
+@pytest.fixture
+def sqlite_book(tmp_path):
+    """A SQLite recipe book for user ann in a fresh database"""
+    db_file = str(tmp_path / "recipes.db")
+    db_recipes.User.create("ann", "pw", db_file)
+    return db_recipes.RecipeBook("ann", db_file)
+
+def test_cached_pages_only_gain_recipes_after_them(sqlite_book):
+    """Test that a new recipe is only added to cached pages that start before it."""
+    assert sqlite_book.fetch_page(1000) == [] and sqlite_book.fetch_page(0) == []
+    recipe_id = sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Soup", "Water", "Boil"))
+    assert recipe_id < 1000
+    assert sqlite_book.fetch_page(1000) == []
+    assert [recipe["Recipe ID"] for recipe in sqlite_book.fetch_page(0)] == [recipe_id]
+    assert sqlite_book.count_recipes() == 1
+
+def test_api_rejects_empty_pages(tmp_path):
+    """Test that the JSON API answers limit=0 with a 400 rather than failing."""
+    api = api_server.RecipeApi(str(tmp_path / "recipes.db"))
+    asyncio.run(api.handle("POST", "/register", {}, b'{"username": "ann", "password": "pw"}'))
+    _, session = asyncio.run(api.handle("POST", "/login", {}, b'{"username": "ann", "password": "pw"}'))
+    headers = {"authorization": f"Bearer {session['token']}"}
+    for target in ["/recipes?limit=0", "/search?q=soup&limit=0"]:
+        with pytest.raises(api_server.ApiError) as error:
+            asyncio.run(api.handle("GET", target, headers, b""))
+        assert error.value.status == 400
+    assert asyncio.run(api.handle("GET", "/recipes?limit=1", headers, b"")) == (200, {"recipes": [], "next_after_id": None})
+
+@pytest.fixture
+def snapshot_sources(tmp_path, monkeypatch, sqlite_book):
+    """ann's SQLite book, with a recipe, and a CSV book for bob, as the only sources of snapshots"""
+    monkeypatch.setattr(snapshot, "DB_FILE", sqlite_book.db_file)
+    monkeypatch.setattr(snapshot, "SHARD_DIR", str(tmp_path / "shards"))
+    sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Soup", "Water, Salt", "Boil."))
+    (tmp_path / "users.csv").write_text("bob,pw\n")
+    (tmp_path / "bob.csv").write_text("Category,Name,Ingredients,Directions\nLunch,Toast,Bread,Toast it.\n")
+    return [(str(tmp_path / "users.csv"), str(tmp_path))]
+
+def test_snapshot_round_trip(tmp_path, sqlite_book, snapshot_sources):
+    """Test that a snapshot verifies and restores both a database and a CSV book."""
+    path = snapshot.create_snapshot(str(tmp_path / "snapshots"), snapshot_sources)
+    assert snapshot.verify_snapshot(path) == []
+    assert set(snapshot.read_manifest(path)["files"]) == {"recipes.db", "csv-1/users.csv", "csv-1/bob.csv"}
+    sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Stew", "Beef", "Simmer."))
+    (tmp_path / "bob.csv").write_text("Category,Name,Ingredients,Directions\n")
+    snapshot.restore_snapshot(path)
+    assert [recipe["Dish Name"] for recipe in sqlite_book.fetch_page()] == ["Soup"]
+    assert (tmp_path / "bob.csv").read_text().endswith("Lunch,Toast,Bread,Toast it.\n")
+
+def test_snapshot_links_unchanged_files(tmp_path, snapshot_sources):
+    """Test that a file unchanged since the last snapshot is hard-linked rather than copied."""
+    first = snapshot.create_snapshot(str(tmp_path / "snapshots"), snapshot_sources)
+    (tmp_path / "users.csv").write_text("bob,pw\ncat,pw\n")
+    second = snapshot.create_snapshot(str(tmp_path / "snapshots"), snapshot_sources)
+    files = snapshot.read_manifest(second)["files"]
+    assert not files["csv-1/bob.csv"]["copied"] and files["csv-1/users.csv"]["copied"]
+    assert os.path.samefile(os.path.join(first, "csv-1", "bob.csv"), os.path.join(second, "csv-1", "bob.csv"))
+    assert snapshot.verify_snapshot(second) == []
+
+def test_damaged_snapshot_is_not_restored(tmp_path, snapshot_sources):
+    """Test that a corrupted copy fails verification and restore_snapshot refuses it."""
+    path = snapshot.create_snapshot(str(tmp_path / "snapshots"), snapshot_sources)
+    with open(os.path.join(path, "csv-1", "bob.csv"), "a") as file:
+        file.write("Lunch,Eggs,Eggs,Fry.\n")
+    assert snapshot.verify_snapshot(path) == ["csv-1/bob.csv: checksum does not match"]
+    with pytest.raises(ValueError):
+        snapshot.restore_snapshot(path)
+    assert "Eggs" not in (tmp_path / "bob.csv").read_text()
+
+def test_snapshot_finishes_interrupted_save(tmp_path, snapshot_sources):
+    """Test that a save left half done (its redo file) is completed before the book is copied."""
+    book = tmp_path / "bob.csv"
+    offset, tail = len(book.read_bytes()), b"Lunch,Eggs,Eggs,Fry.\n"
+    with open(redo_file(str(book)), "wb") as file:  # as offset_index.rewrite_tail leaves it if interrupted
+        file.write(offset.to_bytes(8, "little") + len(tail).to_bytes(8, "little") + tail)
+    path = snapshot.create_snapshot(str(tmp_path / "snapshots"), snapshot_sources)
+    assert not os.path.exists(redo_file(str(book)))
+    with open(os.path.join(path, "csv-1", "bob.csv"), "rb") as file:
+        assert file.read().endswith(b"Toast it.\n" + tail)
+
+def test_shard_for_only_moves_users_to_new_shards():
+    """Test that adding a shard only moves users onto it, and leaves everyone else where they were."""
+    before = {f"user{n}": shards.shard_for(f"user{n}", range(4)) for n in range(200)}
+    after = {username: shards.shard_for(username, range(5)) for username in before}
+    moved = [username for username in before if after[username] != before[username]]
+    assert moved and all(after[username] == 4 for username in moved)
+    assert after == {username: shards.shard_for(username, range(5)) for username in before}
+
+@pytest.fixture
+def shard_catalog(tmp_path):
+    """A sharded recipe book of two shards with four users, each with a recipe"""
+    catalog = shards.ShardCatalog(str(tmp_path / "shards"))
+    catalog.resize(2)
+    for username in ["ann", "bob", "cat", "dan"]:
+        catalog.create_user(username, "pw")
+        db_recipes.RecipeBook(username, shards=catalog).insert_recipe(db_recipes.Recipe("Dinner", f"{username}'s soup", "Water", "Boil."))
+    return catalog
+
+def test_rebalance_moves_only_misplaced_users(shard_catalog):
+    """Test that rebalance moves just the users not on the shard they hash to, with their recipes."""
+    shard_catalog.resize(3)
+    misplaced = shard_catalog.misplaced()
+    assert misplaced
+    staying = {username: shard_catalog.shard_of(username) for username in ["ann", "bob", "cat", "dan"]
+               if username not in {row[0] for row in misplaced}}
+    assert shard_catalog.rebalance() == len(misplaced)
+    assert shard_catalog.misplaced() == []
+    assert all(shard_catalog.shard_of(username) == shard for username, shard in staying.items())
+    assert shard_catalog.count_users() == 4 and shard_catalog.count_recipes() == 4
+    for username in ["ann", "bob", "cat", "dan"]:
+        assert [recipe["Dish Name"] for recipe in db_recipes.RecipeBook(username, shards=shard_catalog).fetch_page()] == [f"{username}'s soup"]
+
+def test_sharded_book_follows_a_moved_user(shard_catalog):
+    """Test that a RecipeBook opened before its user moved reads and writes on the new shard."""
+    book = db_recipes.RecipeBook("ann", shards=shard_catalog)
+    source = shard_catalog.shard_of("ann")
+    assert book.fetch_page()  # cached on the old shard
+    assert shard_catalog.move_user("ann", source, 1 - source)
+    assert not shard_catalog.move_user("ann", source, 1 - source)
+    book.insert_recipe(db_recipes.Recipe("Lunch", "Toast", "Bread", "Toast it."))
+    assert book.db_file == shard_catalog.shard_file(1 - source)
+    assert [recipe["Dish Name"] for recipe in book.fetch_page()] == ["ann's soup", "Toast"]
+    assert shard_catalog.count_users() == 4 and shard_catalog.count_recipes() == 5
+
+def test_repair_after_interrupted_move(shard_catalog):
+    """Test that repair drops the copy an interrupted move left behind, or points the catalog at the one that survived."""
+    source = shard_catalog.shard_of("ann")
+    with database.transaction(shard_catalog.shard_file(1 - source)) as conn:  # copied, but the catalog not yet updated
+        conn.execute("INSERT INTO users (username, password) VALUES ('ann', 'pw')")
+    with database.transaction(shard_catalog.catalog_file) as conn:  # and a user the catalog places on the wrong shard
+        conn.execute("UPDATE users SET shard = 1 - shard WHERE username = 'bob'")
+    bob = 1 - shard_catalog.shard_of("bob")
+    shard_catalog.repair()
+    assert shard_catalog.shard_of("ann") == source and shard_catalog.shard_of("bob") == bob
+    assert shard_catalog.count_users() == 4
+    assert db_recipes.RecipeBook("bob", shards=shard_catalog).count_recipes() == 1
+
+def test_move_user_copies_writes_made_during_the_move(shard_catalog, monkeypatch):
+    """Test that a move copies without the source shard's lock, and copies again if the user wrote meanwhile."""
+    book = db_recipes.RecipeBook("ann", shards=shard_catalog)
+    book.insert_recipe(db_recipes.Recipe("Lunch", "Toast", "Bread", "Toast it."))
+    source, copy_user, copies = shard_catalog.shard_of("ann"), shards.copy_user, []
+
+    def copy_then_write(*args):
+        assert not database.get_connection(shard_catalog.shard_file(source)).in_transaction
+        copies.append(copy_user(*args))
+        if len(copies) == 1:  # not waiting for the move's lock
+            book.insert_recipe(db_recipes.Recipe("Lunch", "Eggs", "Eggs", "Fry."))
+        return copies[-1]
+
+    monkeypatch.setattr(shards, "copy_user", copy_then_write)
+    monkeypatch.setattr(shards, "MOVE_CHUNK", 1)
+    assert shard_catalog.move_user("ann", source, 1 - source)
+    assert len(copies) == 2
+    assert [recipe["Dish Name"] for recipe in book.fetch_page()] == ["ann's soup", "Toast", "Eggs"]
+    assert book.db_file == shard_catalog.shard_file(1 - source)
+    assert shard_catalog.count_users() == 4 and shard_catalog.count_recipes() == 6
+
+def test_move_user_gives_up_on_a_user_who_keeps_writing(shard_catalog, monkeypatch):
+    """Test that a move leaves a user who writes during every copy where they are, for the next rebalance."""
+    book = db_recipes.RecipeBook("ann", shards=shard_catalog)
+    source, copy_user = shard_catalog.shard_of("ann"), shards.copy_user
+
+    def copy_then_write(*args):
+        copy_id = copy_user(*args)
+        book.insert_recipe(db_recipes.Recipe("Lunch", "Toast", "Bread", "Toast it."))
+        return copy_id
+
+    monkeypatch.setattr(shards, "copy_user", copy_then_write)
+    assert not shard_catalog.move_user("ann", source, 1 - source)
+    assert shard_catalog.shard_of("ann") == source and book.count_recipes() == 1 + shards.MOVE_ATTEMPTS
+    assert shard_catalog.count_users() == 4 and shard_catalog.count_recipes() == 4 + shards.MOVE_ATTEMPTS
+
+def test_similarity_index_follows_committed_changes(sqlite_book):
+    """Test that edits and deletes reach a built similarity index once they commit."""
+    bread, rolls, eggs = [sqlite_book.insert_recipe(db_recipes.Recipe("Baking", name, ingredients, "Bake."))
+                          for name, ingredients in [("Bread", "Flour, Water"), ("Rolls", "Flour, Water"), ("Eggs", "Eggs")]]
+    assert [recipe["Recipe ID"] for recipe in sqlite_book.similar_recipes(bread)] == [rolls]
+    assert sqlite_book.update_recipe(eggs, ingredients="Flour, Water, Salt") == 1
+    assert [recipe["Recipe ID"] for recipe in sqlite_book.similar_recipes(bread)] == [rolls, eggs]
+    assert sqlite_book.remove_recipe(rolls) == 1 and sqlite_book.remove_recipe(rolls) == 0
+    assert [recipe["Recipe ID"] for recipe in sqlite_book.similar_recipes(bread)] == [eggs]
+
+@pytest.fixture
+def queued_db(tmp_path):
+    """A database with one table, numbers, to queue writes to"""
+    db_file = str(tmp_path / "queue.db")
+    with database.transaction(db_file) as conn:
+        conn.execute("CREATE TABLE numbers (n INTEGER)")
+    return db_file
+
+def insert_number(n):
+    return lambda conn: conn.execute("INSERT INTO numbers VALUES (?)", (n,)).lastrowid
+
+def numbers(db_file):
+    return [row[0] for row in database.get_connection(db_file).execute("SELECT n FROM numbers ORDER BY n")]
+
+def test_write_queue_commits_writes_together(queued_db):
+    """Test that writes queued together are acknowledged by one commit, and a failing one is rolled back alone."""
+    def fail(conn):
+        conn.execute("INSERT INTO numbers VALUES (2)")
+        raise ValueError("no twos")
+
+    queue = write_queue.WriteQueue(queued_db, max_batch=3, max_delay=10)
+    futures = [queue.submit(insert_number(1)), queue.submit(fail), queue.submit(insert_number(3))]
+    assert [futures[0].result(), futures[2].result()] == [1, 2]
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert (queue.commits, queue.writes) == (1, 3)
+    assert numbers(queued_db) == [1, 3]
+    queue.close()
+
+def test_write_queue_flush_and_close_drain_it(queued_db):
+    """Test that flush waits for every write queued before it, and close commits what is left."""
+    queue = write_queue.WriteQueue(queued_db)
+    futures = [queue.submit(insert_number(n)) for n in range(5)]
+    queue.flush(durable=True)
+    assert all(future.done() for future in futures) and numbers(queued_db) == [0, 1, 2, 3, 4]
+    queue = write_queue.WriteQueue(queued_db, max_delay=10)
+    futures = [queue.submit(insert_number(n)) for n in range(5, 8)]
+    queue.close()
+    assert all(future.done() for future in futures) and numbers(queued_db) == list(range(8))
+    with pytest.raises(RuntimeError):
+        queue.submit(insert_number(8))
+
+def test_queued_book_writes_directly_inside_a_transaction(sqlite_book):
+    """Test that a book with a write queue joins a transaction it is already in rather than queueing."""
+    queue = write_queue.WriteQueue(sqlite_book.db_file)
+    book = db_recipes.RecipeBook("ann", sqlite_book.db_file, write_queue=queue)
+    book.insert_recipe(db_recipes.Recipe("Dinner", "Soup", "Water", "Boil."))
+    with pytest.raises(ZeroDivisionError):
+        with database.transaction(sqlite_book.db_file):
+            book.insert_recipe(db_recipes.Recipe("Dinner", "Stew", "Beef", "Simmer."))
+            1 / 0
+    assert queue.writes == 1
+    assert [recipe["Dish Name"] for recipe in book.fetch_page()] == ["Soup"]
+    queue.close()
+
+def test_migrate_upgrades_an_older_database(tmp_path):
+    """Test that migrate() brings a database made by an older version up to date, data included."""
+    db_file = str(tmp_path / "old.db")
+    with database.transaction(db_file) as conn:
+        for step in schema.MIGRATIONS[:2]:
+            step(conn)
+        conn.execute("PRAGMA user_version = 2")
+        conn.execute("INSERT INTO users (username, password) VALUES ('ann', 'pw')")
+        conn.execute("INSERT INTO recipes (user_id, category, name, ingredients, directions) VALUES (1, 'Dinner', 'Garlic Soup', 'Garlic, Water', 'Boil.')")
+    assert schema.migrate(db_file) == len(schema.MIGRATIONS) == schema.schema_version(db_file)
+    book = db_recipes.RecipeBook("ann", db_file)
+    assert [result["Dish Name"] for result in book.search("garlic")] == ["Garlic Soup"]
+    assert [recipe["Dish Name"] for recipe in book.recipes_with_ingredients(["garlic"])] == ["Garlic Soup"]
+    assert schema.migrate(db_file) == len(schema.MIGRATIONS)  # and running it again changes nothing
+
+def test_search_ranks_matches_and_keeps_to_the_user(sqlite_book):
+    """Test that search puts name matches first and never returns another user's recipes."""
+    db_recipes.User.create("bob", "pw", sqlite_book.db_file)
+    db_recipes.RecipeBook("bob", sqlite_book.db_file).insert_recipe(db_recipes.Recipe("Dinner", "Garlic Bread", "Garlic", "Bake."))
+    sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Pasta", "Pasta, Garlic, Oil", "Boil the pasta."))
+    sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Garlic Soup", "Garlic, Water", "Boil."))
+    sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Salad", "Lettuce", "Toss."))
+    results = sqlite_book.search("garlic")
+    assert [result["Dish Name"] for result in results] == ["Garlic Soup", "Pasta"]
+    assert "[Garlic]" in results[0]["Match"]
+    assert [result["Dish Name"] for result in sqlite_book.search("garlic", limit=1, offset=1)] == ["Pasta"]
+    assert sqlite_book.search("") == []
+
+def test_recipes_with_ingredients_matches_whole_ingredients(sqlite_book):
+    """Test that "ingredient 1" does not match "ingredient 10", and every ingredient must be used."""
+    one = sqlite_book.insert_recipe(db_recipes.Recipe("Test", "One", "Ingredient 1, Salt", "Mix."))
+    sqlite_book.insert_recipe(db_recipes.Recipe("Test", "Ten", "Ingredient 10, Salt", "Mix."))
+    assert [recipe["Recipe ID"] for recipe in sqlite_book.recipes_with_ingredients(["ingredient 1"])] == [one]
+    assert [recipe["Dish Name"] for recipe in sqlite_book.recipes_with_ingredients(["Salt", " Ingredient 10 "])] == ["Ten"]
+    assert len(sqlite_book.recipes_with_ingredients(["salt"])) == 2
+    assert sqlite_book.recipes_with_ingredients(["salt", "pepper"]) == []
+
+def test_update_and_remove_count_only_the_users_recipes(sqlite_book):
+    """Test that update_recipe and remove_recipe return how many of this user's recipes they changed."""
+    db_recipes.User.create("bob", "pw", sqlite_book.db_file)
+    bobs = db_recipes.RecipeBook("bob", sqlite_book.db_file).insert_recipe(db_recipes.Recipe("Lunch", "Toast", "Bread", "Toast it."))
+    recipe_id = sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Soup", "Water", "Boil."))
+    assert sqlite_book.update_recipe(recipe_id, name="Stock") == 1
+    assert sqlite_book.get_recipe(recipe_id)["Dish Name"] == "Stock"
+    assert sqlite_book.update_recipe(recipe_id) == 1 and sqlite_book.update_recipe(recipe_id + 100) == 0
+    assert sqlite_book.update_recipe(bobs, name="Mine") == 0 and sqlite_book.remove_recipe(bobs) == 0
+    assert sqlite_book.remove_recipe(recipe_id) == 1 and sqlite_book.remove_recipe(recipe_id) == 0
+    assert sqlite_book.count_recipes() == 0
+
+def test_api_handles_a_session(tmp_path):
+    """Test the JSON API's handlers, without a socket, from registering to deleting a recipe."""
+    api = api_server.RecipeApi(str(tmp_path / "recipes.db"))
+
+    def call(method, target, data=None, headers=None):
+        return asyncio.run(api.handle(method, target, headers or {}, json.dumps(data).encode() if data else b""))
+
+    assert call("POST", "/register", {"username": "Ann", "password": "pw"}) == (201, {"username": "ann"})
+    for data, status in [({"username": "ann", "password": "pw"}, 409), ({"username": "ann"}, 400)]:
+        with pytest.raises(api_server.ApiError) as error:
+            call("POST", "/register", data)
+        assert error.value.status == status
+    with pytest.raises(api_server.ApiError) as error:
+        call("POST", "/login", {"username": "ann", "password": "wrong"})
+    assert error.value.status == 401
+    headers = {"authorization": "Bearer " + call("POST", "/login", {"username": "ann", "password": "pw"})[1]["token"]}
+
+    recipe = {"Meal Category": "Dinner", "Dish Name": "Garlic Soup", "Ingredients": "Garlic, Water", "Cooking Directions": "Boil."}
+    status, created = call("POST", "/recipes", recipe, headers)
+    assert status == 201 and created == {"Recipe ID": created["Recipe ID"], **recipe}
+    recipe_id = created["Recipe ID"]
+    call("POST", "/recipes", {**recipe, "Dish Name": "Stew"}, headers)
+    assert call("GET", "/recipes?limit=1", headers=headers)[1]["next_after_id"] == recipe_id
+    assert call("GET", f"/recipes/{recipe_id}", headers=headers)[1]["Dish Name"] == "Garlic Soup"
+    assert call("PATCH", f"/recipes/{recipe_id}", {"Dish Name": "Soup"}, headers)[1]["Dish Name"] == "Soup"
+    assert [result["Dish Name"] for result in call("GET", "/search?q=garlic", headers=headers)[1]["results"]] == ["Soup", "Stew"]
+    assert call("DELETE", f"/recipes/{recipe_id}", headers=headers) == (204, None)
+    for method, target, status in [("GET", f"/recipes/{recipe_id}", 404), ("GET", "/recipes/x", 404), ("PUT", "/recipes/1", 405),
+                                   ("GET", "/nowhere", 404), ("GET", "/recipes?after_id=x", 400)]:
+        with pytest.raises(api_server.ApiError) as error:
+            call(method, target, headers=headers)
+        assert error.value.status == status
+    assert call("POST", "/logout", headers=headers) == (204, None)
+    with pytest.raises(api_server.ApiError) as error:
+        call("GET", "/recipes", headers=headers)
+    assert error.value.status == 401
+
+def test_import_into_book_without_final_newline(tmp_path, monkeypatch):
+    """Test that imported recipes start on a new line when the book's last line has no newline."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "nonewline.csv").write_bytes(b'Meal Category,Dish Name,Ingredients,Cooking Directions\r\nDessert,Sorbet,Lemon,"Serve chilled."')
+    (tmp_path / "import.jsonl").write_text('{"Meal Category": "Lunch", "Dish Name": "Toast", "Ingredients": "Bread", "Cooking Directions": "Toast"}\n')
+
+    assert import_recipes("nonewline", "import.jsonl") == 1
+    recipes = load_user_recipes("nonewline")
+    assert [r["Dish Name"] for r in recipes] == ["Sorbet", "Toast"]
+    assert recipes[0]["Cooking Directions"] == "Serve chilled." and None not in recipes[1]
+
+def test_sharded_book_searches_a_moved_user(shard_catalog):
+    """Test that the uncached reads of a book opened before its user moved follow the user too."""
+    reads = {"search": lambda book: [result["Dish Name"] for result in book.search("soup")],
+             "recipes_with_ingredients": lambda book: [recipe["Dish Name"] for recipe in book.recipes_with_ingredients(["water"])],
+             "top_ingredients": lambda book: book.top_ingredients(),
+             "iter_recipes": lambda book: [recipe["Dish Name"] for recipe in book.iter_recipes()]}
+    expected = {name: read(db_recipes.RecipeBook("ann", shards=shard_catalog)) for name, read in reads.items()}
+    for name, read in reads.items():
+        book = db_recipes.RecipeBook("ann", shards=shard_catalog)
+        source = shard_catalog.shard_of("ann")
+        assert shard_catalog.move_user("ann", source, 1 - source)
+        assert read(book) == expected[name] and expected[name]
+        assert book.db_file == shard_catalog.shard_file(1 - source)
+
+def test_migrate_skips_steps_another_process_applied(tmp_path, monkeypatch):
+    """Test that migrate() checks the version again under the write lock, so a process that read it
+    before another one migrated does not run the same steps again."""
+    db_file = str(tmp_path / "recipes.db")
+    schema.migrate(db_file)
+    monkeypatch.setattr(schema, "schema_version", lambda db_file=None: 0)  # read before the other process finished
+    assert schema.migrate(db_file) == len(schema.MIGRATIONS)
+    columns = [column[1] for column in database.get_connection(db_file).execute("PRAGMA table_info(users)")]
+    assert columns.count("generation") == 1
+
+class NumbersBook:
+    """A batch book that adds each recipe's name to a numbers table, failing half way through for "bad" ones"""
+
+    def __init__(self, db_file, flush_error=None):
+        self.db_file, self.flush_error = db_file, flush_error
+
+    def add(self, recipe):
+        database.get_connection(self.db_file).execute("INSERT INTO numbers VALUES (?)", (len(recipe["Dish Name"]),))
+        if recipe["Dish Name"] == "bad":
+            raise ValueError("bad recipe")
+        return recipe["Dish Name"]
+
+    def flush(self):
+        if self.flush_error:
+            raise self.flush_error
+
+    def recover(self, error):
+        pass
+
+def test_batch_group_rolls_back_a_failed_command_alone(queued_db):
+    """Test that a command failing part way through a group leaves none of its writes behind."""
+    commands = [{"command": "add", "recipe": {"Dish Name": name}} for name in ["a", "bad", "abcd"]]
+    out = io.StringIO()
+    failures = run_jsonl(lambda username: NumbersBook(queued_db), "ann", [json.dumps(c) for c in commands], out,
+                         group=lambda: database.transaction(queued_db))
+    assert failures == 1 and [json.loads(line)["ok"] for line in out.getvalue().splitlines()] == [True, False, True]
+    assert numbers(queued_db) == [1, 4]
+
+def test_batch_reports_changes_that_failed_to_save(queued_db):
+    """Test that a book failing to save reports its changes as failed rather than ok."""
+    commands = [{"command": "add", "recipe": {"Dish Name": "a"}}, {"command": "nothing"}]
+    out = io.StringIO()
+    failures = run_jsonl(lambda username: NumbersBook(queued_db, StaleBookError("changed on disk")), "ann",
+                         [json.dumps(c) for c in commands], out)
+    replies = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert failures == 2 and replies[0] == {"ok": False, "error": "StaleBookError: changed on disk"}
+
+def test_batch_command_reports_missing_files(tmp_path, monkeypatch, capsys):
+    """Test that a single batch command reports a missing import file instead of failing with a traceback."""
+    monkeypatch.chdir(tmp_path)
+    save_user_recipes("batchuser", [])
+    parser = argparse.ArgumentParser()
+    add_batch_commands(parser)
+    assert run_batch(parser.parse_args(["--user", "batchuser", "import", str(tmp_path / "missing.csv")]), project.BatchBook) == 1
+    assert capsys.readouterr().err.startswith("FileNotFoundError: [Errno 2] No such file or directory")
+
+def test_recipe_store_requires_every_method():
+    """Test that a recipe book missing part of the storage protocol cannot be created."""
+    class HalfBook(storage.RecipeStore):
+        def iter_recipes(self):
+            return iter([])
+
+    with pytest.raises(TypeError, match="count_recipes"):
+        HalfBook()
+    assert not db_recipes.RecipeBook.__abstractmethods__
+
+def test_csv_book_refuses_malformed_rows(tmp_path, monkeypatch):
+    """Test that oop_project refuses a book with a row that isn't four fields, instead of dropping it."""
+    monkeypatch.setattr(oop_project, "RECIPES_DIR", str(tmp_path))
+    (tmp_path / "tidy.csv").write_text("Meal Category,Dish Name,Ingredients,Cooking Directions\r\nLunch,Toast,Bread,Toast it.\r\n\r\n")
+    assert [recipe.name for recipe in oop_project.RecipeBook("tidy").recipes] == ["Toast"]
+    (tmp_path / "messy.csv").write_text("Meal Category,Dish Name,Ingredients,Cooking Directions\r\nLunch,Toast,Bread,Toast it.\r\nLunch,Eggs,Eggs,Fry,Serve\r\n")
+    with pytest.raises(ValueError, match="line 3"):
+        oop_project.RecipeBook("messy")
+    assert "Eggs,Fry,Serve" in (tmp_path / "messy.csv").read_text()
+
+def test_file_lock_is_per_thread(tmp_path):
+    """Test that another thread waits for a lock this one holds, and that a shared lock is never silently upgraded."""
+    lock = str(tmp_path / "user.lock")
+    taken = threading.Event()
+
+    def take_lock():
+        with file_lock(lock):
+            taken.set()
+
+    with file_lock(lock):
+        with file_lock(lock, shared=True):  # joins the exclusive lock
+            thread = threading.Thread(target=take_lock)
+            thread.start()
+            assert not taken.wait(0.2)
+    thread.join(5)
+    assert taken.is_set()
+    with file_lock(lock, shared=True):
+        with pytest.raises(RuntimeError):
+            with file_lock(lock):
+                pass
+
+def test_jump_past_a_shrunken_book_shows_its_last_page(sqlite_book, monkeypatch, capsys):
+    """Test that jumping to a page that recipes deleted elsewhere have emptied shows the last page instead."""
+    ids = [sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", f"Dish {n}", "Water", "Boil.")) for n in range(25)]
+    answers = iter(["j", "3", "q"])
+
+    def answer(prompt=""):
+        if prompt.startswith("Page number"):  # another session deletes ten recipes meanwhile
+            for recipe_id in ids[:10]:
+                db_recipes.RecipeBook("ann", sqlite_book.db_file).remove_recipe(recipe_id)
+        return next(answers)
+
+    monkeypatch.setattr("builtins.input", answer)
+    sqlite_book.view_recipes()
+    last_page = capsys.readouterr().out.split("Page 1 of 3")[-1]
+    assert "Dish 24" in last_page and "Dish 19" not in last_page
+
+def test_api_hides_unexpected_errors_from_clients(capsys):
+    """Test that a failing handler gets a bare 500 while its traceback goes to the server's stderr."""
+    class FailingApi:
+        async def handle(self, method, target, headers, body):
+            raise RuntimeError("disk full at /srv/recipes.db")
+
+    class Writer:
+        sent = b""
+
+        def write(self, data):
+            self.sent += data
+
+        async def drain(self):
+            pass
+
+        def close(self):
+            pass
+
+    async def request():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"GET /recipes HTTP/1.1\r\nConnection: close\r\n\r\n")
+        reader.feed_eof()
+        await api_server.serve_connection(FailingApi(), reader, writer)
+
+    writer = Writer()
+    asyncio.run(request())
+    assert writer.sent.startswith(b"HTTP/1.1 500 ")
+    assert writer.sent.endswith(b'{"error": "Internal Server Error"}')
+    assert "RuntimeError: disk full at /srv/recipes.db" in capsys.readouterr().err
+
+def test_search_index_follows_edits_and_deletes(sqlite_book):
+    """Test that the search index sees edits and deletes through its triggers, and matches word prefixes."""
+    recipe_id = sqlite_book.insert_recipe(db_recipes.Recipe("Dinner", "Garlic Soup", "Garlic, Water", "Simmer gently."))
+    assert [result["Recipe ID"] for result in sqlite_book.search("garl simm")] == [recipe_id]
+    assert sqlite_book.search('gar"lic) OR (') == []  # quotes and operators are words, not query syntax
+    sqlite_book.update_recipe(recipe_id, name="Onion Soup", ingredients="Onion, Water")
+    assert sqlite_book.search("garlic") == []
+    assert [result["Dish Name"] for result in sqlite_book.search("onion")] == ["Onion Soup"]
+    db_recipes.User.create("bob", "pw", sqlite_book.db_file)
+    assert db_recipes.RecipeBook("bob", sqlite_book.db_file).search("onion") == []
+    sqlite_book.remove_recipe(recipe_id)
+    assert sqlite_book.search("onion") == [] and sqlite_book.search("soup") == []